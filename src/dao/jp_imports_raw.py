@@ -19,6 +19,7 @@ class JPTradeData(SQLModel, table=True):
     qty_1: Optional[int] = Field(default=0)
     unit2_id: int | None = Field(default=None, foreign_key="unittable.id")
     qty_2: Optional[int] = Field(default=0)
+    qty: Optional[float] = Field(default=0)
 
 class IntTradeData(SQLModel, table=True):
     id: int = Field(primary_key=True)
@@ -31,6 +32,7 @@ class IntTradeData(SQLModel, table=True):
     qty_1: Optional[int] = Field(default=0, sa_column=Column(BigInteger))
     unit2_id: Optional[int] = Field(default=None, foreign_key="unittable.id")
     qty_2: Optional[int] = Field(default=0, sa_column=Column(BigInteger))
+    qty: Optional[float] = Field(default=0)
 
 class CountryTable(SQLModel, table=True):
     id: int = Field(primary_key=True)
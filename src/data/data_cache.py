@@ -0,0 +1,210 @@
+from collections import OrderedDict
+from typing import Hashable
+import polars as pl
+import threading
+import hashlib
+import os
+
+
+class ResultCache:
+    """
+    Least recently used cache of result frames bounded by their estimated size in
+    memory. Safe to share between threads.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024**2):
+        """
+        Initialize the ResultCache class.
+
+        Parameters
+        ----------
+        max_bytes: int
+            Maximum estimated size of the cached frames. Frames larger than max_bytes
+            are not cached and 0 disables the cache.
+
+        Returns
+        -------
+        None
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> pl.DataFrame | None:
+        """
+        Returns the frame cached under key, or None, and marks it as recently used.
+        """
+        with self.lock:
+            df = self.entries.get(key)
+            if df is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return df.clone()
+
+    def put(self, key: Hashable, df: pl.DataFrame) -> None:
+        """
+        Caches df under key, evicting the least recently used frames to stay under
+            max_bytes.
+        """
+        if self.max_bytes == 0:
+            return
+        size = df.estimated_size()
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key).estimated_size()
+            self.entries[key] = df.clone()
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.estimated_size()
+                self.evictions += 1
+
+    def invalidate(self) -> None:
+        """
+        Drops every cached frame. The counters are kept.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the hit, miss and eviction counters and the current size of the cache.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
+
+
+class DiskCache:
+    """
+    Cache of result frames stored as zstd Parquet files in a directory shared by
+    several processes. Files are written atomically and the least recently used files
+    are removed once the directory grows over max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024**3):
+        """
+        Initialize the DiskCache class.
+
+        Parameters
+        ----------
+        directory: str
+            Directory of the cached files.
+        max_bytes: int
+            Maximum size of the cached files on disk, 0 disables the cache.
+
+        Returns
+        -------
+        None
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key: Hashable) -> str:
+        """
+        Returns the file of key, named after the hash of its representation.
+        """
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.parquet")
+
+    def get(self, key: Hashable) -> pl.DataFrame | None:
+        """
+        Returns the frame cached under key, or None, and marks it as recently used.
+        """
+        file = self.path(key)
+        try:
+            df = pl.read_parquet(file)
+            os.utime(file)
+        except (FileNotFoundError, pl.exceptions.ComputeError):
+            # Missing, or removed by another process while being read
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return df
+
+    def put(self, key: Hashable, df: pl.DataFrame) -> None:
+        """
+        Writes df under key through a temporary file renamed in place, so readers
+            never see a partial file, and evicts the least recently used files.
+        """
+        if self.max_bytes == 0:
+            return
+        file = self.path(key)
+        temp = f"{file}.{os.getpid()}-{threading.get_ident()}.tmp"
+        df.write_parquet(temp, compression="zstd")
+        os.replace(temp, file)
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used files until the cache fits in max_bytes.
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".parquet"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, file in sorted(files):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+            with self.lock:
+                self.evictions += 1
+
+    def invalidate(self) -> None:
+        """
+        Removes every cached file. The counters are kept.
+        """
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".parquet"):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        """
+        Returns the hit, miss and eviction counters and the current size of the cache.
+        """
+        files = [
+            entry.stat().st_size
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(".parquet")
+        ]
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(files),
+                "bytes": sum(files),
+            }
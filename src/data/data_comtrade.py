@@ -0,0 +1,235 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, NamedTuple
+import polars as pl
+import threading
+import logging
+import queue
+import time
+
+
+class ComtradeQuery(NamedTuple):
+    """
+    A single Comtrade request. cmd_code, flow_code and partner_codes may hold several
+    comma separated codes, which is how the fetcher batches and splits requests.
+    """
+
+    period: str
+    cmd_code: str
+    flow_code: str
+    partner_codes: tuple
+
+
+class RateLimiter:
+    """
+    Spaces out calls shared by several threads so that at most rate calls start per second.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ComtradeFetcher:
+    """
+    Runs Comtrade requests concurrently under a rate limit, retrying failed requests
+    with exponential backoff. A response that hits the max_records cap was truncated
+    by the API, so the request is split (by partner, then flow, then HS level) until
+    every slice comes back complete.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[..., pl.DataFrame],
+        children: Callable[[str], list] | None = None,
+        max_records: int = 500,
+        max_workers: int = 4,
+        rate_limit: float = 1.0,
+        retries: int = 3,
+        backoff: float = 1.0,
+    ):
+        """
+        Initialize the ComtradeFetcher class.
+
+        Parameters
+        ----------
+        fetch: Callable[..., pl.DataFrame]
+            Function called as fetch(iso=..., trade_id=..., date=..., code=..., max_records=...)
+            that returns the rows of a request (e.g. DataPull.pull_comtrade or a local stub).
+        children: Callable[[str], list] | None
+            Returns the HS codes one level below a code (e.g. "01" -> ["0101", "0102"]).
+            Requests are not split by HS level if None.
+        max_records: int
+            Maximum number of rows the API returns for a request.
+        max_workers: int
+            Number of requests running at the same time.
+        rate_limit: float
+            Maximum number of requests started per second.
+        retries: int
+            Number of retries of a failed request.
+        backoff: float
+            Seconds to wait before the first retry, doubled after each retry.
+
+        Returns
+        -------
+        None
+        """
+        self.fetch = fetch
+        self.children = children
+        self.max_records = max_records
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(rate_limit)
+        self.retries = retries
+        self.backoff = backoff
+
+    def run(
+        self, queries: Iterable[ComtradeQuery]
+    ) -> Iterator[tuple[ComtradeQuery, pl.DataFrame, str]]:
+        """
+        Runs the queries and yields (query, rows, status) once every slice of a query is
+        complete. status is "ok", "empty", "truncated" (the cap was hit and the query
+        could not be split further) or "error" (the retries were exhausted).
+
+        Parameters
+        ----------
+        queries: Iterable[ComtradeQuery]
+            The queries to run.
+
+        Returns
+        -------
+        Iterator[tuple[ComtradeQuery, pl.DataFrame, str]]
+        """
+        frames = {}
+        statuses = {}
+        outstanding = {}
+        completed = queue.Queue()
+        queries = iter(queries)
+        in_flight = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+
+            def submit(root: ComtradeQuery, query: ComtradeQuery) -> None:
+                future = executor.submit(self.fetch_query, query)
+                future.add_done_callback(lambda f: completed.put((root, query, f)))
+
+            while True:
+                # Keep a bounded number of requests queued so queries are consumed lazily
+                while in_flight < 2 * self.max_workers:
+                    root = next(queries, None)
+                    if root is None:
+                        break
+                    frames[root], statuses[root], outstanding[root] = [], set(), 1
+                    submit(root, root)
+                    in_flight += 1
+                if in_flight == 0:
+                    break
+
+                root, query, future = completed.get()
+                in_flight -= 1
+                df, status = future.result()
+                slices = self.split(query) if status == "capped" else []
+                if slices:
+                    outstanding[root] += len(slices) - 1
+                    for piece in slices:
+                        submit(root, piece)
+                    in_flight += len(slices)
+                    continue
+
+                if status == "capped":
+                    logging.critical(
+                        f"{query} returned {self.max_records} rows and can not be split further"
+                    )
+                    status = "truncated"
+                if not df.is_empty():
+                    frames[root].append(df)
+                statuses[root].add(status)
+                outstanding[root] -= 1
+                if outstanding[root] == 0:
+                    yield self._finish(root, frames, statuses, outstanding)
+
+    def fetch_query(self, query: ComtradeQuery) -> tuple[pl.DataFrame, str]:
+        """
+        Fetches a single query with retries. Returns the rows and "ok", "empty",
+            "capped" or "error".
+        """
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                df = self.fetch(
+                    iso=",".join(query.partner_codes),
+                    trade_id=query.flow_code,
+                    date=query.period,
+                    code=query.cmd_code,
+                    max_records=self.max_records,
+                )
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    logging.error(f"{query} failed after {attempt + 1} attempts: {e}")
+                    return pl.DataFrame(), "error"
+                logging.warning(f"{query} failed ({e}), retrying")
+                time.sleep(self.backoff * 2**attempt)
+
+        if df.is_empty():
+            return df, "empty"
+        if len(df) >= self.max_records:
+            return df, "capped"
+        return df, "ok"
+
+    def split(self, query: ComtradeQuery) -> list:
+        """
+        Splits a query that hit the cap into smaller queries covering the same rows:
+            first by partner, then by flow, then by HS code (halving code lists and
+            expanding a single code to the codes one HS level below).
+        """
+        partners = query.partner_codes
+        if len(partners) > 1:
+            half = len(partners) // 2
+            return [
+                query._replace(partner_codes=partners[:half]),
+                query._replace(partner_codes=partners[half:]),
+            ]
+
+        flows = query.flow_code.split(",")
+        if len(flows) > 1:
+            return [query._replace(flow_code=flow) for flow in flows]
+
+        codes = query.cmd_code.split(",")
+        if len(codes) == 1 and self.children is not None:
+            codes = self.children(codes[0])
+            if len(codes) == 1:
+                return [query._replace(cmd_code=codes[0])]
+        if len(codes) > 1:
+            half = len(codes) // 2
+            return [
+                query._replace(cmd_code=",".join(codes[:half])),
+                query._replace(cmd_code=",".join(codes[half:])),
+            ]
+        return []
+
+    def _finish(
+        self, root: ComtradeQuery, frames: dict, statuses: dict, outstanding: dict
+    ) -> tuple[ComtradeQuery, pl.DataFrame, str]:
+        root_frames = frames.pop(root)
+        root_statuses = statuses.pop(root)
+        outstanding.pop(root)
+        # A partially failed query is retried as a whole, so its rows are dropped
+        if "error" in root_statuses:
+            return root, pl.DataFrame(), "error"
+        df = (
+            pl.concat(root_frames, how="diagonal_relaxed")
+            if root_frames
+            else pl.DataFrame()
+        )
+        for status in ("truncated", "ok"):
+            if status in root_statuses:
+                return root, df, status
+        return root, df, "empty"
@@ -0,0 +1,266 @@
+from tqdm import tqdm
+import requests
+import logging
+import hashlib
+import base64
+import json
+import os
+
+
+class PartialFileError(Exception):
+    """
+    A partial download does not match the remote file. The partial file is deleted,
+        so the next attempt downloads the file from scratch.
+    """
+
+
+class DataDownload:
+    """
+    Conditional and resumable downloads of remote files.
+
+    Every downloaded file gets a metadata file next to it (``<filename>.meta.json``)
+    holding the ETag, Last-Modified, size and sha256 of the file. The metadata is used
+    to send conditional requests so unchanged files are skipped, and to resume partial
+    downloads (``<filename>.part``) with HTTP Range requests.
+    """
+
+    def __init__(
+        self,
+        session: requests.Session | None = None,
+        chunk_size: int = 10 * 1024 * 1024,
+        retries: int = 3,
+    ):
+        """
+        Initialize the DataDownload class.
+
+        Parameters
+        ----------
+        session: requests.Session | None
+            Session used for the requests. A new session is created if None.
+        chunk_size: int
+            Size in bytes of the chunks written to disk.
+        retries: int
+            Number of times a dropped download is resumed, or a mismatched partial
+            file restarted, before giving up.
+
+        Returns
+        -------
+        None
+        """
+        self.session = session if session is not None else requests.Session()
+        self.chunk_size = chunk_size
+        self.retries = retries
+
+    def download(
+        self, url: str, filename: str, verify: bool = True, force: bool = False
+    ) -> bool:
+        """
+        Downloads the url to filename unless the remote file has not changed.
+
+        Parameters
+        ----------
+        url: str
+            The URL to pull the file from.
+        filename: str
+            The filename to save the file to.
+        verify: bool
+            If True, verifies the SSL certificate. If False, does not verify the SSL certificate.
+        force: bool
+            If True, ignores the stored metadata and downloads the whole file again.
+
+        Returns
+        -------
+        bool
+            True if filename was (re)written, False if the local file was up to date.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self._download(url, filename, verify, force)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                PartialFileError,
+            ) as e:
+                if attempt == self.retries:
+                    raise
+                logging.warning(f"Download of {url} interrupted ({e}), retrying")
+
+    def _download(self, url: str, filename: str, verify: bool, force: bool) -> bool:
+        meta_file = filename + ".meta.json"
+        part_file = filename + ".part"
+        meta = {} if force else self.read_meta(meta_file)
+
+        headers = {}
+        complete = meta.get("complete", {})
+        if complete.get("url") == url and self._is_valid(filename, complete):
+            if complete.get("etag"):
+                headers["If-None-Match"] = complete["etag"]
+            if complete.get("last_modified"):
+                headers["If-Modified-Since"] = complete["last_modified"]
+
+        offset = 0
+        partial = meta.get("partial", {})
+        if os.path.exists(part_file) and partial.get("url") == url:
+            validator = partial.get("etag") or partial.get("last_modified")
+            if validator:
+                offset = os.path.getsize(part_file)
+                headers["Range"] = f"bytes={offset}-"
+                headers["If-Range"] = validator
+
+        with self.session.get(
+            url, headers=headers, stream=True, verify=verify
+        ) as response:
+            if response.status_code == 304:
+                logging.info(f"{filename} is up to date, skipping download")
+                return False
+            if response.status_code == 416 and offset > 0:
+                # The partial file already holds every byte, e.g. the process
+                # stopped before renaming it
+                sha256 = hashlib.sha256()
+                self._hash_file(part_file, sha256)
+                if self._is_complete(response, part_file, partial, sha256):
+                    return self._promote(url, filename, meta, sha256)
+                os.remove(part_file)
+                meta.pop("partial")
+                self.write_meta(meta_file, meta)
+                raise PartialFileError(f"{part_file} does not match {url}")
+            response.raise_for_status()
+
+            if response.status_code == 206 and self._range_start(response) == offset:
+                mode = "ab"
+            else:
+                offset = 0
+                mode = "wb"
+
+            size = self._total_size(response, offset)
+            digest = self._server_digest(response)
+            meta["partial"] = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "size": size,
+                "sha256": digest.hex() if digest is not None else None,
+            }
+            self.write_meta(meta_file, meta)
+
+            sha256 = hashlib.sha256()
+            if mode == "ab":
+                self._hash_file(part_file, sha256)
+                logging.info(f"Resuming download of {url} at byte {offset}")
+
+            with tqdm(
+                total=size,
+                initial=offset,
+                unit="B",
+                unit_scale=True,
+                unit_divisor=1024,
+                desc="Downloading",
+            ) as bar:
+                with open(part_file, mode) as file:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        if chunk:
+                            file.write(chunk)
+                            sha256.update(chunk)
+                            bar.update(len(chunk))
+
+            self._verify(response, part_file, size, sha256)
+
+        return self._promote(url, filename, meta, sha256)
+
+    def _promote(self, url: str, filename: str, meta: dict, sha256) -> bool:
+        """
+        Renames the verified partial file to filename and records it as complete.
+        """
+        os.replace(filename + ".part", filename)
+        meta = {
+            "complete": {
+                **meta["partial"],
+                "size": os.path.getsize(filename),
+                "sha256": sha256.hexdigest(),
+            }
+        }
+        self.write_meta(filename + ".meta.json", meta)
+        logging.info(f"Downloaded {url} to {filename}")
+        return True
+
+    def _is_complete(
+        self, response: requests.Response, part_file: str, partial: dict, sha256
+    ) -> bool:
+        """
+        Checks a partial file the server reports as already complete (416) against
+            the size and sha-256 digest stored when its download started and the
+            size in the Content-Range of the response.
+        """
+        size = partial.get("size")
+        content_range = response.headers.get("Content-Range", "")
+        if content_range.startswith("bytes */") and content_range[8:].isdigit():
+            if size is not None and size != int(content_range[8:]):
+                return False
+            size = int(content_range[8:])
+        if size is None or os.path.getsize(part_file) != size:
+            return False
+        digest = partial.get("sha256")
+        return digest is None or digest == sha256.hexdigest()
+
+    def _verify(
+        self, response: requests.Response, part_file: str, size: int | None, sha256
+    ) -> None:
+        """
+        Checks the size and, when the server sends one, the sha-256 digest of the
+            downloaded file. The partial file is removed if the check fails.
+        """
+        error = None
+        if size is not None and os.path.getsize(part_file) != size:
+            error = f"expected {size} bytes, got {os.path.getsize(part_file)}"
+        expected = self._server_digest(response)
+        if error is None and expected is not None and expected != sha256.digest():
+            error = "sha-256 digest does not match the server digest"
+        if error is not None:
+            os.remove(part_file)
+            raise ValueError(f"Download of {response.url} failed: {error}")
+
+    def _is_valid(self, filename: str, complete: dict) -> bool:
+        return os.path.exists(filename) and os.path.getsize(filename) == complete.get(
+            "size"
+        )
+
+    def _range_start(self, response: requests.Response) -> int | None:
+        content_range = response.headers.get("Content-Range", "")
+        if not content_range.startswith("bytes "):
+            return None
+        return int(content_range[6:].split("-")[0])
+
+    def _total_size(self, response: requests.Response, offset: int) -> int | None:
+        content_range = response.headers.get("Content-Range", "")
+        if response.status_code == 206 and "/" in content_range:
+            total = content_range.split("/")[-1]
+            return int(total) if total != "*" else None
+        if "Content-Length" in response.headers and not response.headers.get(
+            "Content-Encoding"
+        ):
+            return offset + int(response.headers["Content-Length"])
+        return None
+
+    def _server_digest(self, response: requests.Response) -> bytes | None:
+        for header in ("Repr-Digest", "Digest"):
+            for item in response.headers.get(header, "").split(","):
+                algorithm, _, value = item.strip().partition("=")
+                if algorithm.lower() == "sha-256" and value:
+                    return base64.b64decode(value.strip(":"))
+        return None
+
+    def _hash_file(self, filename: str, sha256) -> None:
+        with open(filename, "rb") as file:
+            for chunk in iter(lambda: file.read(self.chunk_size), b""):
+                sha256.update(chunk)
+
+    def read_meta(self, meta_file: str) -> dict:
+        if not os.path.exists(meta_file):
+            return {}
+        with open(meta_file) as file:
+            return json.load(file)
+
+    def write_meta(self, meta_file: str, meta: dict) -> None:
+        with open(meta_file + ".tmp", "w") as file:
+            json.dump(meta, file)
+        os.replace(meta_file + ".tmp", meta_file)
@@ -1,7 +1,71 @@
+from ..models import (
+    init_calendar_table,
+    init_cube_months_table,
+    init_price_months_table,
+    init_price_table,
+    init_trade_cube_table,
+)
+from .data_cache import DiskCache, ResultCache
 from .data_pull import DataPull
+from . import data_cache, data_pull
+from .. import models
 import polars as pl
+import duckdb
+import bisect
+import hashlib
+import logging
 import os
 
+# Dimension of every level: the fact key, the dimension table and its code column
+LEVELS = {
+    "hts": ("hts_id", "htstable", "hts_code"),
+    "naics": ("naics_id", "naicstable", "naics_code"),
+    "country": ("country_id", "countrytable", "country_name"),
+}
+
+# Fact table of every source of process_batch
+SOURCES = {"jp": "jptradedata", "org": "inttradedata"}
+
+# Time keys every time frame is grouped by
+TIME_FRAMES = {
+    "yearly": ["year"],
+    "fiscal": ["fiscal_year"],
+    "qrt": ["year", "qrt"],
+    "fiscal_qrt": ["fiscal_year", "fiscal_qrt"],
+    "monthly": ["year", "month"],
+}
+
+# Version of the cube contents, bumped when the way the cube is built changes so
+# every month is rebuilt
+CUBE_VERSION = 2
+
+# Version of the price statistics, bumped when the way they are computed changes so
+# every month is recomputed
+PRICE_VERSION = 1
+
+# Months after a changed month whose price statistics read it: the moving window,
+# the previous month and the same months of the next year
+PRICE_HORIZON = 15
+
+
+def code_version(*files: str) -> str:
+    """
+    Hashes the source files the results depend on.
+    """
+    digest = hashlib.sha256()
+    for file in files:
+        with open(file, "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()[:16]
+
+
+# Version of the code the results depend on (loading, schema, processing and cache
+# encoding), part of the disk cache keys so results computed by an older version are
+# never read back
+CODE_VERSION = code_version(
+    __file__, data_pull.__file__, data_cache.__file__, models.__file__
+)
+
 
 class DataTrade(DataPull):
     """
@@ -13,6 +77,11 @@ class DataTrade(DataPull):
         saving_dir: str = "data/",
         database_file: str = "data.ddb",
         log_file: str = "data_process.log",
+        backend: str = "duckdb",
+        cache_bytes: int = 256 * 1024**2,
+        disk_cache_bytes: int = 1024**3,
+        memory_limit: int = 0,
+        spill_dir: str = "",
     ):
         """
         Initialize the DataProcess class.
@@ -23,15 +92,37 @@ class DataTrade(DataPull):
             Directory to save the data.
         debug: bool
             Will print debug information in the console if True.
+        backend: str
+            "duckdb" to store the trade data in the database file or "lake" to store
+            it as Hive-partitioned Parquet files under processed/.
+        cache_bytes: int
+            Memory budget of the cache of processed results, 0 disables it.
+        disk_cache_bytes: int
+            Size budget of the cache of processed results in processed/cache/, shared
+            by every process using the same saving_dir. 0 disables it.
+        memory_limit: int
+            Memory budget in bytes. When set, DuckDB keeps under it and spills to
+            spill_dir, the results are summed inside DuckDB and ingest loads the
+            changed months in batches sized to the budget, so data larger than memory
+            can be processed. 0 keeps the defaults.
+        spill_dir: str
+            Directory the data spills to, processed/spill/ by default.
 
         Returns
         -------
         None
         """
-        super().__init__(saving_dir, database_file, log_file)
+        super().__init__(
+            saving_dir, database_file, log_file, backend, memory_limit, spill_dir
+        )
         self.jp_data = os.path.join(self.saving_dir, "raw/jp_data.parquet")
         self.org_data = os.path.join(self.saving_dir, "raw/org_data.parquet")
         self.agr_file = os.path.join(self.saving_dir, "external/code_agr.json")
+        self._code_index = {}
+        self.cache = ResultCache(cache_bytes)
+        self.disk_cache = DiskCache(
+            os.path.join(self.lake_dir, "cache"), disk_cache_bytes
+        )
 
     def process_int_jp(
         self,
@@ -41,7 +132,8 @@ class DataTrade(DataPull):
         agriculture_filter: bool = False,
         group: bool = False,
         level_filter: str = "",
-    ) -> pl.DataFrame:
+        lazy: bool = False,
+    ) -> pl.DataFrame | pl.LazyFrame:
         """
         Process the data for Puerto Rico Statistics Institute provided to JP.
 
@@ -55,6 +147,8 @@ class DataTrade(DataPull):
             Group the data by the classification. (Not implemented yet)
         level_filter:
             search and filter for the data for the given level
+        lazy: bool
+            Return the query plan as a pl.LazyFrame instead of collecting it.
 
         Returns
         -------
@@ -65,43 +159,46 @@ class DataTrade(DataPull):
 
         switch = [time_frame, level]
 
-        if datetime == "":
-            df = self.insert_int_jp()
-        elif len(datetime.split("+")) == 2:
-            times = datetime.split("+")
-            start = times[0]
-            end = times[1]
-            df = self.insert_int_jp()
-            df = df.filter((pl.col("date") >= start) & (pl.col("date") <= end))
-        elif len(datetime.split("+")) == 1:
-            df = self.insert_int_jp()
-            df = df.filter(pl.col("date") == datetime)
-        else:
-            raise ValueError('Invalid time format. Use "date" or "start_date+end_date"')
+        key = self.cache_key(
+            "jptradedata", level, time_frame, datetime, agriculture_filter, level_filter
+        )
+        if not group and (cached := self.cached_result(key)) is not None:
+            return cached.lazy() if lazy else cached
 
-        if agriculture_filter:
-            df = df.filter(pl.col("agri_prod") == 1)
+        table = self.trade_cube("jptradedata")
+        if level == "hts" and not self.level_ids(level, level_filter):
+            raise ValueError(f"Invalid HTS code: {level_filter}")
+        elif level == "naics" and not self.level_ids(level, level_filter):
+            raise ValueError(f"Invalid NAICS code: {level_filter}")
+        elif level == "country" and not self.level_ids(level, level_filter):
+            raise ValueError(f"Invalid Name code: {level_filter}")
+
+        df, empty = self.summarize(
+            table,
+            switch,
+            datetime,
+            agriculture_filter,
+            level_filter,
+        )
 
         if level == "hts":
-            df = df.filter(pl.col("hts_code").str.starts_with(level_filter))
-            if df.is_empty():
+            if empty:
                 raise ValueError(f"Invalid HTS code: {level_filter}")
         elif level == "naics":
-            df = df.filter(pl.col("naics").str.starts_with(level_filter))
-            if df.is_empty():
+            if empty:
                 raise ValueError(f"Invalid NAICS code: {level_filter}")
         elif level == "country":
-            df = df.filter(pl.col("country").str.starts_with(level_filter))
-            if df.is_empty():
+            if empty:
                 raise ValueError(f"Invalid Name code: {level_filter}")
 
-        df = self.conversion(df)
-
         if group:
-            # return self.process_cat(switch=switch)
             raise NotImplementedError("Grouping not implemented yet")
         else:
-            return self.process_data(switch=switch, base=df)
+            if lazy:
+                return df
+            df = df.collect(streaming=True)
+            self.store_result(key, df)
+            return df
 
     def process_int_org(
         self,
@@ -111,7 +208,8 @@ class DataTrade(DataPull):
         agriculture_filter: bool = False,
         group: bool = False,
         level_filter: str = "",
-    ) -> pl.DataFrame:
+        lazy: bool = False,
+    ) -> pl.DataFrame | pl.LazyFrame:
         """
         Process the data from Puerto Rico Statistics Institute.
 
@@ -132,6 +230,8 @@ class DataTrade(DataPull):
             Update the data from the source.
         filter: str
             Filter the data based on the type. ex. "NAICS code" or "HTS code".
+        lazy: bool
+            Return the query plan as a pl.LazyFrame instead of collecting it.
 
         Returns
         -------
@@ -140,44 +240,287 @@ class DataTrade(DataPull):
         """
         switch = [time_frame, level]
 
-        if time_frame == "naics":
+        if level == "naics":
             raise ValueError(
                 "NAICS data is not available for Puerto Rico Statistics Institute."
             )
-        if datetime == "":
-            df = self.insert_int_org()
-        elif len(datetime.split("+")) == 2:
-            times = datetime.split("+")
-            start = times[0]
-            end = times[1]
-            df = self.insert_int_org()
-            df = df.filter((pl.col("date") >= start) & (pl.col("date") <= end))
-        elif len(datetime.split("+")) == 1:
-            df = self.insert_int_org()
-            df = df.filter(pl.col("date") == datetime)
-        else:
-            raise ValueError('Invalid time format. Use "date" or "start_date+end_date"')
+        key = self.cache_key(
+            "inttradedata",
+            level,
+            time_frame,
+            datetime,
+            agriculture_filter,
+            level_filter,
+        )
+        if not group and (cached := self.cached_result(key)) is not None:
+            return cached.lazy() if lazy else cached
 
-        if agriculture_filter:
-            df = df.filter(pl.col("agri_prod") == 1)
+        table = self.trade_cube("inttradedata")
+        if level == "hts" and not self.level_ids(level, level_filter):
+            raise ValueError(f"Invalid HTS code: {level_filter}")
+        elif level == "country" and not self.level_ids(level, level_filter):
+            raise ValueError(f"Invalid Country code: {level_filter}")
+
+        df, empty = self.summarize(
+            table,
+            switch,
+            datetime,
+            agriculture_filter,
+            level_filter,
+        )
 
         if level == "hts":
-            df = df.filter(pl.col("hts_code").str.starts_with(level_filter))
-            if df.is_empty():
+            if empty:
                 raise ValueError(f"Invalid HTS code: {level_filter}")
         elif level == "country":
-            df = df.filter(pl.col("country").str.starts_with(level_filter))
-            if df.is_empty():
+            if empty:
                 raise ValueError(f"Invalid Country code: {level_filter}")
-        df = self.conversion(df)
 
         if group:
-            # return self.process_cat(switch=switch)
             raise NotImplementedError("Grouping not implemented yet")
         else:
-            return self.process_data(switch=switch, base=df)
+            if lazy:
+                return df
+            df = df.collect(streaming=True)
+            self.store_result(key, df)
+            return df
+
+    def process_batch(
+        self,
+        source: str,
+        requests: list,
+        datetime: str = "",
+        agriculture_filter: bool = False,
+    ) -> dict:
+        """
+        Answers several (time_frame, level) requests of a source with a single scan of
+            its cube, summed at every requested grain at once with GROUPING SETS. The
+            results are the ones process_int_jp or process_int_org return for each
+            request and are cached the same way.
+
+        Parameters
+        ----------
+        source: str
+            The source of the data, "jp" or "org".
+        requests: list
+            The (time_frame, level) pairs to process, e.g. [("yearly", "hts")].
+        datetime: str
+            A date ("2020-01-01") or a date range ("2020-01-01+2021-01-01").
+        agriculture_filter: bool
+            Keep only agricultural products if True.
+
+        Returns
+        -------
+        dict
+            The processed data of every (time_frame, level) request.
+        """
+        if source not in SOURCES:
+            raise ValueError(f"Invalid source: {source}")
+        table = SOURCES[source]
+        results = {}
+        grains = {}
+        for time_frame, level in requests:
+            keys = self.switch_keys([time_frame, level])
+            if source == "org" and level == "naics":
+                raise ValueError(
+                    "NAICS data is not available for Puerto Rico Statistics Institute."
+                )
+            key = self.cache_key(
+                table, level, time_frame, datetime, agriculture_filter, ""
+            )
+            if (cached := self.cached_result(key)) is not None:
+                results[(time_frame, level)] = cached
+                continue
+            grains[(time_frame, level)] = (key, keys)
+        if grains:
+            facts = self.filter_relation(
+                self.trade_cube(table), "total", datetime, agriculture_filter
+            )
+            sets = [keys for _, keys in grains.values()]
+            plans = self.aggregate_sets(facts, sets)
+            for (request, (key, _)), plan in zip(grains.items(), plans):
+                results[request] = plan.collect()
+                self.store_result(key, results[request])
+        return {
+            (time_frame, level): results[(time_frame, level)]
+            for time_frame, level in requests
+        }
+
+    def summarize(
+        self,
+        table: duckdb.DuckDBPyRelation,
+        switch: list,
+        datetime: str,
+        agriculture_filter: bool,
+        level_filter: str,
+    ) -> tuple[pl.LazyFrame, bool]:
+        """
+        Filters a cube and sums it at the grain of switch. With a memory_limit the
+            sums are computed inside DuckDB, which spills to spill_dir, and only the
+            groups are materialized; otherwise the filtered rows are summed by Polars.
+
+        Parameters
+        ----------
+        table: duckdb.DuckDBPyRelation
+            The cube, as returned by trade_cube.
+        switch: list
+            The time frame and level of the result.
+        datetime: str
+            A date ("2020-01-01") or a date range ("2020-01-01+2021-01-01").
+        agriculture_filter: bool
+            Keep only agricultural products if True.
+        level_filter: str
+            Keep only the rows whose level code starts with level_filter.
+
+        Returns
+        -------
+        tuple[pl.LazyFrame, bool]
+            The plan of the result and whether no row matched the filters.
+        """
+        level = switch[1]
+        if self.memory_limit > 0:
+            keys = self.switch_keys(switch)
+            facts = self.filter_relation(
+                table, level, datetime, agriculture_filter, level_filter
+            )
+            empty = facts.limit(1).fetchone() is None
+            return self.aggregate_sets(facts, [keys])[0], empty
+        df = self.filter_table(table, level, datetime, agriculture_filter, level_filter)
+        return self.process_data(switch=switch, base=df.lazy()), df.is_empty()
+
+    def aggregate_sets(
+        self, facts: duckdb.DuckDBPyRelation, sets: list
+    ) -> list[pl.LazyFrame]:
+        """
+        Sums the imports and exports (value and quantity) of facts by several sets of
+            keys in a single DuckDB query with GROUPING SETS, and finishes the groups
+            of every set like aggregate.
+
+        Parameters
+        ----------
+        facts: duckdb.DuckDBPyRelation
+            The rows to sum, e.g. a filtered cube.
+        sets: list
+            The key lists to group by, e.g. [["year"], ["year", "qrt", "hts_id"]].
 
-    def process_data(self, switch: list, base: pl.DataFrame) -> pl.DataFrame:
+        Returns
+        -------
+        list[pl.LazyFrame]
+            The result of every key list, in the order of sets.
+        """
+        # GROUPING() sets the bit of every column a row is not grouped by
+        columns = list(dict.fromkeys(key for keys in sets for key in keys))
+        grouping = ", ".join(f"({', '.join(keys)})" for keys in sets)
+        df = self.reader().sql(f"""
+            SELECT
+                {", ".join(columns)},
+                GROUPING({", ".join(columns)}) AS grain,
+                coalesce(sum(data) FILTER (trade_id = 1), 0)::BIGINT AS imports,
+                coalesce(sum(qty) FILTER (trade_id = 1), 0) AS imports_qty,
+                coalesce(sum(data) FILTER (trade_id = 2), 0)::BIGINT AS exports,
+                coalesce(sum(qty) FILTER (trade_id = 2), 0) AS exports_qty
+            FROM facts
+            WHERE hts_id IS NOT NULL AND trade_id IN (1, 2)
+            GROUP BY GROUPING SETS ({grouping});
+            """).pl()
+
+        fact_keys = [fact_key for fact_key, _, _ in LEVELS.values()]
+        plans = []
+        for keys in sets:
+            grain = sum(
+                1 << (len(columns) - 1 - i)
+                for i, column in enumerate(columns)
+                if column not in keys
+            )
+            rows = df.lazy().filter(pl.col("grain") == grain)
+            for key in keys:
+                if key in fact_keys:
+                    rows = rows.filter(pl.col(key).is_not_null())
+            rows = rows.select(
+                *keys, "imports", "imports_qty", "exports", "exports_qty"
+            )
+            plans.append(self.finalize(rows, keys))
+        return plans
+
+    def cache_key(
+        self,
+        table: str,
+        level: str,
+        time_frame: str,
+        datetime: str,
+        agriculture_filter: bool,
+        level_filter: str,
+    ) -> tuple:
+        """
+        Returns the key of a processed result in the cache: the normalized query
+            parameters and the data version of the source.
+        """
+        if level not in LEVELS:
+            level_filter = ""
+        return (
+            table,
+            level,
+            time_frame,
+            datetime.strip(),
+            bool(agriculture_filter),
+            level_filter,
+            self.data_version(table),
+        )
+
+    def cached_result(self, key: tuple) -> pl.DataFrame | None:
+        """
+        Returns the result cached under key, looked up in memory first and then on
+            disk, or None.
+        """
+        df = self.cache.get(key)
+        if df is None:
+            df = self.disk_cache.get(key + (CODE_VERSION,))
+            if df is not None:
+                self.cache.put(key, df)
+        return df
+
+    def store_result(self, key: tuple, df: pl.DataFrame) -> None:
+        """
+        Caches a processed result in memory and on disk.
+        """
+        self.cache.put(key, df)
+        self.disk_cache.put(key + (CODE_VERSION,), df)
+
+    def data_version(self, table: str) -> str:
+        """
+        Returns a token that changes whenever the data of a fact table may change: the
+            fingerprint of the raw file it is loaded from or, when reading an existing
+            Parquet lake, a hash of the path, size and modification time of every file
+            of the cube partitions, so a month rewritten inside an existing directory
+            changes it too.
+
+        Parameters
+        ----------
+        table: str
+            The fact table ("jptradedata" or "inttradedata").
+
+        Returns
+        -------
+        str
+            The data version.
+        """
+        cube = table.replace("data", "cube")
+        if self.backend == "lake" and self.lake_exists(cube):
+            path = os.path.join(self.lake_dir, f"source={cube}")
+            digest = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for file in sorted(files):
+                    stat = os.stat(os.path.join(root, file))
+                    name = os.path.relpath(os.path.join(root, file), path)
+                    digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+            return digest.hexdigest()[:16]
+        source_file = self.jp_data if table == "jptradedata" else self.org_data
+        if not os.path.exists(source_file):
+            return ""
+        return f"{self.source_fingerprint(source_file)}-{CUBE_VERSION}"
+
+    def process_data(self, switch: list, base: pl.LazyFrame) -> pl.LazyFrame:
         """
         Process the data based on the switch. Used for the process_int_jp and process_int_org methods
             to determine the aggregation of the data.
@@ -196,678 +539,680 @@ class DataTrade(DataPull):
             Processed data. Requires df.collect() to view the data.
         """
 
-        match switch:
-            case ["yearly", "total"]:
-                df = self.filter_data(base, ["year"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year"))
-                )
-                df = df.select(pl.col("*").exclude("year_right"))
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("year")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+        return self.aggregate(base, self.switch_keys(switch))
 
-            case ["yearly", "naics"]:
-                df = self.filter_data(base, ["year", "naics_id"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    naics_id=pl.when(pl.col("naics_id").is_null())
-                    .then(pl.col("naics_id_right"))
-                    .otherwise(pl.col("naics_id")),
-                )
-                df = df.select(pl.col("*").exclude("year_right", "naics_id_right"))
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "naics_id")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+    def switch_keys(self, switch: list) -> list:
+        """
+        Returns the columns a (time_frame, level) switch is grouped by, e.g.
+            ["year", "qrt", "hts_id"] for ["qrt", "hts"].
+        """
+        time_frame, level = switch
+        if time_frame not in TIME_FRAMES or level not in ["total", *LEVELS]:
+            raise ValueError(f"Invalid switch: {switch}")
+        keys = TIME_FRAMES[time_frame]
+        if level in LEVELS:
+            keys = keys + [LEVELS[level][0]]
+        return keys
 
-            case ["yearly", "hts"]:
-                df = self.filter_data(base, ["year", "hts_code"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    hts_code=pl.when(pl.col("hts_code").is_null())
-                    .then(pl.col("hts_code_right"))
-                    .otherwise(pl.col("hts_code")),
-                )
-                df = df.select(pl.col("*").exclude("year_right", "hts_code_right"))
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "hts_code")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+    def aggregate(self, df: pl.LazyFrame, keys: list) -> pl.LazyFrame:
+        """
+        Sums the imports and exports (value and quantity) of df by any combination of
+            time and dimension keys in a single grouped pass, with the trade flows
+            pivoted inside the aggregation, and adds the net values and the codes of
+            the dimension keys.
 
-            case ["yearly", "country"]:
-                df = self.filter_data(base, ["year", "country_id"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    country_id=pl.when(pl.col("country_id").is_null())
-                    .then(pl.col("country_id_right"))
-                    .otherwise(pl.col("country_id")),
-                )
-                df = df.select(pl.col("*").exclude("year_right", "country_id_right"))
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "country_id")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+        Parameters
+        ----------
+        df: pl.LazyFrame
+            The data to sum, e.g. rows of the cube.
+        keys: list
+            The columns to group by, e.g. ["year", "qrt", "hts_id"].
 
-            case ["fiscal", "total"]:
-                df = self.filter_data(base, ["fiscal_year"])
-                df = df.with_columns(
-                    fiscal_year=pl.when(pl.col("fiscal_year").is_null())
-                    .then(pl.col("fiscal_year_right"))
-                    .otherwise(pl.col("fiscal_year"))
-                )
-                df = df.select(pl.col("*").exclude("fiscal_year_right"))
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("fiscal_year")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+        Returns
+        -------
+        pl.LazyFrame
+            One row per group sorted by the time keys and the codes.
+        """
+        imports = pl.col("trade_id") == 1
+        exports = pl.col("trade_id") == 2
+        df = (
+            df.filter(pl.col("hts_id").is_not_null() & (imports | exports))
+            .group_by(keys)
+            .agg(
+                imports=pl.col("data").filter(imports).sum(),
+                imports_qty=pl.col("qty").filter(imports).sum(),
+                exports=pl.col("data").filter(exports).sum(),
+                exports_qty=pl.col("qty").filter(exports).sum(),
+            )
+        )
+        return self.finalize(df, keys)
 
-            case ["fiscal", "naics"]:
-                df = self.filter_data(base, ["fiscal_year", "naics_id"])
-                df = df.with_columns(
-                    fiscal_year=pl.when(pl.col("fiscal_year").is_null())
-                    .then(pl.col("fiscal_year_right"))
-                    .otherwise(pl.col("fiscal_year")),
-                    naics_id=pl.when(pl.col("naics_id").is_null())
-                    .then(pl.col("naics_id_right"))
-                    .otherwise(pl.col("naics_id")),
-                )
-                df = df.select(
-                    pl.col("*").exclude("fiscal_year_right", "naics_id_right")
-                )
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("fiscal_year", "naics_id")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+    def finalize(self, df: pl.LazyFrame, keys: list) -> pl.LazyFrame:
+        """
+        Adds the net values to the summed imports and exports of df, replaces the
+            dimension keys by their codes and sorts the groups by the time keys and the
+            codes.
 
-            case ["fiscal", "hts"]:
-                df = self.filter_data(base, ["fiscal_year", "hts_code"])
-                df = df.with_columns(
-                    fiscal_year=pl.when(pl.col("fiscal_year").is_null())
-                    .then(pl.col("fiscal_year_right"))
-                    .otherwise(pl.col("fiscal_year")),
-                    hts_code=pl.when(pl.col("hts_code").is_null())
-                    .then(pl.col("hts_code_right"))
-                    .otherwise(pl.col("hts_code")),
-                )
-                df = df.select(
-                    pl.col("*").exclude("fiscal_year_right", "hts_code_right")
-                )
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("fiscal_year", "hts_code")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+        Parameters
+        ----------
+        df: pl.LazyFrame
+            The imports and exports summed by keys.
+        keys: list
+            The columns df is grouped by.
 
-            case ["fiscal", "country"]:
-                df = self.filter_data(base, ["fiscal_year", "country_id"])
-                df = df.with_columns(
-                    fiscal_year=pl.when(pl.col("fiscal_year").is_null())
-                    .then(pl.col("fiscal_year_right"))
-                    .otherwise(pl.col("fiscal_year")),
-                    country_id=pl.when(pl.col("country_id").is_null())
-                    .then(pl.col("country_id_right"))
-                    .otherwise(pl.col("country_id")),
-                )
-                df = df.select(
-                    pl.col("*").exclude("fiscal_year_right", "country_id_right")
-                )
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("fiscal_year", "country_id")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+        Returns
+        -------
+        pl.LazyFrame
+            The finished result.
+        """
+        df = df.with_columns(
+            net_exports=pl.col("exports") - pl.col("imports"),
+            net_qty=pl.col("exports_qty") - pl.col("imports_qty"),
+        )
+        # Dimension keys are ordered by their code rather than by id
+        codes = {fact_key: code for fact_key, _, code in LEVELS.values()}
+        return self.add_descriptions(df).sort([codes.get(key, key) for key in keys])
 
-            case ["qrt", "total"]:
-                df = self.filter_data(base, ["year", "qrt"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    qrt=pl.when(pl.col("qrt").is_null())
-                    .then(pl.col("qrt_right"))
-                    .otherwise(pl.col("qrt")),
-                )
-                df = df.select(pl.col("*").exclude("year_right", "qrt_right"))
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "qrt")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+    def process_price(self, agriculture_filter: bool = False) -> pl.DataFrame:
+        """
+        Computes the monthly import and export prices of every HS4 product with their
+            3 month moving average and standard deviation, Bollinger bands, rank among
+            the products of the month, change from the previous month and change from
+            the same month of the previous year. Every window is partitioned by hs4 and
+            framed by calendar months, so gaps in a series are never bridged by rows of
+            another product or another period. The statistics are kept in pricetable
+            and only the months affected by new cube months are recomputed.
 
-            case ["qrt", "naics"]:
-                df = self.filter_data(base, ["year", "qrt", "naics_id"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    qrt=pl.when(pl.col("qrt").is_null())
-                    .then(pl.col("qrt_right"))
-                    .otherwise(pl.col("qrt")),
-                    naics_id=pl.when(pl.col("naics_id").is_null())
-                    .then(pl.col("naics_id_right"))
-                    .otherwise(pl.col("naics_id")),
-                )
-                df = df.select(
-                    pl.col("*").exclude("year_right", "qrt_right", "naics_id_right")
-                )
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "qrt", "naics_id")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+        Parameters
+        ----------
+        agriculture_filter: bool
+            Keep only agricultural products if True.
 
-            case ["qrt", "hts"]:
-                df = self.filter_data(base, ["year", "qrt", "hts_code"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    qrt=pl.when(pl.col("qrt").is_null())
-                    .then(pl.col("qrt_right"))
-                    .otherwise(pl.col("qrt")),
-                    hts_code=pl.when(pl.col("hts_code").is_null())
-                    .then(pl.col("hts_code_right"))
-                    .otherwise(pl.col("hts_code")),
-                )
-                df = df.select(
-                    pl.col("*").exclude("year_right", "qrt_right", "hts_code_right")
-                )
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "qrt", "hts_code")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+        Returns
+        -------
+        pl.DataFrame
+            One row per HS4 product and month, sorted by date and hs4.
+        """
+        self.refresh_price(agriculture_filter)
+        return self.conn.execute(
+            """
+            SELECT * EXCLUDE (
+                agriculture,
+                price_imports_count,
+                price_imports_sum,
+                price_imports_sumsq,
+                price_exports_count,
+                price_exports_sum,
+                price_exports_sumsq
+            )
+            FROM 'pricetable'
+            WHERE agriculture = $agriculture
+            ORDER BY date, hs4;
+            """,
+            {"agriculture": agriculture_filter},
+        ).pl()
 
-            case ["qrt", "country"]:
-                df = self.filter_data(base, ["year", "qrt", "country_id"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    qrt=pl.when(pl.col("qrt").is_null())
-                    .then(pl.col("qrt_right"))
-                    .otherwise(pl.col("qrt")),
-                    country_id=pl.when(pl.col("country_id").is_null())
-                    .then(pl.col("country_id_right"))
-                    .otherwise(pl.col("country_id")),
-                )
-                df = df.select(
-                    pl.col("*").exclude("year_right", "qrt_right", "country_id_right")
-                )
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "qrt", "country_id")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+    def refresh_price(self, agriculture_filter: bool = False) -> None:
+        """
+        Updates pricetable with the cube months that changed since the prices were last
+            computed. The prices of the changed months are rebuilt from the cube, then
+            the statistics of the months that read them are recomputed from the prices
+            of the PRICE_HORIZON months before, keeping for every row the count, sum
+            and sum of squares of the prices in its moving window. Every other month
+            is left as is.
 
-            case ["monthly", "total"]:
-                df = self.filter_data(base, ["year", "month"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    month=pl.when(pl.col("month").is_null())
-                    .then(pl.col("month_right"))
-                    .otherwise(pl.col("month")),
-                )
-                df = df.select(pl.col("*").exclude("year_right", "month_right"))
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "month")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+        Parameters
+        ----------
+        agriculture_filter: bool
+            Keep only agricultural products if True.
 
-            case ["monthly", "naics"]:
-                df = self.filter_data(base, ["year", "month", "naics_id"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    month=pl.when(pl.col("month").is_null())
-                    .then(pl.col("month_right"))
-                    .otherwise(pl.col("month")),
-                    naics_id=pl.when(pl.col("naics_id").is_null())
-                    .then(pl.col("naics_id_right"))
-                    .otherwise(pl.col("naics_id")),
-                )
-                df = df.select(
-                    pl.col("*").exclude("year_right", "month_right", "naics_id_right")
-                )
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "month", "naics_id")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+        Returns
+        -------
+        None
+        """
+        cube = self.trade_cube("inttradedata")
+        init_price_table(self.data_file)
+        init_price_months_table(self.data_file)
+        stale = self.conn.execute(
+            """
+            SELECT date, checksum FROM 'cubemonths' AS c
+            WHERE source = 'inttradedata' AND NOT EXISTS (
+                SELECT 1 FROM 'pricemonths' AS p
+                WHERE p.agriculture = $agriculture AND p.date = c.date
+                    AND p.checksum = c.checksum AND p.version = $version
+            );
+            """,
+            {"agriculture": agriculture_filter, "version": PRICE_VERSION},
+        ).pl()
+        if stale.is_empty():
+            return
 
-            case ["monthly", "hts"]:
-                df = self.filter_data(base, ["year", "month", "hts_code"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    month=pl.when(pl.col("month").is_null())
-                    .then(pl.col("month_right"))
-                    .otherwise(pl.col("month")),
-                    hts_code=pl.when(pl.col("hts_code").is_null())
-                    .then(pl.col("hts_code_right"))
-                    .otherwise(pl.col("hts_code")),
-                )
-                df = df.select(
-                    pl.col("*").exclude("year_right", "month_right", "hts_code_right")
-                )
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "month", "hts_code")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
-                )
-                return df
+        hts = self.reader().table("htstable")
+        if agriculture_filter:
+            hts = hts.filter(duckdb.ColumnExpression("agri_prod"))
+        years = ", ".join(map(str, stale.get_column("date").dt.year().unique()))
+        prices = self.reader().sql(f"""
+            SELECT
+                *,
+                imports / imports_qty AS price_imports,
+                exports / exports_qty AS price_exports
+            FROM (
+                SELECT
+                    substr(hts.hts_code, 1, 4) AS hs4,
+                    month,
+                    year,
+                    date::TIMESTAMP AS date,
+                    sum(imports)::BIGINT AS imports,
+                    sum(exports)::BIGINT AS exports,
+                    sum(if(imports_qty = 0, 1, imports_qty)) AS imports_qty,
+                    sum(if(exports_qty = 0, 1, exports_qty)) AS exports_qty
+                FROM (
+                    SELECT
+                        date,
+                        month,
+                        year,
+                        hts_id,
+                        coalesce(sum(data) FILTER (trade_id = 1), 0) AS imports,
+                        coalesce(sum(data) FILTER (trade_id = 2), 0) AS exports,
+                        coalesce(sum(qty) FILTER (trade_id = 1), 0) AS imports_qty,
+                        coalesce(sum(qty) FILTER (trade_id = 2), 0) AS exports_qty
+                    FROM cube
+                    WHERE year IN ({years}) AND date IN (SELECT date FROM stale)
+                    GROUP BY ALL
+                ) AS facts
+                JOIN hts ON hts.id = facts.hts_id
+                GROUP BY ALL
+            );
+            """).pl()
 
-            case ["monthly", "country"]:
-                df = self.filter_data(base, ["year", "month", "country_id"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    month=pl.when(pl.col("month").is_null())
-                    .then(pl.col("month_right"))
-                    .otherwise(pl.col("month")),
-                    country_id=pl.when(pl.col("country_id").is_null())
-                    .then(pl.col("country_id_right"))
-                    .otherwise(pl.col("country_id")),
-                )
-                df = df.select(
-                    pl.col("*").exclude("year_right", "month_right", "country_id_right")
-                )
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "imports_qty", "exports_qty"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "month", "country_id")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
-                df = df.with_columns(
-                    net_qty=pl.col("exports_qty") - pl.col("imports_qty")
+        self.conn.begin()
+        try:
+            self.conn.execute(
+                """
+                DELETE FROM 'pricetable'
+                WHERE agriculture = $agriculture
+                    AND date IN (SELECT date::TIMESTAMP FROM stale);
+                """,
+                {"agriculture": agriculture_filter},
+            )
+            self.conn.execute(
+                """
+                INSERT INTO 'pricetable' BY NAME
+                SELECT $agriculture AS agriculture, * FROM prices;
+                """,
+                {"agriculture": agriculture_filter},
+            )
+            rows = self.conn.execute(
+                """
+                WITH affected AS (
+                    SELECT DISTINCT date::TIMESTAMP + to_months(lag::INTEGER) AS date
+                    FROM stale, range($horizon) AS lags(lag)
+                ),
+                prices AS (
+                    SELECT
+                        agriculture,
+                        hs4,
+                        month,
+                        year,
+                        imports,
+                        exports,
+                        imports_qty,
+                        exports_qty,
+                        price_imports,
+                        price_exports,
+                        date,
+                        year * 12 + month AS month_index
+                    FROM 'pricetable'
+                    WHERE agriculture = $agriculture AND date IN (
+                        SELECT date - to_months(lag::INTEGER)
+                        FROM affected, range($horizon) AS lags(lag)
+                    )
+                ),
+                windows AS (
+                    SELECT
+                        *,
+                        count(price_imports) OVER months AS price_imports_count,
+                        sum(price_imports) OVER months AS price_imports_sum,
+                        sum(price_imports ** 2) OVER months AS price_imports_sumsq,
+                        count(price_exports) OVER months AS price_exports_count,
+                        sum(price_exports) OVER months AS price_exports_sum,
+                        sum(price_exports ** 2) OVER months AS price_exports_sumsq
+                    FROM prices
+                    WINDOW months AS (
+                        PARTITION BY hs4 ORDER BY month_index
+                        RANGE BETWEEN 2 PRECEDING AND CURRENT ROW
+                    )
+                ),
+                moving AS (
+                    SELECT
+                        *,
+                        price_imports_sum / price_imports_count
+                            AS moving_price_imports,
+                        price_exports_sum / price_exports_count
+                            AS moving_price_exports,
+                        sqrt(greatest(
+                            price_imports_sumsq
+                                - price_imports_sum ** 2 / price_imports_count,
+                            0
+                        ) / nullif(price_imports_count - 1, 0))
+                            AS moving_price_imports_std,
+                        sqrt(greatest(
+                            price_exports_sumsq
+                                - price_exports_sum ** 2 / price_exports_count,
+                            0
+                        ) / nullif(price_exports_count - 1, 0))
+                            AS moving_price_exports_std
+                    FROM windows
+                ),
+                ranked AS (
+                    SELECT
+                        *,
+                        row_number() OVER (
+                            PARTITION BY date ORDER BY moving_price_imports, hs4
+                        ) AS rank_imports,
+                        row_number() OVER (
+                            PARTITION BY date ORDER BY moving_price_exports, hs4
+                        ) AS rank_exports
+                    FROM moving
+                ),
+                lagged AS (
+                    SELECT
+                        *,
+                        any_value(moving_price_imports) OVER last_month
+                            AS last_month_imports,
+                        any_value(moving_price_imports) OVER last_year
+                            AS prev_year_imports,
+                        any_value(moving_price_exports) OVER last_year
+                            AS prev_year_exports,
+                        any_value(rank_imports) OVER last_year
+                            AS prev_year_rank_imports,
+                        any_value(rank_exports) OVER last_year
+                            AS prev_year_rank_exports
+                    FROM ranked
+                    WINDOW
+                        last_month AS (
+                            PARTITION BY hs4 ORDER BY month_index
+                            RANGE BETWEEN 1 PRECEDING AND 1 PRECEDING
+                        ),
+                        last_year AS (
+                            PARTITION BY hs4 ORDER BY month_index
+                            RANGE BETWEEN 12 PRECEDING AND 12 PRECEDING
+                        )
                 )
-                return df
+                SELECT
+                    * EXCLUDE (month_index, last_month_imports),
+                    moving_price_imports + 2 * moving_price_imports_std
+                        AS upper_band_imports,
+                    moving_price_imports - 2 * moving_price_imports_std
+                        AS lower_band_imports,
+                    moving_price_exports + 2 * moving_price_exports_std
+                        AS upper_band_exports,
+                    moving_price_exports - 2 * moving_price_exports_std
+                        AS lower_band_exports,
+                    (moving_price_imports - last_month_imports) / last_month_imports
+                        AS pct_change_imports,
+                    (moving_price_imports - prev_year_imports) / prev_year_imports
+                        AS pct_change_imports_year_over_year,
+                    (moving_price_exports - prev_year_exports) / prev_year_exports
+                        AS pct_change_exports_year_over_year,
+                    rank_imports - prev_year_rank_imports
+                        AS rank_imports_change_year_over_year,
+                    rank_exports - prev_year_rank_exports
+                        AS rank_exports_change_year_over_year
+                FROM lagged
+                WHERE date IN (SELECT date FROM affected);
+                """,
+                {"agriculture": agriculture_filter, "horizon": PRICE_HORIZON},
+            ).pl()
+            self.conn.execute(
+                """
+                DELETE FROM 'pricetable'
+                WHERE agriculture = $agriculture
+                    AND date IN (SELECT DISTINCT date FROM rows);
+                """,
+                {"agriculture": agriculture_filter},
+            )
+            self.conn.sql("INSERT INTO 'pricetable' BY NAME SELECT * FROM rows;")
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO 'pricemonths'
+                SELECT $agriculture, date, checksum, $version FROM stale;
+                """,
+                {"agriculture": agriculture_filter, "version": PRICE_VERSION},
+            )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        logging.info(
+            f"Refreshed the prices of {len(stale)} months and {len(rows)} rows"
+        )
 
-            case _:
-                raise ValueError(f"Invalid switch: {switch}")
+    def ingest(self, table: str, df: pl.LazyFrame, source_file: str) -> None:
+        """
+        Loads the changed months of a source like DataPull.ingest and refreshes the
+            cube of the source.
+        """
+        super().ingest(table, df, source_file)
+        if self.refresh_cube(table) > 0:
+            self.cache.invalidate()
 
-    def process_price(self, agriculture_filter: bool = False) -> pl.DataFrame:
-        df = self.process_int_org(
-            time_frame="monthly", level="hts", agriculture_filter=agriculture_filter
-        )
-        df = df.with_columns(pl.col("imports_qty", "exports_qty").replace(0, 1))
-        df = df.with_columns(hs4=pl.col("hts_code").str.slice(0, 4))
-
-        df = df.group_by(pl.col("hs4", "month", "year")).agg(
-            pl.col("imports").sum().alias("imports"),
-            pl.col("exports").sum().alias("exports"),
-            pl.col("imports_qty").sum().alias("imports_qty"),
-            pl.col("exports_qty").sum().alias("exports_qty"),
-        )
+    def trade_cube(self, table: str) -> duckdb.DuckDBPyRelation:
+        """
+        Returns the cube of a fact table ("jptradedata" or "inttradedata"), the facts
+            summed by month, HTS, country, NAICS and trade flow with the year, quarter
+            and fiscal year of the month and the quantity converted to kg. The fact
+            table is loaded and the cube refreshed first if needed.
 
-        df = df.with_columns(
-            price_imports=pl.col("imports") / pl.col("imports_qty"),
-            price_exports=pl.col("exports") / pl.col("exports_qty"),
-        )
+        Parameters
+        ----------
+        table: str
+            The fact table of the cube.
 
-        df = df.with_columns(date=pl.datetime(pl.col("year"), pl.col("month"), 1))
-
-        # Sort the DataFrame by the date column
-        df = df.sort("date")
-
-        # Now you can safely use group_by_dynamic
-        result = df.with_columns(
-            pl.col("price_imports")
-            .rolling_mean(window_size=3, min_periods=1)
-            .over("hs4")
-            .alias("moving_price_imports"),
-            pl.col("price_exports")
-            .rolling_mean(window_size=3, min_periods=1)
-            .over("hs4")
-            .alias("moving_price_exports"),
-            pl.col("price_imports")
-            .rolling_std(window_size=3, min_periods=1)
-            .over("hs4")
-            .alias("moving_price_imports_std"),
-            pl.col("price_exports")
-            .rolling_std(window_size=3, min_periods=1)
-            .over("hs4")
-            .alias("moving_price_exports_std"),
-        )
-        results = result.with_columns(
-            pl.col("moving_price_imports")
-            .rank("ordinal")
-            .over("date")
-            .alias("rank_imports")
-            .cast(pl.Int64),
-            pl.col("moving_price_exports")
-            .rank("ordinal")
-            .over("date")
-            .alias("rank_exports")
-            .cast(pl.Int64),
-            upper_band_imports=pl.col("moving_price_imports")
-            + 2 * pl.col("moving_price_imports_std"),
-            lower_band_imports=pl.col("moving_price_imports")
-            - 2 * pl.col("moving_price_imports_std"),
-            upper_band_exports=pl.col("moving_price_exports")
-            + 2 * pl.col("moving_price_exports_std"),
-            lower_band_exports=pl.col("moving_price_exports")
-            - 2 * pl.col("moving_price_exports_std"),
-        )
-        results = df.join(results, on=["date", "hs4"], how="left", validate="1:1")
-        results = results.with_columns(
-            year=pl.when(pl.col("year").is_null())
-            .then(pl.col("year_right"))
-            .otherwise(pl.col("year")),
-            month=pl.when(pl.col("month").is_null())
-            .then(pl.col("month_right"))
-            .otherwise(pl.col("month")),
-            imports=pl.when(pl.col("imports").is_null())
-            .then(pl.col("imports_right"))
-            .otherwise(pl.col("imports")),
-            exports=pl.when(pl.col("exports").is_null())
-            .then(pl.col("exports_right"))
-            .otherwise(pl.col("exports")),
-            price_imports=pl.when(pl.col("price_imports").is_null())
-            .then(pl.col("price_imports_right"))
-            .otherwise(pl.col("price_imports")),
-            price_exports=pl.when(pl.col("price_exports").is_null())
-            .then(pl.col("price_exports_right"))
-            .otherwise(pl.col("price_exports")),
-            imports_qty=pl.when(pl.col("imports_qty").is_null())
-            .then(pl.col("exports_qty_right"))
-            .otherwise(pl.col("imports_qty")),
-            exports_qty=pl.when(pl.col("exports_qty").is_null())
-            .then(pl.col("exports_qty"))
-            .otherwise(pl.col("exports_qty")),
-        )
+        Returns
+        -------
+        duckdb.DuckDBPyRelation
+            The cube.
+        """
+        cube = table.replace("data", "cube")
+        if self.backend == "lake" and self.lake_exists(cube):
+            return self.reader().table(cube)
+        self.trade_table(table)
+        self.refresh_cube(table)
+        return self.reader().table(cube)
 
-        results = results.select(
-            pl.col("*").exclude(
-                "year_right",
-                "month_right",
-                "imports_right",
-                "exports_right",
-                "price_imports_right",
-                "price_exports_right",
-                "exports_qty_right",
-                "imports_qty_right",
-            )
-        )
+    def refresh_cube(self, table: str) -> int:
+        """
+        Rebuilds the months of the cube of a fact table whose facts changed since the
+            cube was last built (or that were built by another CUBE_VERSION), leaving
+            every other month as is.
 
-        # Assuming 'results' already has the necessary columns and is sorted by date and hs4
-        results = results.with_columns(
-            pl.col("moving_price_imports")
-            .pct_change()
-            .over("date", "hs4")
-            .alias("pct_change_imports")
-        ).sort(by=["date", "hs4"])
-
-        # To get the percentage change for the same month of the previous year
-        # First, create a column for the previous year's value
-        results = results.with_columns(
-            pl.when(
-                pl.col("date").dt.year() > 1
-            )  # Ensure there's a previous year to compare
-            .then(pl.col("moving_price_imports").shift(12))  # Shift by 12 months
-            .otherwise(None)
-            .alias("prev_year_imports"),
-        )
-        results = results.with_columns(
-            pl.when(
-                pl.col("date").dt.year() > 1
-            )  # Ensure there's a previous year to compare
-            .then(pl.col("moving_price_exports").shift(12))  # Shift by 12 months
-            .otherwise(None)
-            .alias("prev_year_exports"),
-        )
-        results = results.with_columns(
-            pl.when(
-                pl.col("date").dt.year() > 1
-            )  # Ensure there's a previous year to compare
-            .then(pl.col("rank_imports").shift(12))  # Shift by 12 months
-            .otherwise(None)
-            .alias("prev_year_rank_imports"),
+        Parameters
+        ----------
+        table: str
+            The fact table of the cube.
+
+        Returns
+        -------
+        int
+            The number of months rebuilt.
+        """
+        cube = table.replace("data", "cube")
+        init_cube_months_table(self.data_file)
+        init_trade_cube_table(self.data_file, cube)
+        stale = self.conn.execute(
+            """
+            SELECT date, checksum FROM 'ingestmonths' AS m
+            WHERE source = $source AND NOT EXISTS (
+                SELECT 1 FROM 'cubemonths' AS c
+                WHERE c.source = m.source AND c.date = m.date
+                    AND c.checksum = m.checksum AND c.version = $version
+            );
+            """,
+            {"source": table, "version": CUBE_VERSION},
+        ).pl()
+        if stale.is_empty():
+            return 0
+
+        # The facts are summed inside DuckDB so only the cube rows are materialized
+        facts = self.reader().table(table)
+        keys = ["country_id", "naics_id"]
+        columns = ["date::DATE AS date", "trade_id", "hts_id"]
+        columns += [key for key in keys if key in facts.columns]
+        dates = stale.select("date")
+        df = (
+            facts.join(self.reader().from_arrow(dates.to_arrow()), "date", how="semi")
+            .aggregate(
+                ", ".join(columns + ["sum(data)::BIGINT AS data", "sum(qty) AS qty"]),
+                ", ".join(column.split(" AS ")[-1] for column in columns),
+            )
+            .pl()
         )
-        results = results.with_columns(
-            pl.when(
-                pl.col("date").dt.year() > 1
-            )  # Ensure there's a previous year to compare
-            .then(pl.col("rank_exports").shift(12))  # Shift by 12 months
-            .otherwise(None)
-            .alias("prev_year_rank_exports")
+        schema = self.conn.table(cube).limit(0).pl().schema
+        calendar = self.load_calendar(dates)
+        rows = (
+            df.with_columns(pl.lit(None).alias(key) for key in keys if key not in df)
+            .join(calendar, on="date", how="left")
+            .select(schema.names())
+            .cast(dict(schema))
         )
 
-        # Now calculate the percentage change
-        results = results.with_columns(
-            (
-                (pl.col("moving_price_imports") - pl.col("prev_year_imports"))
-                / pl.col("prev_year_imports")
-            ).alias("pct_change_imports_year_over_year"),
-            (
-                (pl.col("moving_price_exports") - pl.col("prev_year_exports"))
-                / pl.col("prev_year_exports")
-            ).alias("pct_change_exports_year_over_year"),
-            (pl.col("rank_imports") - pl.col("prev_year_rank_imports")).alias(
-                "rank_imports_change_year_over_year"
-            ),
-            (
-                pl.col("rank_exports").cast(pl.Int64)
-                - pl.col("prev_year_rank_exports").cast(pl.Int64)
-            ).alias("rank_exports_change_year_over_year"),
-        ).sort(by=["date", "hs4"])
-        return results
-
-    def process_cat(self, df: pl.DataFrame, switch: list):
-        match switch:
-            case ["yearly", "total"]:
-                df = self.filter_data(df, ["year", "naics"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    naics=pl.when(pl.col("naics").is_null())
-                    .then(pl.col("naics_right"))
-                    .otherwise(pl.col("naics")),
+        self.conn.begin()
+        try:
+            if self.backend == "lake":
+                self.write_lake(cube, rows)
+            else:
+                self.conn.sql(
+                    f"DELETE FROM '{cube}' WHERE date IN (SELECT date FROM dates);"
                 )
-                df = df.select(pl.col("*").exclude("year_right", "naics_right"))
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "qty_imports", "qty_exports"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "naics")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
+                self.conn.sql(f"INSERT INTO '{cube}' SELECT * FROM rows;")
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO 'cubemonths'
+                SELECT $source, date, checksum, $version FROM stale;
+                """,
+                {"source": table, "version": CUBE_VERSION},
+            )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        logging.info(f"Refreshed {len(stale)} months of {cube}")
+        return len(stale)
 
-    def filter_data(self, df: pl.DataFrame, filter: list) -> pl.DataFrame:
+    def load_calendar(self, dates: pl.DataFrame) -> pl.DataFrame:
         """
-        Filter the data based on the filter list.
+        Adds the months of dates to the calendar table and returns their periods: the
+            year, month, calendar quarter, fiscal year and fiscal quarter. Fiscal years
+            start in July and are named after the year they end in.
 
         Parameters
         ----------
-        df: pl.DataFrame
-            Data to filter.
-        filter: List
-            List of columns to filter the data.
+        dates: pl.DataFrame
+            Frame with the first day of every month in a date column.
 
         Returns
         -------
         pl.DataFrame
-            data to be filtered.
-        """
-        df = df.filter(pl.col("hts_code").is_not_null())
-        imports = (
-            df.filter(pl.col("trade_id") == 1)
-            .group_by(filter)
-            .agg(pl.sum("data", "qty"))
-            .sort(filter)
-            .rename({"data": "imports", "qty": "imports_qty"})
+            The calendar rows of dates.
+        """
+        init_calendar_table(self.data_file)
+        self.conn.sql("""
+            INSERT OR IGNORE INTO 'calendartable'
+            SELECT DISTINCT
+                date::DATE,
+                year(date),
+                month(date),
+                quarter(date),
+                year(date) + (month(date) > 6)::INTEGER,
+                (month(date) + 5) % 12 // 3 + 1
+            FROM dates;
+            """)
+        return (
+            self.conn.table("calendartable")
+            .join(self.conn.from_arrow(dates.to_arrow()), "date", how="semi")
+            .pl()
         )
-        exports = (
-            df.filter(pl.col("trade_id") == 2)
-            .group_by(filter)
-            .agg(pl.sum("data", "qty"))
-            .sort(filter)
-            .rename({"data": "exports", "qty": "exports_qty"})
+
+    def filter_table(
+        self,
+        table: duckdb.DuckDBPyRelation,
+        level: str,
+        datetime: str = "",
+        agriculture_filter: bool = False,
+        level_filter: str = "",
+    ) -> pl.DataFrame:
+        """
+        Materializes the rows of filter_relation and only the columns needed to
+            aggregate the data at level.
+        """
+        columns = ["date", "year", "qrt", "month", "fiscal_year", "fiscal_qrt"]
+        columns += ["trade_id", "hts_id", "data", "qty"]
+        if level in LEVELS and LEVELS[level][0] not in columns:
+            columns.append(LEVELS[level][0])
+        table = self.filter_relation(
+            table, level, datetime, agriculture_filter, level_filter
         )
-        return imports.join(exports, on=filter, how="full", validate="1:1")
+        return table.select(*columns).pl()
 
-    def conversion(self, df: pl.DataFrame) -> pl.DataFrame:
+    def filter_relation(
+        self,
+        table: duckdb.DuckDBPyRelation,
+        level: str,
+        datetime: str = "",
+        agriculture_filter: bool = False,
+        level_filter: str = "",
+    ) -> duckdb.DuckDBPyRelation:
         """
-        Convert the data to the correct units (kg).
+        Applies the date, agriculture and level filters to a table relation inside
+            DuckDB.
+
+        Parameters
+        ----------
+        table: duckdb.DuckDBPyRelation
+            The cube to filter, as returned by trade_cube.
+        level: str
+            The level of the data ("total", "hts", "naics" or "country").
+        datetime: str
+            A date ("2020-01-01") or a date range ("2020-01-01+2021-01-01").
+        agriculture_filter: bool
+            Keep only agricultural products if True.
+        level_filter: str
+            Keep only the rows whose level code starts with level_filter.
+
+        Returns
+        -------
+        duckdb.DuckDBPyRelation
+            The filtered rows.
+        """
+        date = duckdb.ColumnExpression("date")
+        times = datetime.split("+")
+        if datetime == "":
+            condition = duckdb.ConstantExpression(True)
+        elif len(times) == 2:
+            condition = date.between(
+                duckdb.ConstantExpression(times[0]).cast(duckdb.typing.TIMESTAMP),
+                duckdb.ConstantExpression(times[1]).cast(duckdb.typing.TIMESTAMP),
+            )
+        elif len(times) == 1:
+            condition = date == duckdb.ConstantExpression(datetime).cast(
+                duckdb.typing.TIMESTAMP
+            )
+        else:
+            raise ValueError('Invalid time format. Use "date" or "start_date+end_date"')
+
+        # Parquet lake: filter the partition columns too so only the files of the
+        # requested months are opened
+        if datetime != "" and "year" in table.columns:
+            year = duckdb.ColumnExpression("year")
+            month = duckdb.ColumnExpression("month")
+            dates = pl.Series(times).str.to_datetime().to_list()
+            start, end = dates[0], dates[-1]
+            condition &= year.between(
+                duckdb.ConstantExpression(start.year),
+                duckdb.ConstantExpression(end.year),
+            )
+            if len(times) == 1:
+                condition &= month == duckdb.ConstantExpression(start.month)
+
+        table = table.filter(condition).set_alias("facts")
+        if agriculture_filter:
+            hts = (
+                self.reader()
+                .table("htstable")
+                .filter(duckdb.ColumnExpression("agri_prod"))
+            )
+            table = table.join(
+                hts.set_alias("dim"), "facts.hts_id = dim.id", how="semi"
+            ).set_alias("facts")
+
+        if level in LEVELS:
+            fact_key = LEVELS[level][0]
+            if level_filter == "":
+                table = table.filter(duckdb.ColumnExpression(fact_key).isnotnull())
+            else:
+                ids = self.level_ids(level, level_filter)
+                table = table.filter(
+                    duckdb.ColumnExpression(fact_key).isin(
+                        *[duckdb.ConstantExpression(id) for id in ids]
+                    )
+                )
+        return table
+
+    def code_index(self, level: str) -> tuple[list, list]:
+        """
+        Returns the codes of a level ("hts", "naics" or "country") in sorted order and
+            the dimension id of each code. The index is built once and rebuilt only
+            when the dimension table grows.
+
+        Parameters
+        ----------
+        level: str
+            The level of the codes.
+
+        Returns
+        -------
+        tuple[list, list]
+            The sorted codes and their ids.
+        """
+        _, dimension, code = LEVELS[level]
+        table = self.reader().table(dimension)
+        size = table.count("*").fetchone()[0]
+        if level not in self._code_index or self._code_index[level][0] != size:
+            pairs = sorted(
+                table.filter(f"{code} IS NOT NULL").select(code, "id").fetchall()
+            )
+            codes = [code for code, _ in pairs]
+            ids = [id for _, id in pairs]
+            self._code_index[level] = (size, codes, ids)
+        return self._code_index[level][1:]
+
+    def level_ids(self, level: str, level_filter: str) -> list:
+        """
+        Returns the dimension ids of the codes of a level starting with level_filter,
+            found by binary search over code_index without reading the fact table.
+
+        Parameters
+        ----------
+        level: str
+            The level of the codes ("hts", "naics" or "country").
+        level_filter: str
+            The prefix of the codes.
+
+        Returns
+        -------
+        list
+            The ids of the matching codes, empty if no code matches.
+        """
+        codes, ids = self.code_index(level)
+        start = bisect.bisect_left(codes, level_filter)
+        end = bisect.bisect_left(codes, level_filter + chr(0x10FFFF), lo=start)
+        return ids[start:end]
+
+    def add_descriptions(self, df: pl.LazyFrame) -> pl.LazyFrame:
+        """
+        Replaces every dimension key in df by its code (e.g. hts_id by hts_code) from
+            the dimension tables. The surrogate keys never reach the results.
 
         Parameters
         ----------
         df: pl.LazyFrame
-            Data to convert.
+            Aggregated data grouped by dimension keys.
 
         Returns
         -------
         pl.LazyFrame
-            Converted data.
+            The data with the codes in place of its dimension keys.
         """
-
-        df = df.with_columns(pl.col("qty_1", "qty_2").fill_null(strategy="zero"))
-        df = df.with_columns(
-            conv_1=pl.when(pl.col("unit_1").str.to_lowercase() == "kg")
-            .then(pl.col("qty_1") * 1)
-            .when(pl.col("unit_1").str.to_lowercase() == "l")
-            .then(pl.col("qty_1") * 1)
-            .when(pl.col("unit_1").str.to_lowercase() == "doz")
-            .then(pl.col("qty_1") / 0.756)
-            .when(pl.col("unit_1").str.to_lowercase() == "m3")
-            .then(pl.col("qty_1") * 1560)
-            .when(pl.col("unit_1").str.to_lowercase() == "t")
-            .then(pl.col("qty_1") * 907.185)
-            .when(pl.col("unit_1").str.to_lowercase() == "kts")
-            .then(pl.col("qty_1") * 1)
-            .when(pl.col("unit_1").str.to_lowercase() == "pfl")
-            .then(pl.col("qty_1") * 0.789)
-            .when(pl.col("unit_1").str.to_lowercase() == "gm")
-            .then(pl.col("qty_1") * 1000)
-            .otherwise(pl.col("qty_1")),
-            conv_2=pl.when(pl.col("unit_2").str.to_lowercase() == "kg")
-            .then(pl.col("qty_2") * 1)
-            .when(pl.col("unit_2").str.to_lowercase() == "l")
-            .then(pl.col("qty_2") * 1)
-            .when(pl.col("unit_2").str.to_lowercase() == "doz")
-            .then(pl.col("qty_2") / 0.756)
-            .when(pl.col("unit_2").str.to_lowercase() == "m3")
-            .then(pl.col("qty_2") * 1560)
-            .when(pl.col("unit_2").str.to_lowercase() == "t")
-            .then(pl.col("qty_2") * 907.185)
-            .when(pl.col("unit_2").str.to_lowercase() == "kts")
-            .then(pl.col("qty_2") * 1)
-            .when(pl.col("unit_2").str.to_lowercase() == "pfl")
-            .then(pl.col("qty_2") * 0.789)
-            .when(pl.col("unit_2").str.to_lowercase() == "gm")
-            .then(pl.col("qty_2") * 1000)
-            .otherwise(pl.col("qty_2")),
-            qrt=pl.when(
-                (pl.col("date").dt.month() >= 1) & (pl.col("date").dt.month() <= 3)
+        for fact_key, dimension, code in LEVELS.values():
+            columns = df.collect_schema().names()
+            if fact_key not in columns:
+                continue
+            codes = (
+                self.reader().table(dimension).select(f"id AS {fact_key}, {code}").pl()
+            )
+            position = columns.index(fact_key)
+            df = df.join(codes.lazy(), on=fact_key, how="left").select(
+                columns[:position] + [code] + columns[position + 1 :]
             )
-            .then(1)
-            .when((pl.col("date").dt.month() >= 4) & (pl.col("date").dt.month() <= 8))
-            .then(2)
-            .when((pl.col("date").dt.month() >= 7) & (pl.col("date").dt.month() <= 9))
-            .then(3)
-            .when((pl.col("date").dt.month() >= 10) & (pl.col("date").dt.month() <= 12))
-            .then(4),
-            fiscal_year=pl.when(pl.col("date").dt.month() > 6)
-            .then(pl.col("date").dt.year() + 1)
-            .otherwise(pl.col("date").dt.year())
-            .alias("fiscal_year"),
-            month=pl.col("date").dt.month(),
-            year=pl.col("date").dt.year(),
-        ).with_columns(qty=pl.col("conv_1") + pl.col("conv_2"))
         return df
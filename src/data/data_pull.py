@@ -1,20 +1,111 @@
 import comtradeapicall
+from .data_comtrade import ComtradeFetcher, ComtradeQuery
+from .data_download import DataDownload
 from ..models import (
     get_conn,
     init_int_trade_data_table,
     init_jp_trade_data_table,
     init_com_trade_data_table,
+    init_com_trade_ledger_table,
+    init_ingest_watermark_table,
+    init_ingest_months_table,
 )
-from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Iterable, Iterator
+import pyarrow.parquet as pq
+import pyarrow.csv as pv
+import pyarrow as pa
 import polars as pl
+import duckdb
 import pandas as pd
 import datetime
 import requests
 import logging
+import itertools
+import threading
 import zipfile
+import hashlib
+import shutil
+import tempfile
 import urllib3
+import codecs
+import io
+import json
+import csv
 import os
 
+ORG_SCHEMA = {
+    "import_export": pl.String,
+    "country": pl.String,
+    "year": pl.Int64,
+    "month": pl.Int64,
+    "value": pl.Int64,
+    "unit_1": pl.String,
+    "qty_1": pl.Int64,
+    "unit_2": pl.String,
+    "qty_2": pl.Int64,
+    "HTS": pl.String,
+    "HTS_desc": pl.String,
+}
+
+# Factor converting every quantity unit to its target unit, overridden by
+# external/unit_conversion.csv (unit_code,factor,target_unit). Other units are kept.
+UNIT_CONVERSION = pl.DataFrame(
+    [
+        ("kg", 1.0, "kg"),
+        ("l", 1.0, "l"),
+        ("doz", 1 / 0.756, "kg"),
+        ("m3", 1560.0, "kg"),
+        ("t", 907.185, "kg"),
+        ("kts", 1.0, "kg"),
+        ("pfl", 0.789, "l"),
+        ("gm", 1000.0, "kg"),
+    ],
+    schema={"unit_code": pl.String, "factor": pl.Float64, "target_unit": pl.String},
+    orient="row",
+)
+
+# Rough in-memory size of a source row with its dimension attributes, used to split
+# the months loaded by ingest into batches that fit the memory budget
+INGEST_ROW_BYTES = 1024
+
+# Dimension tables of the star schema: fact key, natural key and attributes
+DIMENSIONS = {
+    "htstable": (
+        "hts_id",
+        "hts_code",
+        ["hts_short_desc", "hts_long_desc", "agri_prod"],
+    ),
+    "countrytable": ("country_id", "country_name", ["cty_code"]),
+    "districttable": ("district_id", "district_code", ["district_desc"]),
+    "sitctable": ("sitc_id", "sitc_code", ["sitc_short_desc", "sitc_long_desc"]),
+    "naicstable": ("naics_id", "naics_code", ["naics_description"]),
+}
+
+
+class _HeadStream(io.RawIOBase):
+    """
+    Readable stream returning bytes already read from a file followed by the rest of
+        the file, so a non-seekable stream can be sniffed and still read once.
+    """
+
+    def __init__(self, head: bytes, file):
+        self.head = head
+        self.file = file
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.head:
+            data, self.head = self.head[: len(buffer)], self.head[len(buffer) :]
+        else:
+            data = self.file.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
 
 class DataPull:
     """
@@ -27,10 +118,23 @@ class DataPull:
         saving_dir: str = "data/",
         database_file: str = "data.ddb",
         log_file: str = "data_process.log",
+        backend: str = "duckdb",
+        memory_limit: int = 0,
+        spill_dir: str = "",
     ):
+        if backend not in ("duckdb", "lake"):
+            raise ValueError(f"Invalid backend: {backend}. Use 'duckdb' or 'lake'")
         self.saving_dir = saving_dir
         self.data_file = database_file
-        self.conn = get_conn(self.data_file)
+        self.backend = backend
+        self.lake_dir = os.path.join(saving_dir, "processed")
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir or os.path.join(self.lake_dir, "spill")
+        self._conn = None
+        self._reader = None
+        self._views = set()
+        self.session = self.get_session()
+        self.downloader = DataDownload(session=self.session)
 
         logging.basicConfig(
             level=logging.INFO,
@@ -46,132 +150,448 @@ class DataPull:
         if not os.path.exists(self.saving_dir + "external"):
             os.makedirs(self.saving_dir + "external")
 
-    def pull_int_org(self) -> None:
+    @property
+    def conn(self) -> duckdb.DuckDBPyConnection:
+        """
+        Connection to the DuckDB database, opened on first use so that processes only
+            reading the Parquet lake never take the database lock.
+        """
+        if self._conn is None:
+            self._conn = get_conn(self.data_file)
+            self.configure(self._conn)
+        return self._conn
+
+    def configure(self, conn: duckdb.DuckDBPyConnection) -> None:
+        """
+        Applies the memory budget to a connection. With a memory_limit (in bytes)
+            DuckDB keeps its memory under the limit and spills the intermediates of
+            large joins, aggregates and sorts to spill_dir instead of failing.
+        """
+        if self.memory_limit > 0:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            conn.sql(f"SET memory_limit = '{int(self.memory_limit)}B';")
+            conn.sql(f"SET temp_directory = '{self.spill_dir}';")
+
+    def reader(self) -> duckdb.DuckDBPyConnection:
+        """
+        Connection queries go through. With the "duckdb" backend it is the database
+            connection. With the "lake" backend it is an in-memory connection with a
+            view over the Parquet files of every table in the lake. A view is created
+            the first time its table shows up and globs the files at query time, so
+            partitions written later are picked up.
+        """
+        if self.backend == "duckdb":
+            return self.conn
+        if self._reader is None:
+            self._reader = duckdb.connect()
+            self.configure(self._reader)
+        dimensions = os.path.join(self.lake_dir, "dimensions")
+        for file in sorted(os.listdir(dimensions)) if os.path.isdir(dimensions) else []:
+            if file.endswith(".parquet") and file[:-8] not in self._views:
+                self._views.add(file[:-8])
+                self._reader.sql(f"""
+                    CREATE OR REPLACE VIEW "{file[:-8]}" AS
+                    SELECT * FROM read_parquet('{os.path.join(dimensions, file)}');
+                    """)
+        sources = os.listdir(self.lake_dir) if os.path.isdir(self.lake_dir) else []
+        for table in sorted(sources):
+            if not table.startswith("source=") or table[7:] in self._views:
+                continue
+            if self.lake_exists(table[7:]):
+                self._views.add(table[7:])
+                files = os.path.join(self.lake_dir, table, "**", "*.parquet")
+                self._reader.sql(f"""
+                    CREATE OR REPLACE VIEW "{table[7:]}" AS
+                    SELECT * EXCLUDE (source)
+                    FROM read_parquet(
+                        '{files}',
+                        hive_partitioning = true,
+                        hive_types = {{
+                            'year': INTEGER, 'month': TINYINT, 'trade_id': INTEGER
+                        }}
+                    );
+                    """)
+        return self._reader
+
+    def lake_exists(self, table: str) -> bool:
+        """
+        Checks whether the Parquet lake holds partitions of a fact table.
+        """
+        path = os.path.join(self.lake_dir, f"source={table}")
+        return os.path.isdir(path) and len(os.listdir(path)) > 0
+
+    def trade_table(self, table: str) -> duckdb.DuckDBPyRelation:
+        """
+        Returns a relation over a fact table ("jptradedata" or "inttradedata"), loading
+            the source first if needed. With the "lake" backend an existing dataset is
+            read as is, without opening the database, so several processes can query it
+            at the same time; insert_int_jp and insert_int_org load new releases.
+        """
+        if self.backend == "lake" and self.lake_exists(table):
+            return self.reader().table(table)
+        if table == "jptradedata":
+            return self.insert_int_jp()
+        return self.insert_int_org()
+
+    def write_lake(self, table: str, facts: pl.DataFrame) -> None:
+        """
+        Writes the months of facts to the Parquet lake, partitioned as
+            processed/source=<table>/year=<year>/month=<month>/trade_id=<trade_id>/.
+            The partitions are written to a staging directory and their files are
+            renamed over the files of the existing partitions instead of replacing the
+            month directories. Each file is swapped atomically, so a reader never finds
+            a month missing; while a month is being swapped it may still see the old
+            file of one trade flow next to the new file of the other.
+        """
+        staging = os.path.join(self.lake_dir, f".staging-{table}")
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+        os.makedirs(staging)
+        target = os.path.join(staging, f"source={table}")
+        schema = self.conn.table(table).limit(0).pl().drop("id", strict=False).schema
+        facts = facts.cast(dict(schema)).with_columns(
+            year=pl.col("date").dt.year(), month=pl.col("date").dt.month()
+        )
+        self.conn.sql(f"""
+            COPY facts TO '{target}' (
+                FORMAT parquet, PARTITION_BY (year, month, trade_id), COMPRESSION zstd
+            );
+            """)
+        for year in os.listdir(target):
+            for month in os.listdir(os.path.join(target, year)):
+                new = os.path.join(target, year, month)
+                old = os.path.join(self.lake_dir, f"source={table}", year, month)
+                flows = os.listdir(new)
+                for flow in flows:
+                    os.makedirs(os.path.join(old, flow), exist_ok=True)
+                    files = os.listdir(os.path.join(new, flow))
+                    for file in files:
+                        os.replace(
+                            os.path.join(new, flow, file), os.path.join(old, flow, file)
+                        )
+                    for file in set(os.listdir(os.path.join(old, flow))) - set(files):
+                        os.remove(os.path.join(old, flow, file))
+                # Trade flows absent from the new month
+                for flow in set(os.listdir(old)) - set(flows):
+                    shutil.rmtree(os.path.join(old, flow))
+        shutil.rmtree(staging)
+
+    def export_dimensions(self) -> None:
+        """
+        Writes every dimension table to processed/dimensions/<table>.parquet for the
+            "lake" backend.
+        """
+        dimensions = os.path.join(self.lake_dir, "dimensions")
+        os.makedirs(dimensions, exist_ok=True)
+        for table in list(DIMENSIONS) + ["unittable", "tradetable"]:
+            file = os.path.join(dimensions, f"{table}.parquet")
+            self.conn.sql(f"COPY \"{table}\" TO '{file}.tmp' (FORMAT parquet);")
+            os.replace(file + ".tmp", file)
+
+    def get_session(self, pool_size: int = 16, retries: int = 5) -> requests.Session:
+        """
+        Creates a requests session with a connection pool shared by all the pulls and
+            retries with exponential backoff on connection errors and 429/5xx responses.
+
+        Parameters
+        ----------
+        pool_size: int
+            Maximum number of connections kept open per host.
+        retries: int
+            Number of retries of a failed request.
+
+        Returns
+        -------
+        requests.Session
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=1,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET"],
+            ),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def pull_int_org(
+        self,
+        streaming: bool = True,
+        row_group_size: int | None = None,
+        compression: str = "zstd",
+    ) -> None:
         """
         Pulls data from the Puerto Rico Institute of Statistics. Saves them in the
             raw directory as a parquet file.
 
         Parameters
         ----------
-        None
+        streaming: bool
+            If True, reads the nested zip archives as byte streams and sinks both
+            flows straight to parquet without extracting them to disk. If False,
+            extracts the archives in the raw directory and converts the CSVs.
+        row_group_size: int | None
+            Number of rows per parquet row group. Uses 262144 if None.
+        compression: str
+            Compression codec of the parquet file (e.g. "zstd", "snappy", "lz4").
 
         Returns
         -------
         None
         """
-        self.pull_file(
+        changed = self.pull_file(
             url="http://www.estadisticas.gobierno.pr/iepr/LinkClick.aspx?fileticket=JVyYmIHqbqc%3d&tabid=284&mid=244930",
             filename=(self.saving_dir + "raw/tmp.zip"),
         )
-        # Extract the zip file
-        with zipfile.ZipFile(self.saving_dir + "raw/tmp.zip", "r") as zip_ref:
-            zip_ref.extractall(f"{self.saving_dir}raw/")
+        if not changed and os.path.exists(self.saving_dir + "raw/org_data.parquet"):
+            logging.info("org_data.parquet is up to date")
+            return
+        additional_files = ["IMPORT_HTS10_ALL.zip", "EXPORT_HTS10_ALL.zip"]
 
-        # Extract additional zip files
-        additional_files = ["EXPORT_HTS10_ALL.zip", "IMPORT_HTS10_ALL.zip"]
-        for additional_file in additional_files:
-            additional_file_path = os.path.join(
-                f"{self.saving_dir}raw/{additional_file}"
+        if streaming:
+            self.zip_to_parquet(
+                zip_file=self.saving_dir + "raw/tmp.zip",
+                members=additional_files,
+                parquet_file=self.saving_dir + "raw/org_data.parquet",
+                schema=ORG_SCHEMA,
+                row_group_size=row_group_size,
+                compression=compression,
             )
-            with zipfile.ZipFile(additional_file_path, "r") as zip_ref:
-                zip_ref.extractall(os.path.join(f"{self.saving_dir}raw/"))
+        else:
+            # Extract the zip file
+            with zipfile.ZipFile(self.saving_dir + "raw/tmp.zip", "r") as zip_ref:
+                zip_ref.extractall(f"{self.saving_dir}raw/")
 
-        # Concatenate the files
-        imports = pl.scan_csv(
-            self.saving_dir + "raw/IMPORT_HTS10_ALL.csv", ignore_errors=True
-        )
-        exports = pl.scan_csv(
-            self.saving_dir + "raw/EXPORT_HTS10_ALL.csv", ignore_errors=True
-        )
-        pl.concat([imports, exports], how="vertical").collect().write_parquet(
-            self.saving_dir + "raw/org_data.parquet"
-        )
+            # Extract additional zip files
+            for additional_file in additional_files:
+                additional_file_path = os.path.join(
+                    f"{self.saving_dir}raw/{additional_file}"
+                )
+                with zipfile.ZipFile(additional_file_path, "r") as zip_ref:
+                    zip_ref.extractall(os.path.join(f"{self.saving_dir}raw/"))
+
+            # Concatenate the files
+            self.csv_batches_to_parquet(
+                csv_files=[
+                    self.saving_dir + "raw/IMPORT_HTS10_ALL.csv",
+                    self.saving_dir + "raw/EXPORT_HTS10_ALL.csv",
+                ],
+                parquet_file=self.saving_dir + "raw/org_data.parquet",
+                row_group_size=row_group_size,
+                compression=compression,
+            )
 
         logging.info(
             "finished extracting data from the Puerto Rico Institute of Statistics"
         )
 
-    def insert_int_org(self) -> pl.DataFrame:
-        if (
-            "inttradedata"
-            not in self.conn.sql("SHOW TABLES;").df().get("name").tolist()
+    def zip_to_parquet(
+        self,
+        zip_file: str,
+        members: list,
+        parquet_file: str,
+        schema: dict,
+        row_group_size: int | None = None,
+        compression: str = "zstd",
+    ) -> None:
+        """
+        Converts the CSVs found in nested zip archives to a single parquet file. Each
+            member is decompressed as a byte stream in its own thread and written in
+            bounded row groups, so no CSV is extracted to disk and memory stays flat.
+
+        Parameters
+        ----------
+        zip_file: str
+            The outer zip archive.
+        members: list
+            Names of the nested zip archives inside zip_file. Each must hold one CSV.
+        parquet_file: str
+            The parquet file to write.
+        schema: dict
+            Polars dtypes of the CSV columns. Values that fail to cast become null.
+        row_group_size: int | None
+            Number of rows per parquet row group. Uses 262144 if None.
+        compression: str
+            Compression codec of the parquet file.
+
+        Returns
+        -------
+        None
+        """
+        row_group_size = row_group_size or 512**2
+        tmp_file = parquet_file + ".tmp"
+        lock = threading.Lock()
+        writer = None
+
+        def write(df: pl.DataFrame) -> None:
+            nonlocal writer
+            table = df.to_arrow()
+            with lock:
+                if writer is None:
+                    writer = pq.ParquetWriter(
+                        tmp_file, table.schema, compression=compression
+                    )
+                writer.write_table(table, row_group_size=row_group_size)
+
+        def convert(member: str) -> int:
+            rows = 0
+            buffer, buffered = [], 0
+            for df in self._read_nested_csv(zip_file, member, schema):
+                buffer.append(df)
+                rows += len(df)
+                buffered += len(df)
+                if buffered >= row_group_size:
+                    write(pl.concat(buffer, how="vertical"))
+                    buffer, buffered = [], 0
+            if buffer:
+                write(pl.concat(buffer, how="vertical"))
+            logging.info(f"Decoded {rows} rows from {member}")
+            return rows
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(members)) as executor:
+                list(executor.map(convert, members))
+        finally:
+            if writer is not None:
+                writer.close()
+        os.replace(tmp_file, parquet_file)
+
+    def _read_nested_csv(self, zip_file: str, member: str, schema: dict):
+        """
+        Yields the CSV inside the nested archive member of zip_file in batches of
+            polars DataFrames cast to schema. Reading a zip archive takes seeks, which
+            a compressed member can only serve by inflating it again from the start, so
+            the nested archive is copied once to a spooled temporary file (in memory up
+            to 64 MiB). The CSV is then streamed once: its header is parsed from the
+            first block, which is handed on to the CSV reader with the rest.
+        """
+        with (
+            zipfile.ZipFile(zip_file, "r") as outer,
+            tempfile.SpooledTemporaryFile(max_size=64 * 1024**2) as nested,
         ):
-            init_int_trade_data_table(self.data_file)
-        if self.conn.sql("SELECT * FROM 'inttradedata';").df().empty:
-            if not os.path.exists(f"{self.saving_dir}raw/org_data.parquet"):
-                self.pull_int_org()
-            if not os.path.exists(f"{self.saving_dir}external/code_agr.json"):
-                logging.debug(
-                    "https://raw.githubusercontent.com/ouslan/jp-imports/main/data/external/code_agr.json"
+            with outer.open(member) as source:
+                shutil.copyfileobj(source, nested, 1024 * 1024)
+            nested.seek(0)
+            with zipfile.ZipFile(nested, "r") as inner:
+                csv_name = next(
+                    name for name in inner.namelist() if name.lower().endswith(".csv")
                 )
-                self.pull_file(
-                    url="https://raw.githubusercontent.com/ouslan/jp-imports/main/data/external/code_agr.json",
-                    filename=(f"{self.saving_dir}external/code_agr.json"),
-                )
-            agri_prod = pl.read_json(
-                f"{self.saving_dir}external/code_agr.json"
-            ).transpose()
-            agri_prod = (
-                agri_prod.with_columns(pl.nth(0).cast(pl.String).str.zfill(4))
-                .to_series()
-                .to_list()
-            )
-            int_df = pl.scan_parquet(f"{self.saving_dir}raw/org_data.parquet")
-            int_df = int_df.rename(
-                {col: col.lower() for col in int_df.collect_schema().names()}
-            )
-            int_df = int_df.with_columns(
-                date=pl.col("year").cast(pl.String)
-                + "-"
-                + pl.col("month").cast(pl.String)
-                + "-01",
-                unit_1=pl.col("unit_1").str.to_lowercase(),
-                unit_2=pl.col("unit_2").str.to_lowercase(),
-                hts_code=pl.col("hts")
-                .cast(pl.String)
-                .str.zfill(10)
-                .str.replace("'", ""),
-                trade_id=pl.when(pl.col("import_export") == "i").then(1).otherwise(2),
-            ).rename({"value": "data"})
-
-            int_df = int_df.with_columns(pl.col("date").cast(pl.Date))
-
-            int_df = int_df.with_columns(hs4=pl.col("hts_code").str.slice(0, 4))
-
-            int_df = int_df.with_columns(
-                agri_prod=pl.when(pl.col("hs4").is_in(agri_prod)).then(1).otherwise(0)
-            )
+                with inner.open(csv_name) as file:
+                    head = file.read(1024 * 1024)
+                    while b"\n" not in head and (block := file.read(1024 * 1024)):
+                        head += block
+                    line = head.split(b"\n", 1)[0].decode("utf-8")
+                    header = next(csv.reader([line]))
+                    reader = pv.open_csv(
+                        _HeadStream(head, file),
+                        convert_options=pv.ConvertOptions(
+                            column_types={col: pa.string() for col in header},
+                            strings_can_be_null=True,
+                        ),
+                    )
+                    for batch in reader:
+                        df = pl.from_arrow(batch)
+                        yield df.cast(
+                            {col: schema[col] for col in df.columns if col in schema},
+                            strict=False,
+                        )
 
-            int_df = int_df.select(
-                pl.col(
-                    "date",
-                    "country",
-                    "trade_id",
-                    "agri_prod",
-                    "hts_code",
-                    "hts_desc",
-                    "data",
-                    "qty_1",
-                    "unit_1",
-                    "qty_2",
-                    "unit_2",
-                )
-            ).collect()
+    def insert_int_org(self, update: bool = False) -> duckdb.DuckDBPyRelation:
+        """
+        Loads the org_data.parquet release in the inttradedata table. Only months
+            that are new or were revised since the last load are written (see ingest).
 
-            self.conn.sql("INSERT INTO 'inttradedata' BY NAME SELECT * FROM int_df;")
-            logging.info("finished inserting data into the database")
-            return self.conn.sql("SELECT * FROM 'inttradedata';").pl()
-        else:
-            return self.conn.sql("SELECT * FROM 'inttradedata';").pl()
+        Parameters
+        ----------
+        update: bool
+            If True, checks for a new release before loading.
 
-    def pull_int_jp(self, update: bool = False) -> None:
+        Returns
+        -------
+        duckdb.DuckDBPyRelation
+            A lazy relation over the inttradedata table. Filters and projections applied
+                to it run inside DuckDB; nothing is read until it is materialized.
+        """
+        self.drop_legacy_table("inttradedata")
+        if not self.table_exists("inttradedata"):
+            init_int_trade_data_table(self.data_file)
+        if update or not os.path.exists(f"{self.saving_dir}raw/org_data.parquet"):
+            self.pull_int_org()
+        agri_prod = self.agri_codes()
+
+        int_df = pl.scan_parquet(f"{self.saving_dir}raw/org_data.parquet")
+        int_df = int_df.rename(
+            {col: col.lower() for col in int_df.collect_schema().names()}
+        )
+        int_df = int_df.with_columns(
+            date=pl.col("year").cast(pl.String)
+            + "-"
+            + pl.col("month").cast(pl.String)
+            + "-01",
+            unit_1=pl.col("unit_1").str.to_lowercase(),
+            unit_2=pl.col("unit_2").str.to_lowercase(),
+            hts_code=pl.col("hts").cast(pl.String).str.zfill(10).str.replace("'", ""),
+            trade_id=pl.when(pl.col("import_export") == "i").then(1).otherwise(2),
+        ).rename({"value": "data"})
+
+        int_df = int_df.with_columns(pl.col("date").cast(pl.Date))
+
+        int_df = int_df.with_columns(hs4=pl.col("hts_code").str.slice(0, 4))
+
+        int_df = int_df.with_columns(
+            agri_prod=pl.col("hs4").is_in(agri_prod),
+            hts_short_desc=pl.col("hts_desc"),
+            hts_long_desc=pl.col("hts_desc"),
+            country_name=pl.col("country"),
+        )
+
+        int_df = int_df.select(
+            pl.col(
+                "date",
+                "trade_id",
+                "hts_code",
+                "hts_short_desc",
+                "hts_long_desc",
+                "agri_prod",
+                "country_name",
+                "data",
+                "qty_1",
+                "unit_1",
+                "qty_2",
+                "unit_2",
+            )
+        )
+        int_df = self.convert_units(int_df)
+        self.ingest("inttradedata", int_df, f"{self.saving_dir}raw/org_data.parquet")
+        return self.reader().table("inttradedata")
+
+    def pull_int_jp(
+        self,
+        update: bool = False,
+        streaming: bool = True,
+        row_group_size: int | None = None,
+        compression: str = "zstd",
+    ) -> None:
         """
         Pulls data from the Puerto Rico Institute of Statistics used by the JP.
             Saved them in the raw directory as parquet files.
 
         Parameters
         ----------
-        None
+        update: bool
+            If True, pulls the data even if the parquet file already exists.
+        streaming: bool
+            If True, converts the CSV to parquet in bounded batches instead of
+            loading the whole file in memory.
+        row_group_size: int | None
+            Number of rows per parquet row group. Uses 262144 if None.
+        compression: str
+            Compression codec of the parquet file (e.g. "zstd", "snappy", "lz4").
 
         Returns
         -------
@@ -192,95 +612,540 @@ class DataPull:
                 "https://datos.estadisticas.pr/dataset/027ddbe1-c51c-46bf-aec3-a62d5d7e8539/resource/b8367825-a3de-41cf-8794-e42c10987b6f/download/ftrade_all_iepr.csv"
             )
             url = "https://datos.estadisticas.pr/dataset/027ddbe1-c51c-46bf-aec3-a62d5d7e8539/resource/b8367825-a3de-41cf-8794-e42c10987b6f/download/ftrade_all_iepr.csv"
-            self.pull_file(
+            changed = self.pull_file(
                 url=url, filename=(self.saving_dir + "raw/jp_data.csv"), verify=False
             )
-            pl.read_csv(
-                f"{self.saving_dir}/raw/jp_data.csv", ignore_errors=True
-            ).write_parquet(f"{self.saving_dir}/raw/jp_data.parquet")
+            if changed or not os.path.exists(self.saving_dir + "raw/jp_data.parquet"):
+                self.csv_to_parquet(
+                    csv_file=f"{self.saving_dir}raw/jp_data.csv",
+                    parquet_file=f"{self.saving_dir}raw/jp_data.parquet",
+                    streaming=streaming,
+                    row_group_size=row_group_size,
+                    compression=compression,
+                )
 
         logging.info("Pulling data from the Puerto Rico Institute of Statistics")
 
-    def insert_int_jp(self) -> pl.DataFrame:
-        if "jptradedata" not in self.conn.sql("SHOW TABLES;").df().get("name").tolist():
-            init_jp_trade_data_table(self.data_file)
+    def csv_to_parquet(
+        self,
+        csv_file: str,
+        parquet_file: str,
+        streaming: bool = True,
+        row_group_size: int | None = None,
+        compression: str = "zstd",
+    ) -> None:
+        """
+        Converts a CSV file to parquet. The parquet file is written next to its final
+            location and moved in place once complete, so readers never see a partial file.
 
-        if self.conn.sql("SELECT * FROM 'jptradedata';").df().empty:
-            if not os.path.exists(f"{self.saving_dir}raw/jp_data.parquet"):
-                self.pull_int_jp()
-            if not os.path.exists(f"{self.saving_dir}external/code_agr.json"):
-                logging.debug(
-                    "https://raw.githubusercontent.com/ouslan/jp-imports/main/data/external/code_agr.json"
+        Parameters
+        ----------
+        csv_file: str
+            The CSV file to convert.
+        parquet_file: str
+            The parquet file to write.
+        streaming: bool
+            If True, scans the CSV lazily and sinks it to parquet in bounded batches,
+            keeping memory flat regardless of the file size. If False, reads the
+            whole CSV in memory before writing it.
+        row_group_size: int | None
+            Number of rows per parquet row group. Uses 262144 if None.
+        compression: str
+            Compression codec of the parquet file.
+
+        Returns
+        -------
+        None
+        """
+        row_group_size = row_group_size or 512**2
+        if streaming:
+            self.csv_batches_to_parquet(
+                [csv_file], parquet_file, row_group_size, compression
+            )
+        else:
+            tmp_file = parquet_file + ".tmp"
+            pq.write_table(
+                pl.read_csv(csv_file, ignore_errors=True).to_arrow(),
+                tmp_file,
+                row_group_size=row_group_size,
+                compression=compression,
+            )
+            os.replace(tmp_file, parquet_file)
+        logging.info(f"Converted {csv_file} to {parquet_file}")
+
+    def csv_batches_to_parquet(
+        self,
+        csv_files: list,
+        parquet_file: str,
+        row_group_size: int | None = None,
+        compression: str = "zstd",
+    ) -> None:
+        """
+        Converts CSV files with the same columns to a single parquet file batch by
+            batch, so memory stays flat regardless of the file size. The dtypes are
+            inferred from the first file like pl.read_csv and values that fail to parse
+            become null. Every row group but the last holds exactly row_group_size rows.
+
+        Parameters
+        ----------
+        csv_files: list
+            The CSV files to convert, written in order.
+        parquet_file: str
+            The parquet file to write.
+        row_group_size: int | None
+            Number of rows per parquet row group. Uses 262144 if None.
+        compression: str
+            Compression codec of the parquet file.
+
+        Returns
+        -------
+        None
+        """
+        row_group_size = row_group_size or 512**2
+        schema = pl.scan_csv(csv_files[0], ignore_errors=True).collect_schema()
+        tmp_file = parquet_file + ".tmp"
+        writer = None
+
+        def write(df: pl.DataFrame) -> None:
+            nonlocal writer
+            table = df.to_arrow()
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    tmp_file, table.schema, compression=compression
                 )
-                self.pull_file(
-                    url="https://raw.githubusercontent.com/ouslan/jp-imports/main/data/external/code_agr.json",
-                    filename=(f"{self.saving_dir}external/code_agr.json"),
+            writer.write_table(table, row_group_size=row_group_size)
+
+        buffer, rows = [], 0
+        try:
+            for csv_file in csv_files:
+                reader = pl.read_csv_batched(
+                    csv_file, schema_overrides=schema, ignore_errors=True
                 )
-            agri_prod = pl.read_json(
-                f"{self.saving_dir}external/code_agr.json"
-            ).transpose()
-            agri_prod = (
-                agri_prod.with_columns(pl.nth(0).cast(pl.String).str.zfill(4))
-                .to_series()
-                .to_list()
-            )
-            jp_df = pl.read_parquet(f"{self.saving_dir}raw/jp_data.parquet")
-            jp_df = jp_df.rename(
-                {col: col.lower() for col in jp_df.collect_schema().names()}
+                while batches := reader.next_batches(1):
+                    buffer += batches
+                    rows += len(batches[0])
+                    while rows >= row_group_size:
+                        df = pl.concat(buffer, how="vertical")
+                        write(df.slice(0, row_group_size))
+                        buffer = [df.slice(row_group_size)]
+                        rows -= row_group_size
+            if rows > 0 or writer is None:
+                write(
+                    pl.concat(buffer, how="vertical") if buffer else schema.to_frame()
+                )
+        finally:
+            if writer is not None:
+                writer.close()
+        os.replace(tmp_file, parquet_file)
+
+    def insert_int_jp(self, update: bool = False) -> duckdb.DuckDBPyRelation:
+        """
+        Loads the jp_data.parquet release in the jptradedata table. Only months
+            that are new or were revised since the last load are written (see ingest).
+
+        Parameters
+        ----------
+        update: bool
+            If True, checks for a new release before loading.
+
+        Returns
+        -------
+        duckdb.DuckDBPyRelation
+            A lazy relation over the jptradedata table. Filters and projections applied
+                to it run inside DuckDB; nothing is read until it is materialized.
+        """
+        self.drop_legacy_table("jptradedata")
+        if not self.table_exists("jptradedata"):
+            init_jp_trade_data_table(self.data_file)
+        if update or not os.path.exists(f"{self.saving_dir}raw/jp_data.parquet"):
+            self.pull_int_jp(update=update)
+        agri_prod = self.agri_codes()
+
+        jp_df = pl.scan_parquet(f"{self.saving_dir}raw/jp_data.parquet")
+        jp_df = jp_df.rename(
+            {col: col.lower() for col in jp_df.collect_schema().names()}
+        )
+        jp_df = jp_df.with_columns(
+            date=pl.col("year").cast(pl.String)
+            + "-"
+            + pl.col("month").cast(pl.String)
+            + "-01",
+            unit_1=pl.col("unit_1").str.to_lowercase(),
+            unit_2=pl.col("unit_2").str.to_lowercase(),
+            hts_code=pl.col("commodity_code")
+            .cast(pl.String)
+            .str.zfill(10)
+            .str.replace("'", ""),
+            trade_id=pl.when(pl.col("trade") == "i").then(1).otherwise(2),
+        )
+
+        jp_df = jp_df.with_columns(pl.col("date").cast(pl.Date))
+
+        jp_df = jp_df.with_columns(
+            agri_prod=pl.col("hts_code").str.slice(0, 4).is_in(agri_prod)
+        )
+        jp_df = jp_df.with_columns(
+            sitc=pl.when(pl.col("sitc_short_desc").str.starts_with("Civilian"))
+            .then(9998)
+            .when(pl.col("sitc_short_desc").str.starts_with("-"))
+            .then(9999)
+            .otherwise(pl.col("sitc"))
+        )
+        jp_df = jp_df.filter(pl.col("hts_code").is_not_null())
+        jp_df = jp_df.select(
+            "date",
+            "trade_id",
+            "hts_code",
+            "agri_prod",
+            "data",
+            "end_use_i",
+            "end_use_e",
+            "qty_1",
+            "unit_1",
+            "qty_2",
+            "unit_2",
+            hts_short_desc=pl.col("commodity_short_name"),
+            hts_long_desc=pl.col("hts_desc"),
+            cty_code=pl.col("cty_code").cast(pl.String),
+            country_name=pl.col("country"),
+            district_code=pl.col("district").cast(pl.String),
+            district_desc=pl.col("districtdesc"),
+            sitc_code=pl.col("sitc").cast(pl.String),
+            sitc_short_desc=pl.col("sitc_short_desc"),
+            sitc_long_desc=pl.col("sitc_long_desc"),
+            naics_code=pl.col("naics").cast(pl.String),
+            naics_description=pl.col("naics_description"),
+        )
+        jp_df = self.convert_units(jp_df)
+        self.ingest("jptradedata", jp_df, f"{self.saving_dir}raw/jp_data.parquet")
+        return self.reader().table("jptradedata")
+
+    def agri_codes(self) -> list:
+        """
+        Returns the 4 digit HTS codes of agricultural products from code_agr.json.
+        """
+        if not os.path.exists(f"{self.saving_dir}external/code_agr.json"):
+            logging.debug(
+                "https://raw.githubusercontent.com/ouslan/jp-imports/main/data/external/code_agr.json"
             )
-            jp_df = jp_df.with_columns(
-                date=pl.col("year").cast(pl.String)
-                + "-"
-                + pl.col("month").cast(pl.String)
-                + "-01",
-                unit_1=pl.col("unit_1").str.to_lowercase(),
-                unit_2=pl.col("unit_2").str.to_lowercase(),
-                hts_code=pl.col("commodity_code")
-                .cast(pl.String)
-                .str.zfill(10)
-                .str.replace("'", ""),
-                trade_id=pl.when(pl.col("trade") == "i").then(1).otherwise(2),
+            self.pull_file(
+                url="https://raw.githubusercontent.com/ouslan/jp-imports/main/data/external/code_agr.json",
+                filename=(f"{self.saving_dir}external/code_agr.json"),
             )
+        agri_prod = pl.read_json(f"{self.saving_dir}external/code_agr.json").transpose()
+        return (
+            agri_prod.with_columns(pl.nth(0).cast(pl.String).str.zfill(4))
+            .to_series()
+            .to_list()
+        )
+
+    def source_fingerprint(self, source_file: str) -> str:
+        """
+        Returns the fingerprint of a raw source file: its size and modification time,
+            and the unit conversion table since the stored qty depends on it.
+        """
+        stat = os.stat(source_file)
+        units = self.unit_conversion().write_csv().encode()
+        units = hashlib.sha256(units).hexdigest()[:16]
+        return f"{stat.st_size}-{stat.st_mtime_ns}-{units}"
+
+    def unit_conversion(self) -> pl.DataFrame:
+        """
+        Returns the unit conversion table (unit_code, factor, target_unit), read from
+            external/unit_conversion.csv if it exists or UNIT_CONVERSION otherwise.
+        """
+        filename = f"{self.saving_dir}external/unit_conversion.csv"
+        if not os.path.exists(filename):
+            return UNIT_CONVERSION
+        return pl.read_csv(filename, schema=UNIT_CONVERSION.schema).with_columns(
+            pl.col("unit_code").str.to_lowercase()
+        )
+
+    def convert_units(self, df: pl.LazyFrame) -> pl.LazyFrame:
+        """
+        Adds qty, the sum of qty_1 and qty_2 converted with the unit conversion table,
+            to a frame with lowercase unit_1 and unit_2 columns.
 
-            jp_df = jp_df.with_columns(pl.col("date").cast(pl.Date))
+        Parameters
+        ----------
+        df: pl.LazyFrame
+            The frame to convert.
 
-            jp_df = jp_df.with_columns(
-                agri_prod=pl.when(pl.col("hts_code").is_in(agri_prod))
-                .then(1)
-                .otherwise(0)
+        Returns
+        -------
+        pl.LazyFrame
+            The frame with the qty column.
+        """
+        factors = self.unit_conversion().lazy().select("unit_code", "factor")
+        columns = df.collect_schema().names()
+        for unit in ("1", "2"):
+            df = df.join(
+                factors.rename({"factor": f"factor_{unit}"}),
+                left_on=f"unit_{unit}",
+                right_on="unit_code",
+                how="left",
             )
-            jp_df = jp_df.with_columns(
-                sitc=pl.when(pl.col("sitc_short_desc").str.starts_with("Civilian"))
-                .then(9998)
-                .when(pl.col("sitc_short_desc").str.starts_with("-"))
-                .then(9999)
-                .otherwise(pl.col("sitc"))
+        return df.select(
+            *columns,
+            qty=pl.col("qty_1").fill_null(0) * pl.col("factor_1").fill_null(1.0)
+            + pl.col("qty_2").fill_null(0) * pl.col("factor_2").fill_null(1.0),
+        )
+
+    def table_exists(self, table: str) -> bool:
+        """
+        Checks whether a table exists from the DuckDB catalog, without reading it.
+        """
+        return (
+            self.conn.execute(
+                "SELECT count(*) FROM duckdb_tables() WHERE table_name = $table;",
+                {"table": table},
+            ).fetchone()[0]
+            > 0
+        )
+
+    def table_rows(self, table: str) -> int:
+        """
+        Returns the row count of a table from the DuckDB catalog, without scanning it.
+            Returns 0 if the table does not exist.
+        """
+        row = self.conn.execute(
+            "SELECT estimated_size FROM duckdb_tables() WHERE table_name = $table;",
+            {"table": table},
+        ).fetchone()
+        return 0 if row is None else row[0]
+
+    def ingest(self, table: str, df: pl.LazyFrame, source_file: str) -> None:
+        """
+        Incrementally loads a source in a table. The ingestwatermark table keeps the
+            max date and a fingerprint of every source, and the ingestmonths table a
+            row count and checksum of every month loaded. An unchanged source is
+            skipped without being read; otherwise only months that are new or whose
+            checksum changed are replaced, with a delete and insert in one transaction.
+            With a memory_limit the changed months are read and loaded in batches of
+            whole months sized to the budget (see ingest_batches), so only one batch
+            is in memory at a time; every batch scans df again.
+
+        Parameters
+        ----------
+        table: str
+            The table to load (e.g. "jptradedata").
+        df: pl.LazyFrame
+            The source rows with a date column, the fact measures and the natural
+                keys and attributes of the dimensions (see load_dimensions).
+        source_file: str
+            The file df is read from, fingerprinted to detect new releases.
+
+        Returns
+        -------
+        None
+        """
+        if not self.table_exists("ingestwatermark"):
+            init_ingest_watermark_table(self.data_file)
+        if not self.table_exists("ingestmonths"):
+            init_ingest_months_table(self.data_file)
+
+        fingerprint = self.source_fingerprint(source_file)
+        watermark = self.conn.execute(
+            "SELECT max_date, fingerprint FROM 'ingestwatermark' WHERE source = $source;",
+            {"source": table},
+        ).fetchone()
+        loaded = (
+            self.lake_exists(table)
+            if self.backend == "lake"
+            else self.table_rows(table) > 0
+        )
+        if watermark is not None and watermark[1] == fingerprint and loaded:
+            logging.info(f"{source_file} is unchanged, {table} is up to date")
+            return
+
+        months = (
+            df.group_by("date")
+            .agg(
+                rows=pl.len(),
+                checksum=(pl.struct(pl.all()).hash() % 2**32).sum(),
             )
-            jp_df = jp_df.filter(pl.col("hts_code").is_not_null())
-            jp_df = jp_df.select(
-                pl.col(
-                    "date",
-                    "country",
-                    "trade_id",
-                    "agri_prod",
-                    "hts_code",
-                    "hts_desc",
-                    "data",
-                    "qty_1",
-                    "unit_1",
-                    "qty_2",
-                    "unit_2",
-                    "sitc",
-                    "naics",
+            .collect(streaming=self.memory_limit > 0)
+        )
+        loaded = self.conn.execute(
+            "SELECT date, checksum FROM 'ingestmonths' WHERE source = $source;",
+            {"source": table},
+        ).pl()
+        changed = months.join(loaded, on=["date", "checksum"], how="anti").sort("date")
+        max_date = months.get_column("date").max()
+
+        self.conn.begin()
+        try:
+            if self.backend == "duckdb":
+                self.conn.sql(
+                    f"DELETE FROM '{table}' WHERE date IN (SELECT date FROM changed);"
                 )
+            for batch in self.ingest_batches(changed):
+                new = df.join(batch.lazy().select("date"), on="date", how="semi")
+                facts = self.load_dimensions(table, new.collect())
+                if self.backend == "lake":
+                    self.export_dimensions()
+                    self.write_lake(table, facts)
+                else:
+                    self.conn.sql(f"INSERT INTO '{table}' BY NAME SELECT * FROM facts;")
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO 'ingestmonths'
+                SELECT $source, date, rows, checksum FROM changed;
+                """,
+                {"source": table},
             )
-            self.conn.sql("INSERT INTO 'jptradedata' BY NAME SELECT * FROM jp_df;")
-            logging.info("finished inserting data into the database")
-            return self.conn.sql("SELECT * FROM 'jptradedata';").pl()
-        else:
-            return self.conn.sql("SELECT * FROM 'jptradedata';").pl()
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO 'ingestwatermark'
+                VALUES ($source, $max_date, $fingerprint, current_localtimestamp());
+                """,
+                {"source": table, "max_date": max_date, "fingerprint": fingerprint},
+            )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        revised = 0 if watermark is None else (changed["date"] <= watermark[0]).sum()
+        logging.info(
+            f"Loaded {changed['rows'].sum()} rows in {table}: "
+            f"{len(changed) - revised} new and "
+            f"{revised} revised months, watermark at {max_date}"
+        )
+
+    def ingest_batches(self, changed: pl.DataFrame) -> list:
+        """
+        Splits the months ingest loads into batches of consecutive months holding
+            about memory_limit / INGEST_ROW_BYTES rows. A month larger than that is a
+            batch of its own. Without a memory_limit every month is in one batch.
+
+        Parameters
+        ----------
+        changed: pl.DataFrame
+            The months to load, with their date and rows.
+
+        Returns
+        -------
+        list
+            The batches, as slices of changed.
+        """
+        if self.memory_limit <= 0:
+            return [changed] if len(changed) > 0 else []
+        budget = max(1, self.memory_limit // INGEST_ROW_BYTES)
+        batches, start, rows = [], 0, 0
+        for i, month_rows in enumerate(changed.get_column("rows")):
+            if rows > 0 and rows + month_rows > budget:
+                batches.append(changed.slice(start, i - start))
+                start, rows = i, 0
+            rows += month_rows
+        if rows > 0:
+            batches.append(changed.slice(start))
+        return batches
+
+    def load_dimensions(self, table: str, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        Loads the dimension values of df in the dimension tables and replaces them by
+            their integer keys, so df can be inserted in the fact table.
 
-    def pull_comtrade(self, iso: str, trade_id, date, code) -> pl.DataFrame:
+        Parameters
+        ----------
+        table: str
+            The fact table df is loaded in.
+        df: pl.DataFrame
+            The source rows, with the natural keys and attributes of the dimensions.
+
+        Returns
+        -------
+        pl.DataFrame
+            The columns of the fact table.
+        """
+        for dimension, (fact_key, key, attributes) in DIMENSIONS.items():
+            if key not in df.columns:
+                continue
+            attributes = [column for column in attributes if column in df.columns]
+            ids = self.load_dimension(dimension, key, df.select(key, *attributes))
+            df = df.join(ids.rename({"id": fact_key}), on=key, how="left")
+
+        units = pl.concat(
+            [
+                df.select(unit_code=pl.col("unit_1")),
+                df.select(unit_code=pl.col("unit_2")),
+            ]
+        )
+        ids = self.load_dimension("unittable", "unit_code", units)
+        for column, fact_key in (("unit_1", "unit1_id"), ("unit_2", "unit2_id")):
+            df = df.join(
+                ids.rename({"id": fact_key, "unit_code": column}), on=column, how="left"
+            )
+
+        columns = [
+            column for column in self.conn.table(table).columns if column != "id"
+        ]
+        return df.select(columns)
+
+    def load_dimension(self, table: str, key: str, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        Inserts the values of df missing from a dimension table in one Arrow batch,
+            numbering them after the existing ids.
+
+        Parameters
+        ----------
+        table: str
+            The dimension table (e.g. "htstable").
+        key: str
+            The natural key of the dimension (e.g. "hts_code").
+        df: pl.DataFrame
+            The key and attributes of the dimension. The first row of every key wins.
+
+        Returns
+        -------
+        pl.DataFrame
+            The id and key of every value in the dimension table.
+        """
+        ids = self.conn.table(table).select(f"id::BIGINT AS id, {key}").pl()
+        missing = (
+            df.drop_nulls(key)
+            .unique(subset=key, keep="first")
+            .join(ids, on=key, how="anti")
+            .sort(key)
+        )
+        if missing.is_empty():
+            return ids
+
+        start = (ids.get_column("id").max() or 0) + 1
+        missing = missing.with_row_index("id", offset=start).with_columns(
+            pl.col("id").cast(pl.Int64)
+        )
+        rows = missing.to_arrow()
+        self.conn.sql(f"INSERT INTO '{table}' BY NAME SELECT * FROM rows;")
+        logging.info(f"Inserted {len(missing)} new values in {table}")
+        return pl.concat([ids, missing.select("id", key)])
+
+    def drop_legacy_table(self, table: str) -> None:
+        """
+        Drops a fact table stored in the old layout (text columns instead of dimension
+            keys) and resets its ingestion state, so it is reloaded.
+        """
+        if not self.table_exists(table):
+            return
+        if "hts_id" in self.conn.table(table).columns:
+            return
+        self.conn.sql(f'DROP TABLE "{table}";')
+        if self.table_exists("ingestwatermark"):
+            self.conn.execute(
+                "DELETE FROM 'ingestwatermark' WHERE source = $source;",
+                {"source": table},
+            )
+        if self.table_exists("ingestmonths"):
+            self.conn.execute(
+                "DELETE FROM 'ingestmonths' WHERE source = $source;",
+                {"source": table},
+            )
+        logging.info(f"Dropped {table} in the old layout, it will be reloaded")
+
+    def pull_comtrade(
+        self, iso: str, trade_id, date, code, max_records: int = 500
+    ) -> pl.DataFrame:
         df = comtradeapicall.previewFinalData(
             typeCode="C",
             freqCode="M",
@@ -293,7 +1158,7 @@ class DataPull:
             partner2Code=None,
             customsCode=None,
             motCode=None,
-            maxRecords=500,
+            maxRecords=max_records,
             format_output="JSON",
             aggregateBy=None,
             breakdownMode="classic",
@@ -306,116 +1171,293 @@ class DataPull:
         df = pl.from_pandas(df).cast(pl.String)
         return pl.DataFrame(df)
 
-    def insert_comtrade(self, iso: str):
-        if (
-            "comtradetable"
-            not in self.conn.sql("SHOW TABLES;").df().get("name").tolist()
-        ):
-            init_com_trade_data_table(self.data_file)
+    def insert_comtrade(
+        self,
+        iso: str | list,
+        max_workers: int = 4,
+        rate_limit: float = 1.0,
+        partners_per_query: int = 10,
+        batch_rows: int = 50_000,
+    ) -> pl.DataFrame:
+        """
+        Pulls the missing Comtrade exports of the partners and inserts them in the
+            comtradetable. Requests run concurrently through ComtradeFetcher, several
+            partners are batched in each request and responses are inserted in large
+            batches. A request split by HS level stores the rows of the codes below
+            its HS2 code, tagged with that code in queryCmdCode.
 
-        codes = (
-            self.insert_int_org()
-            .select(pl.col("hts_code").str.slice(0, 2).unique())
-            .to_series()
-            .to_list()
+        Parameters
+        ----------
+        iso: str | list
+            The partner code or list of partner codes to pull.
+        max_workers: int
+            Number of requests running at the same time.
+        rate_limit: float
+            Maximum number of requests started per second.
+        partners_per_query: int
+            Number of partner codes batched in a single request.
+        batch_rows: int
+            Number of rows buffered before they are inserted.
+
+        Returns
+        -------
+        pl.DataFrame
+            The comtradetable.
+        """
+        init_com_trade_data_table(self.data_file)
+        if not self.table_exists("comtradeledger"):
+            init_com_trade_ledger_table(self.data_file)
+            self.migrate_comtrade_ledger()
+
+        self.insert_int_org()
+        codes = [row[0] for row in self.conn.sql("""
+                SELECT DISTINCT substr(h.hts_code, 1, 2)
+                FROM 'inttradedata' AS f JOIN 'htstable' AS h ON f.hts_id = h.id;
+                """).fetchall() if row[0] is not None]
+        isos = [str(iso)] if isinstance(iso, (str, int)) else [str(i) for i in iso]
+        missing = {}
+        for partner in isos:
+            for key in self.plan_comtrade(partner, codes):
+                missing.setdefault(key, []).append(partner)
+        queries = [
+            ComtradeQuery(
+                period=f"{year}{str(month).zfill(2)}",
+                cmd_code=code,
+                flow_code="X",
+                partner_codes=tuple(partners[i : i + partners_per_query]),
+            )
+            for (year, month, code), partners in missing.items()
+            for i in range(0, len(partners), partners_per_query)
+        ]
+        fetcher = ComtradeFetcher(
+            fetch=self.pull_comtrade,
+            children=self.hts_children(),
+            max_workers=max_workers,
+            rate_limit=rate_limit,
         )
-        for year in range(2010, datetime.date.today().year + 1):
-            for month in range(1, 13):
-                for code in codes:
-                    if (
-                        not self.conn.sql(
-                            f"SELECT * FROM 'comtradetable' WHERE refYear={year} AND refMonth={month} AND cmdCode={code} AND partnerCode={iso};"
-                        )
-                        .df()
-                        .empty
-                    ):
-                        continue
-                    df = self.pull_comtrade(
-                        iso, "X", f"{year}{str(month).zfill(2)}", code
-                    )
-                    if df.is_empty():
-                        dummy_df = pl.DataFrame(
-                            [
-                                pl.Series("typeCode", [""], dtype=pl.String),
-                                pl.Series("freqCode", [""], dtype=pl.String),
-                                pl.Series("refPeriodId", [""], dtype=pl.String),
-                                pl.Series("refYear", [str(year)], dtype=pl.String),
-                                pl.Series("refMonth", [str(month)], dtype=pl.String),
-                                pl.Series("period", [""], dtype=pl.String),
-                                pl.Series("reporterCode", [""], dtype=pl.String),
-                                pl.Series("reporterISO", [""], dtype=pl.String),
-                                pl.Series("reporterDesc", [""], dtype=pl.String),
-                                pl.Series("flowCode", [""], dtype=pl.String),
-                                pl.Series("flowDesc", [""], dtype=pl.String),
-                                pl.Series("partnerCode", [iso], dtype=pl.String),
-                                pl.Series("partnerISO", [""], dtype=pl.String),
-                                pl.Series("partnerDesc", [""], dtype=pl.String),
-                                pl.Series("partner2Code", [""], dtype=pl.String),
-                                pl.Series("partner2ISO", [""], dtype=pl.String),
-                                pl.Series("partner2Desc", [""], dtype=pl.String),
-                                pl.Series("classificationCode", [""], dtype=pl.String),
-                                pl.Series(
-                                    "classificationSearchCode", [""], dtype=pl.String
-                                ),
-                                pl.Series(
-                                    "isOriginalClassification",
-                                    [""],
-                                    dtype=pl.String,
-                                ),
-                                pl.Series("cmdCode", [code], dtype=pl.String),
-                                pl.Series("cmdDesc", [""], dtype=pl.String),
-                                pl.Series("aggrLevel", [""], dtype=pl.String),
-                                pl.Series("isLeaf", [""], dtype=pl.String),
-                                pl.Series("customsCode", [""], dtype=pl.String),
-                                pl.Series("customsDesc", [""], dtype=pl.String),
-                                pl.Series("mosCode", [""], dtype=pl.String),
-                                pl.Series("motCode", [""], dtype=pl.String),
-                                pl.Series("motDesc", [""], dtype=pl.String),
-                                pl.Series("qtyUnitCode", [""], dtype=pl.String),
-                                pl.Series("qtyUnitAbbr", [""], dtype=pl.String),
-                                pl.Series("qty", [0.0], dtype=pl.Float64),
-                                pl.Series("isQtyEstimated", [""], dtype=pl.String),
-                                pl.Series("altQtyUnitCode", [""], dtype=pl.String),
-                                pl.Series("altQtyUnitAbbr", [""], dtype=pl.String),
-                                pl.Series("altQty", [0.0], dtype=pl.Float64),
-                                pl.Series("isAltQtyEstimated", [""], dtype=pl.String),
-                                pl.Series("netWgt", [0.0], dtype=pl.Float64),
-                                pl.Series("isNetWgtEstimated", [""], dtype=pl.String),
-                                pl.Series("grossWgt", [0.0], dtype=pl.Float64),
-                                pl.Series("isGrossWgtEstimated", [""], dtype=pl.String),
-                                pl.Series("cifvalue", [0.0], dtype=pl.Float64),
-                                pl.Series("fobvalue", [0.0], dtype=pl.Float64),
-                                pl.Series("primaryValue", [0.0], dtype=pl.Float64),
-                                pl.Series(
-                                    "legacyEstimationFlag", [""], dtype=pl.String
-                                ),
-                                pl.Series("isReported", [""], dtype=pl.String),
-                                pl.Series("isAggregate", [""], dtype=pl.String),
-                            ]
-                        )
-                        self.conn.sql(
-                            "INSERT INTO 'comtradetable' BY NAME SELECT * FROM dummy_df;"
-                        )
 
-                        logging.warning(
-                            f"Returned None for {year}-{month} for {code} Inserted dummy records for iso {iso}"
+        buffer = []
+        ledger = []
+        buffered = 0
+        try:
+            for query, df, status in fetcher.run(queries):
+                year, month = int(query.period[:4]), int(query.period[4:])
+                counts = {}
+                if status != "error" and not df.is_empty():
+                    buffer.append(df.with_columns(queryCmdCode=pl.lit(query.cmd_code)))
+                    counts = dict(df.group_by("partnerCode").len().iter_rows())
+                for partner in query.partner_codes:
+                    rows = counts.get(partner, 0)
+                    ledger.append(
+                        (
+                            partner,
+                            year,
+                            month,
+                            query.cmd_code,
+                            query.flow_code,
+                            status if status == "error" or rows else "empty",
+                            rows,
                         )
-                        continue
-                    elif len(df) == 500:
-                        logging.critical(
-                            f"Error: {year}-{month} {code} and iso {iso} returned 500 rows."
-                        )
-
-                    self.conn.sql(
-                        "INSERT INTO 'comtradetable' BY NAME SELECT * FROM df;"
-                    )
-                    logging.info(
-                        f"Succesfully inserted {len(df)} records for {year}-{month} for {code} for iso {iso}"
                     )
+                logging.info(
+                    f"Pulled {len(df)} records ({status}) for {year}-{month} for {query.cmd_code} for iso {query.partner_codes}"
+                )
+                buffered += len(df) + len(query.partner_codes)
+                if buffered >= batch_rows:
+                    self.flush_comtrade(buffer, ledger)
+                    buffer, ledger = [], []
+                    buffered = 0
+        finally:
+            self.flush_comtrade(buffer, ledger)
         return self.conn.sql("SELECT * FROM 'comtradetable';").pl()
 
+    def flush_comtrade(self, buffer: list, ledger: list) -> None:
+        """
+        Inserts the buffered Comtrade responses in the comtradetable and records the
+            fetched keys in the comtradeledger, in a single transaction so the ledger
+            never lists rows that were not stored. The rows stored by an earlier
+            truncated fetch of a key are replaced.
+        """
+        if not buffer and not ledger:
+            return
+        fetched_at = datetime.datetime.now()
+        refetched = pl.DataFrame(
+            [entry[:5] for entry in ledger if entry[5] != "error"],
+            schema={
+                "partner_code": pl.String,
+                "ref_year": pl.Int32,
+                "ref_month": pl.Int32,
+                "cmd_code": pl.String,
+                "flow_code": pl.String,
+            },
+            orient="row",
+        )
+        self.conn.begin()
+        try:
+            self.conn.sql("""
+                DELETE FROM 'comtradetable' AS t
+                USING 'comtradeledger' AS l, refetched AS k
+                WHERE l.status = 'truncated'
+                    AND (l.partner_code, l.ref_year, l.ref_month, l.cmd_code, l.flow_code)
+                        = (k.partner_code, k.ref_year, k.ref_month, k.cmd_code, k.flow_code)
+                    AND t.partnerCode = k.partner_code
+                    AND TRY_CAST(t.refYear AS INTEGER) = k.ref_year
+                    AND TRY_CAST(t.refMonth AS INTEGER) = k.ref_month
+                    AND coalesce(t.queryCmdCode, t.cmdCode) = k.cmd_code
+                    AND t.flowCode = k.flow_code;
+                """)
+            if buffer:
+                df = pl.concat(buffer, how="diagonal_relaxed")
+                self.conn.sql("INSERT INTO 'comtradetable' BY NAME SELECT * FROM df;")
+                logging.info(f"Succesfully inserted {len(df)} records in comtradetable")
+            if ledger:
+                self.conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO 'comtradeledger'
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+                    """,
+                    [entry + (fetched_at,) for entry in ledger],
+                )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def migrate_comtrade_ledger(self) -> None:
+        """
+        Records the keys already in comtradetable in the comtradeledger and removes the
+            empty dummy records older versions wrote to mark requests without data.
+        """
+        self.conn.sql("""
+            INSERT OR IGNORE INTO 'comtradeledger'
+            SELECT
+                partnerCode,
+                TRY_CAST(refYear AS INTEGER),
+                TRY_CAST(refMonth AS INTEGER),
+                cmdCode,
+                'X',
+                CASE WHEN count(reporterCode) FILTER (reporterCode <> '') > 0
+                    THEN 'ok' ELSE 'empty' END,
+                count(reporterCode) FILTER (reporterCode <> ''),
+                current_localtimestamp()
+            FROM 'comtradetable'
+            WHERE TRY_CAST(refYear AS INTEGER) IS NOT NULL
+            GROUP BY ALL;
+            """)
+        self.conn.sql(
+            "DELETE FROM 'comtradetable' WHERE reporterCode = '' AND flowCode = '';"
+        )
+
+    def comtrade_coverage(self, iso: str | list | None = None) -> pl.DataFrame:
+        """
+        Summarizes the comtradeledger by partner and status. Requests with status
+            "truncated" hit the cap and could not be split, so their rows are incomplete
+            until a later insert_comtrade fetches them again.
+
+        Parameters
+        ----------
+        iso: str | list | None
+            The partner code or list of partner codes to report. All partners if None.
+
+        Returns
+        -------
+        pl.DataFrame
+            One row per partner and status with the number of requests, the number of
+                rows stored, the first and last period and the last fetch time.
+        """
+        ledger = self.conn.sql("SELECT * FROM 'comtradeledger';").pl()
+        if iso is not None:
+            isos = [str(iso)] if isinstance(iso, (str, int)) else [str(i) for i in iso]
+            ledger = ledger.filter(pl.col("partner_code").is_in(isos))
+        period = pl.col("ref_year") * 100 + pl.col("ref_month")
+        return (
+            ledger.group_by("partner_code", "status")
+            .agg(
+                requests=pl.len(),
+                rows=pl.col("row_count").sum(),
+                first_period=period.min(),
+                last_period=period.max(),
+                last_fetched=pl.col("fetched_at").max(),
+            )
+            .sort("partner_code", "status")
+        )
+
+    def hts_children(self):
+        """
+        Returns a function listing the HS codes one level (two digits) below a code, taken
+            from the full HS nomenclature of Comtrade (see hs_nomenclature) so codes the
+            partner trades but Puerto Rico never recorded are requested too. Used to
+            split Comtrade requests by HS level.
+        """
+        codes = {}
+        for code, parent in self.hs_nomenclature().iter_rows():
+            if parent is not None and len(code) == len(parent) + 2:
+                codes.setdefault(parent, []).append(code)
+
+        def children(code: str) -> list:
+            return sorted(codes.get(code, []))
+
+        return children
+
+    def hs_nomenclature(self) -> pl.DataFrame:
+        """
+        Returns the id and parent of every code of the Comtrade HS classification, read
+            from the API the first time and kept in external/comtrade_hs.parquet.
+        """
+        filename = f"{self.saving_dir}external/comtrade_hs.parquet"
+        if not os.path.exists(filename):
+            df = comtradeapicall.getReference("cmd:HS")
+            if df is None:
+                raise ValueError("Could not read the HS classification from Comtrade")
+            df = pl.from_pandas(df[["id", "parent"]]).cast(pl.String)
+            df.write_parquet(filename + ".tmp")
+            os.replace(filename + ".tmp", filename)
+        return pl.read_parquet(filename, columns=["id", "parent"])
+
+    def plan_comtrade(self, iso: str, codes: list) -> list:
+        """
+        Computes the (year, month, HS2 code) requests still missing for a partner. The
+            keys already loaded are read once with a single projection query and the
+            missing work set is computed in memory.
+
+        Parameters
+        ----------
+        iso: str
+            The partner code of the requests.
+        codes: list
+            The HS2 codes to request.
+
+        Returns
+        -------
+        list
+            The (year, month, code) tuples with no complete fetch in the
+                comtradeledger. Failed and truncated fetches are planned again.
+        """
+        loaded = set(
+            self.conn.execute(
+                """
+                SELECT ref_year, ref_month, cmd_code
+                FROM 'comtradeledger'
+                WHERE partner_code = $iso AND status NOT IN ('error', 'truncated');
+                """,
+                {"iso": str(iso)},
+            ).fetchall()
+        )
+        return [
+            (year, month, code)
+            for year in range(2010, datetime.date.today().year + 1)
+            for month in range(1, 13)
+            for code in codes
+            if (year, month, code) not in loaded
+        ]
+
     def pull_census_hts(
-        self, end_year: int, start_year: int, exports: bool, state: str
+        self,
+        end_year: int,
+        start_year: int,
+        exports: bool,
+        state: str,
+        max_workers: int = 8,
     ) -> None:
         """
         Pulls HTS data from the Census and saves them in a parquet file.
@@ -430,6 +1472,8 @@ class DataPull:
             If True, pulls exports data. If False, pulls imports data.
         state: str
             The state to pull data from (e.g. "PR" for Puerto Rico).
+        max_workers: int
+            Number of years fetched concurrently.
 
         Returns
         -------
@@ -444,9 +1488,6 @@ class DataPull:
             pl.Series("country_name", dtype=pl.String),
             pl.Series("contry_code", dtype=pl.String),
         ]
-        census_df = pl.DataFrame(empty_df)
-        base_url = "https://api.census.gov/data/timeseries/"
-        key = os.getenv("CENSUS_API_KEY")
 
         if exports:
             param = "CTY_CODE,CTY_NAME,ALL_VAL_MO,COMM_LVL,E_COMMODITY"
@@ -458,7 +1499,7 @@ class DataPull:
                 "COMM_LVL": "comm_level",
                 "E_COMMODITY": "commodity",
             }
-            saving_path = f"{self.saving_dir}/raw/census_hts_exports.parquet"
+            saving_path = f"{self.saving_dir}raw/census_hts_exports.parquet"
         else:
             param = "CTY_CODE,CTY_NAME,GEN_VAL_MO,COMM_LVL,I_COMMODITY"
             flow = "intltrade/imports/statehs"
@@ -469,35 +1510,27 @@ class DataPull:
                 "COMM_LVL": "comm_level",
                 "I_COMMODITY": "commodity",
             }
-            saving_path = f"{self.saving_dir}/raw/census_hts_imports.parquet"
-
-        for year in range(start_year, end_year + 1):
-            url = f"{base_url}{flow}?get={param}&STATE={state}&key={key}&time={year}"
-            r = requests.get(url).json()
-            df = pl.DataFrame(r)
-            names = df.select(pl.col("column_0")).transpose()
-            df = df.drop("column_0").transpose()
-            df = df.rename(names.to_dicts().pop()).rename(naming)
-            df = df.with_columns(
-                date=(pl.col("time") + "-01").str.to_datetime("%Y-%m-%d")
-            )
-            df = df.select(
-                pl.col(
-                    "date",
-                    "census_value",
-                    "comm_level",
-                    "commodity",
-                    "country_name",
-                    "contry_code",
-                )
-            )
-            df = df.with_columns(pl.col("census_value").cast(pl.Int64))
-            census_df = pl.concat([census_df, df], how="vertical")
+            saving_path = f"{self.saving_dir}raw/census_hts_imports.parquet"
 
-        census_df.write_parquet(saving_path)
+        self.pull_census(
+            flow=flow,
+            param=param,
+            naming=naming,
+            empty_df=pl.DataFrame(empty_df),
+            state=state,
+            start_year=start_year,
+            end_year=end_year,
+            saving_path=saving_path,
+            max_workers=max_workers,
+        )
 
     def pull_census_naics(
-        self, end_year: int, start_year: int, exports: bool, state: str
+        self,
+        end_year: int,
+        start_year: int,
+        exports: bool,
+        state: str,
+        max_workers: int = 8,
     ) -> None:
         """
         Pulls NAICS data from the Census and saves them in a parquet file.
@@ -512,6 +1545,8 @@ class DataPull:
             If True, pulls exports data. If False, pulls imports data.
         state: str
             The state to pull data from (e.g. "PR" for Puerto Rico).
+        max_workers: int
+            Number of years fetched concurrently.
 
         Returns
         -------
@@ -525,9 +1560,6 @@ class DataPull:
             pl.Series("country_name", dtype=pl.String),
             pl.Series("contry_code", dtype=pl.String),
         ]
-        census_df = pl.DataFrame(empty_df)
-        base_url = "https://api.census.gov/data/timeseries/"
-        key = os.getenv("CENSUS_API_KEY")
 
         if exports:
             param = "CTY_CODE,CTY_NAME,ALL_VAL_MO,COMM_LVL,NAICS"
@@ -539,7 +1571,7 @@ class DataPull:
                 "COMM_LVL": "comm_level",
                 "NAICS": "naics_code",
             }
-            saving_path = f"{self.saving_dir}/raw/census_naics_exports.parquet"
+            saving_path = f"{self.saving_dir}raw/census_naics_exports.parquet"
         else:
             param = "CTY_CODE,CTY_NAME,GEN_VAL_MO,COMM_LVL,NAICS"
             flow = "intltrade/imports/statenaics"
@@ -550,36 +1582,223 @@ class DataPull:
                 "COMM_LVL": "comm_level",
                 "NAICS": "naics_code",
             }
-            saving_path = f"{self.saving_dir}/raw/census_naics_imports.parquet"
-
-        for year in range(2010, datetime.date.today().year + 1):
-            url = f"{base_url}{flow}?get={param}&STATE={state}&key={key}&time={year}"
-            r = requests.get(url).json()
-            df = pl.DataFrame(r)
-            names = df.select(pl.col("column_0")).transpose()
-            df = df.drop("column_0").transpose()
-            df = df.rename(names.to_dicts().pop()).rename(naming)
-            df = df.with_columns(
-                date=(pl.col("time") + "-01").str.to_datetime("%Y-%m-%d")
-            )
-            df = df.select(
-                pl.col(
-                    "date",
-                    "census_value",
-                    "comm_level",
-                    "naics_code",
-                    "country_name",
-                    "contry_code",
+            saving_path = f"{self.saving_dir}raw/census_naics_imports.parquet"
+
+        self.pull_census(
+            flow=flow,
+            param=param,
+            naming=naming,
+            empty_df=pl.DataFrame(empty_df),
+            state=state,
+            start_year=start_year,
+            end_year=end_year,
+            saving_path=saving_path,
+            max_workers=max_workers,
+        )
+
+    def pull_census(
+        self,
+        flow: str,
+        param: str,
+        naming: dict,
+        empty_df: pl.DataFrame,
+        state: str,
+        start_year: int,
+        end_year: int,
+        saving_path: str,
+        max_workers: int = 8,
+    ) -> None:
+        """
+        Pulls a Census time series year by year and saves it in a parquet file. Each
+            (flow, state, year) is cached as a parquet partition in raw/census/ so only
+            the missing years and the current year are fetched. The years are fetched
+            concurrently over the pooled session and assembled in a single pass.
+
+        Parameters
+        ----------
+        flow: str
+            The Census endpoint (e.g. "intltrade/exports/statehs").
+        param: str
+            The variables to get from the endpoint.
+        naming: dict
+            Mapping of the Census variables to the column names.
+        empty_df: pl.DataFrame
+            Empty DataFrame with the output schema.
+        state: str
+            The state to pull data from (e.g. "PR" for Puerto Rico).
+        start_year: int
+            The first year to pull data from.
+        end_year: int
+            The last year to pull data from.
+        saving_path: str
+            The parquet file to save the data to.
+        max_workers: int
+            Number of years fetched concurrently.
+
+        Returns
+        -------
+        None
+        """
+        cache_dir = os.path.join(
+            f"{self.saving_dir}raw/census", flow.replace("/", "_"), f"state={state}"
+        )
+        os.makedirs(cache_dir, exist_ok=True)
+        years = range(start_year, end_year + 1)
+        current_year = datetime.date.today().year
+        missing = [
+            year
+            for year in years
+            if year >= current_year
+            or not os.path.exists(os.path.join(cache_dir, f"year={year}.parquet"))
+        ]
+
+        def fetch(year: int) -> None:
+            df = self.pull_census_year(flow, param, naming, empty_df, state, year)
+            partition = os.path.join(cache_dir, f"year={year}.parquet")
+            df.write_parquet(partition + ".tmp")
+            os.replace(partition + ".tmp", partition)
+            logging.info(f"Pulled {len(df)} rows from {flow} for {state} in {year}")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(fetch, missing))
+
+        partitions = [os.path.join(cache_dir, f"year={year}.parquet") for year in years]
+        if partitions:
+            pl.scan_parquet(partitions).sink_parquet(saving_path)
+        else:
+            empty_df.write_parquet(saving_path)
+
+    def pull_census_year(
+        self,
+        flow: str,
+        param: str,
+        naming: dict,
+        empty_df: pl.DataFrame,
+        state: str,
+        year: int,
+    ) -> pl.DataFrame:
+        """
+        Pulls a single year of a Census time series. Failed requests are retried with
+            backoff by the session.
+        """
+        key = os.getenv("CENSUS_API_KEY")
+        url = f"https://api.census.gov/data/timeseries/{flow}"
+        with self.session.get(
+            url,
+            params={"get": param, "STATE": state, "key": key, "time": year},
+            timeout=300,
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            # The Census API answers 204 with an empty body when there is no data
+            if response.status_code == 204:
+                return empty_df
+            rows = self.iter_json_rows(response.iter_content(chunk_size=1024 * 1024))
+            return self.decode_census(rows, naming, empty_df)
+
+    def decode_census(
+        self,
+        rows: Iterable[list],
+        naming: dict,
+        empty_df: pl.DataFrame,
+        batch_size: int = 100_000,
+    ) -> pl.DataFrame:
+        """
+        Decodes the row-oriented JSON of the Census API (a header row followed by the
+            data rows) into typed columns. Rows are transposed in batches straight into
+            polars Series, census_value is cast to Int64 and each distinct time is parsed
+            to a date once.
+
+        Parameters
+        ----------
+        rows: Iterable[list]
+            The header row followed by the data rows.
+        naming: dict
+            Mapping of the Census variables to the column names.
+        empty_df: pl.DataFrame
+            Empty DataFrame with the output schema.
+        batch_size: int
+            Number of rows transposed at a time.
+
+        Returns
+        -------
+        pl.DataFrame
+            Data with the schema of empty_df.
+        """
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is None:
+            return empty_df
+        names = [naming.get(col, col) for col in header]
+        keep = [
+            i
+            for i, name in enumerate(names)
+            if name in empty_df.columns or name == "time"
+        ]
+
+        frames = []
+        while batch := list(itertools.islice(rows, batch_size)):
+            columns = list(zip(*batch))
+            frames.append(
+                pl.DataFrame(
+                    [pl.Series(names[i], columns[i], dtype=pl.String) for i in keep]
                 )
             )
-            df = df.with_columns(pl.col("census_value").cast(pl.Int64))
-            census_df = pl.concat([census_df, df], how="vertical")
+        if not frames:
+            return empty_df
+        df = pl.concat(frames, how="vertical")
 
-        census_df.write_parquet(saving_path)
+        times = df.get_column("time").unique()
+        dates = (times + "-01").str.to_datetime("%Y-%m-%d")
+        df = df.with_columns(
+            date=pl.col("time").replace_strict(times, dates, return_dtype=pl.Datetime),
+            census_value=pl.col("census_value").cast(pl.Int64),
+        )
+        return df.select(empty_df.columns)
 
-    def pull_file(self, url: str, filename: str, verify: bool = True) -> None:
+    def iter_json_rows(self, chunks: Iterable[bytes]) -> Iterator[list]:
+        """
+        Incrementally parses a JSON array of arrays from a stream of byte chunks,
+            yielding each inner array as soon as it is complete. The response never
+            has to be held in memory as a whole.
+        """
+        decoder = json.JSONDecoder()
+        utf8 = codecs.getincrementaldecoder("utf-8")()
+        buffer = ""
+        started = False
+        for chunk in itertools.chain(chunks, [None]):
+            buffer += utf8.decode(chunk or b"", final=chunk is None)
+            pos = 0
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos == len(buffer):
+                    break
+                if not started:
+                    if buffer[pos] != "[":
+                        raise ValueError("Expected a JSON array")
+                    started = True
+                    pos += 1
+                    continue
+                if buffer[pos] == "]":
+                    return
+                try:
+                    row, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if chunk is None:
+                        raise
+                    break
+                yield row
+            buffer = buffer[pos:]
+        if started:
+            raise ValueError("Unterminated JSON array")
+
+    def pull_file(
+        self, url: str, filename: str, verify: bool = True, force: bool = False
+    ) -> bool:
         """
         Pulls a file from a URL and saves it in the filename. Used by the class to pull external files.
+            Unchanged files are skipped and interrupted downloads are resumed, see DataDownload.
 
         Parameters
         ----------
@@ -589,27 +1808,14 @@ class DataPull:
             The filename to save the file to.
         verify: bool
             If True, verifies the SSL certificate. If False, does not verify the SSL certificate.
+        force: bool
+            If True, downloads the file even if the remote file has not changed.
 
         Returns
         -------
-        None
+        bool
+            True if the file was downloaded, False if it was unchanged.
         """
-        chunk_size = 10 * 1024 * 1024
-
-        with requests.get(url, stream=True, verify=verify) as response:
-            total_size = int(response.headers.get("content-length", 0))
-
-            with tqdm(
-                total=total_size,
-                unit="B",
-                unit_scale=True,
-                unit_divisor=1024,
-                desc="Downloading",
-            ) as bar:
-                with open(filename, "wb") as file:
-                    for chunk in response.iter_content(chunk_size=chunk_size):
-                        if chunk:
-                            file.write(chunk)
-                            bar.update(
-                                len(chunk)
-                            )  # Update the progress bar with the size of the chunk
+        return self.downloader.download(
+            url=url, filename=filename, verify=verify, force=force
+        )
@@ -1,58 +1,92 @@
+from .dao.jp_imports_raw import (
+    CountryTable,
+    DistrictTable,
+    HTSTable,
+    IntTradeData,
+    JPTradeData,
+    NAICSTable,
+    SITCTable,
+    TradeTable,
+    UnitTable,
+)
+from datetime import datetime
 import duckdb
 
+DIMENSION_MODELS = [
+    TradeTable,
+    HTSTable,
+    CountryTable,
+    NAICSTable,
+    SITCTable,
+    DistrictTable,
+    UnitTable,
+]
+
 
 def get_conn(db_path: str) -> duckdb.DuckDBPyConnection:
     return duckdb.connect(db_path)
 
 
-def init_int_trade_data_table(db_path: str) -> None:
+def model_ddl(model, primary_key: bool = True) -> str:
+    # Build the CREATE TABLE of a SQLModel model. Measures are stored as BIGINT since
+    # monthly trade values overflow 32 bits.
+    columns = []
+    for column in model.__table__.columns:
+        python_type = getattr(column.type, "impl", column.type).python_type
+        if python_type is bool:
+            dtype = "BOOLEAN"
+        elif python_type is datetime:
+            dtype = "TIMESTAMP"
+        elif python_type is int:
+            keyed = column.primary_key or column.foreign_keys
+            dtype = "INTEGER" if keyed else "BIGINT"
+        elif python_type is float:
+            dtype = "DOUBLE"
+        else:
+            dtype = "TEXT"
+        if column.primary_key:
+            dtype += " PRIMARY KEY" if primary_key else ""
+        columns.append(f"{column.name} {dtype}")
+    return f'''CREATE TABLE IF NOT EXISTS "{model.__tablename__}" ({", ".join(columns)});'''
+
+
+def init_dimension_tables(db_path: str) -> None:
     conn = get_conn(db_path=db_path)
 
-    # Create IntTradeData table
+    # Create the dimension tables of the star schema
+    for model in DIMENSION_MODELS:
+        conn.sql(model_ddl(model))
     conn.sql(
         """
-        CREATE TABLE IF NOT EXISTS "inttradedata" (
-            trade_id INTEGER,
-            hts_code TEXT,
-            hts_desc TEXT,
-            agri_prod INTEGER,
-            country TEXT,
-            data BIGINT DEFAULT 0,
-            unit_1 TEXT,
-            qty_1 BIGINT DEFAULT 0,
-            unit_2 TEXT,
-            qty_2 BIGINT DEFAULT 0,
-            date TIMESTAMP
-        );
+        INSERT OR IGNORE INTO "tradetable" VALUES (1, 'Imports'), (2, 'Exports');
         """
     )
 
 
-def init_jp_trade_data_table(db_path: str) -> None:
+def init_fact_table(db_path: str, model) -> None:
     conn = get_conn(db_path=db_path)
+    init_dimension_tables(db_path)
 
-    # Create JPTradeData table
+    # Fact rows are bulk loaded, so their id comes from a sequence instead of a primary key
+    table = model.__tablename__
+    conn.sql(f'''CREATE SEQUENCE IF NOT EXISTS "{table}_id_seq";''')
     conn.sql(
-        """
-        CREATE TABLE IF NOT EXISTS "jptradedata" (
-            date TIMESTAMP,
-            country TEXT,
-            trade_id INTEGER,
-            agri_prod INTEGER,
-            hts_code TEXT,
-            hts_desc TEXT,
-            data BIGINT DEFAULT 0,
-            sitc TEXT,
-            naics TEXT,
-            unit_1 TEXT,
-            qty_1 BIGINT DEFAULT 0,
-            unit_2 TEXT,
-            qty_2 BIGINT DEFAULT 0,
-        );
-        """
+        model_ddl(model, primary_key=False).replace(
+            "id INTEGER", f"id BIGINT DEFAULT nextval('{table}_id_seq')", 1
+        )
     )
 
 
+def init_int_trade_data_table(db_path: str) -> None:
+    # Create IntTradeData table
+    init_fact_table(db_path, IntTradeData)
+
+
+def init_jp_trade_data_table(db_path: str) -> None:
+    # Create JPTradeData table
+    init_fact_table(db_path, JPTradeData)
+
+
 def init_com_trade_data_table(db_path: str) -> None:
     conn = get_conn(db_path=db_path)
     conn.sql(
@@ -104,7 +138,194 @@ def init_com_trade_data_table(db_path: str) -> None:
             primaryValue FLOAT,
             legacyEstimationFlag VARCHAR(255),
             isReported VARCHAR(255),
-            isAggregate VARCHAR(255)
+            isAggregate VARCHAR(255),
+            -- HS code of the request the row was fetched for, cmdCode may be a
+            -- code below it when a capped request was split by HS level
+            queryCmdCode VARCHAR(255)
             );
         """
     )
+    conn.sql(
+        """
+        ALTER TABLE "comtradetable" ADD COLUMN IF NOT EXISTS queryCmdCode VARCHAR(255);
+        """
+    )
+
+
+def init_com_trade_ledger_table(db_path: str) -> None:
+    conn = get_conn(db_path=db_path)
+
+    # Create ComTradeLedger table, one row per fetched (partner, period, code, flow)
+    conn.sql(
+        """
+        CREATE TABLE IF NOT EXISTS "comtradeledger" (
+            partner_code TEXT,
+            ref_year INTEGER,
+            ref_month INTEGER,
+            cmd_code TEXT,
+            flow_code TEXT,
+            status TEXT,
+            row_count INTEGER DEFAULT 0,
+            fetched_at TIMESTAMP,
+            PRIMARY KEY (partner_code, ref_year, ref_month, cmd_code, flow_code)
+        );
+        """
+    )
+
+
+def init_ingest_watermark_table(db_path: str) -> None:
+    conn = get_conn(db_path=db_path)
+
+    # Create IngestWatermark table, the high-water mark of every ingested source
+    conn.sql(
+        """
+        CREATE TABLE IF NOT EXISTS "ingestwatermark" (
+            source TEXT PRIMARY KEY,
+            max_date DATE,
+            fingerprint TEXT,
+            updated_at TIMESTAMP
+        );
+        """
+    )
+
+
+def init_ingest_months_table(db_path: str) -> None:
+    conn = get_conn(db_path=db_path)
+
+    # Create IngestMonths table, the row count and checksum of every loaded month
+    conn.sql(
+        """
+        CREATE TABLE IF NOT EXISTS "ingestmonths" (
+            source TEXT,
+            date DATE,
+            rows BIGINT,
+            checksum UBIGINT,
+            PRIMARY KEY (source, date)
+        );
+        """
+    )
+
+
+def init_trade_cube_table(db_path: str, table: str) -> None:
+    conn = get_conn(db_path=db_path)
+
+    # Create a trade cube table, the facts summed by month, HTS, country, NAICS and flow
+    conn.sql(
+        f"""
+        CREATE TABLE IF NOT EXISTS "{table}" (
+            date DATE,
+            year INTEGER,
+            qrt INTEGER,
+            month TINYINT,
+            fiscal_year INTEGER,
+            fiscal_qrt INTEGER,
+            trade_id INTEGER,
+            hts_id INTEGER,
+            country_id INTEGER,
+            naics_id INTEGER,
+            data BIGINT,
+            qty DOUBLE
+        );
+        """
+    )
+
+
+def init_cube_months_table(db_path: str) -> None:
+    conn = get_conn(db_path=db_path)
+
+    # Create CubeMonths table, the fact months every cube was last built from
+    conn.sql(
+        """
+        CREATE TABLE IF NOT EXISTS "cubemonths" (
+            source TEXT,
+            date DATE,
+            checksum UBIGINT,
+            version INTEGER,
+            PRIMARY KEY (source, date)
+        );
+        """
+    )
+
+
+def init_calendar_table(db_path: str) -> None:
+    conn = get_conn(db_path=db_path)
+
+    # Create Calendar table, the periods of every month (fiscal years start in July)
+    conn.sql(
+        """
+        CREATE TABLE IF NOT EXISTS "calendartable" (
+            date DATE PRIMARY KEY,
+            year INTEGER,
+            month TINYINT,
+            qrt INTEGER,
+            fiscal_year INTEGER,
+            fiscal_qrt INTEGER
+        );
+        """
+    )
+
+
+def init_price_table(db_path: str) -> None:
+    conn = get_conn(db_path=db_path)
+
+    # Create Price table, the price statistics of every HS4 product and month with
+    # the count, sum and sum of squares of the prices in their moving window
+    conn.sql(
+        """
+        CREATE TABLE IF NOT EXISTS "pricetable" (
+            agriculture BOOLEAN,
+            hs4 TEXT,
+            month TINYINT,
+            year INTEGER,
+            imports BIGINT,
+            exports BIGINT,
+            imports_qty DOUBLE,
+            exports_qty DOUBLE,
+            price_imports DOUBLE,
+            price_exports DOUBLE,
+            date TIMESTAMP,
+            moving_price_imports DOUBLE,
+            moving_price_exports DOUBLE,
+            moving_price_imports_std DOUBLE,
+            moving_price_exports_std DOUBLE,
+            rank_imports BIGINT,
+            rank_exports BIGINT,
+            upper_band_imports DOUBLE,
+            lower_band_imports DOUBLE,
+            upper_band_exports DOUBLE,
+            lower_band_exports DOUBLE,
+            pct_change_imports DOUBLE,
+            prev_year_imports DOUBLE,
+            prev_year_exports DOUBLE,
+            prev_year_rank_imports BIGINT,
+            prev_year_rank_exports BIGINT,
+            pct_change_imports_year_over_year DOUBLE,
+            pct_change_exports_year_over_year DOUBLE,
+            rank_imports_change_year_over_year BIGINT,
+            rank_exports_change_year_over_year BIGINT,
+            price_imports_count INTEGER,
+            price_imports_sum DOUBLE,
+            price_imports_sumsq DOUBLE,
+            price_exports_count INTEGER,
+            price_exports_sum DOUBLE,
+            price_exports_sumsq DOUBLE
+        );
+        """
+    )
+
+
+def init_price_months_table(db_path: str) -> None:
+    conn = get_conn(db_path=db_path)
+
+    # Create PriceMonths table, the cube months the price statistics were computed from
+    conn.sql(
+        """
+        CREATE TABLE IF NOT EXISTS "pricemonths" (
+            agriculture BOOLEAN,
+            date DATE,
+            checksum UBIGINT,
+            version INTEGER,
+            PRIMARY KEY (agriculture, date)
+        );
+        """
+    )
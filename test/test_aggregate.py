@@ -0,0 +1,85 @@
+import pytest
+from test.test_lake import make_trade, write_release
+from polars.testing import assert_frame_equal
+import polars as pl
+
+
+@pytest.fixture
+def data_trade(tmp_path):
+    return make_trade(tmp_path, "duckdb")
+
+
+BASE = pl.DataFrame(
+    {
+        "year": [2020, 2020, 2020, 2021],
+        "qrt": [1, 1, 2, 1],
+        "trade_id": [1, 2, 1, 2],
+        "hts_id": [1, 1, 1, 1],
+        "data": [10, 4, 5, 7],
+        "qty": [1.0, 2.0, 3.0, 4.0],
+    }
+)
+
+
+def test_aggregate_pivots_trade_flows(data_trade):
+    df = data_trade.aggregate(BASE.lazy(), ["year", "qrt"]).collect()
+    expected = pl.DataFrame(
+        {
+            "year": [2020, 2020, 2021],
+            "qrt": [1, 2, 1],
+            "imports": [10, 5, 0],
+            "imports_qty": [1.0, 3.0, 0.0],
+            "exports": [4, 0, 7],
+            "exports_qty": [2.0, 0.0, 4.0],
+            "net_exports": [-6, -5, 7],
+            "net_qty": [1.0, -3.0, 4.0],
+        }
+    )
+    assert_frame_equal(df, expected)
+
+
+def test_invalid_switch(data_trade):
+    with pytest.raises(ValueError):
+        data_trade.process_data(["weekly", "hts"], BASE.lazy())
+    with pytest.raises(ValueError):
+        data_trade.process_data(["yearly", "sitc"], BASE.lazy())
+
+
+def test_lazy_plan(data_trade):
+    write_release(data_trade, {1: 100, 2: 200}, 1)
+    plan = data_trade.process_int_org("hts", "monthly", lazy=True)
+    assert isinstance(plan, pl.LazyFrame)
+    assert_frame_equal(plan.collect(), data_trade.process_int_org("hts", "monthly"))
+
+
+def test_batch_matches_individual(data_trade):
+    write_release(data_trade, {1: 100, 5: 200, 8: 300}, 1)
+    requests = [
+        (time_frame, level)
+        for time_frame in ["yearly", "fiscal", "qrt", "fiscal_qrt", "monthly"]
+        for level in ["total", "hts", "country"]
+    ]
+    results = data_trade.process_batch("org", requests)
+    assert list(results) == requests
+
+    data_trade.cache.invalidate()
+    data_trade.disk_cache.invalidate()
+    for time_frame, level in requests:
+        expected = data_trade.process_int_org(level, time_frame)
+        assert_frame_equal(results[(time_frame, level)], expected)
+
+    # Cached results are returned without scanning the cube again
+    results = data_trade.process_batch("org", requests[:2])
+    assert data_trade.cache.stats()["hits"] == 2
+    with pytest.raises(ValueError):
+        data_trade.process_batch("org", [("yearly", "naics")])
+
+
+def test_results_carry_codes_not_keys(data_trade):
+    write_release(data_trade, {1: 100, 2: 200}, 1)
+    values = ["imports", "imports_qty", "exports", "exports_qty"]
+    values += ["net_exports", "net_qty"]
+    df = data_trade.process_int_org("hts", "monthly")
+    assert df.columns == ["year", "month", "hts_code"] + values
+    df = data_trade.process_batch("org", [("yearly", "country")])
+    assert df[("yearly", "country")].columns == ["year", "country_name"] + values
@@ -0,0 +1,68 @@
+import pytest
+from src.data.data_pull import DataPull
+from polars.testing import assert_frame_equal
+import polars as pl
+import json
+
+NAMING = {
+    "CTY_CODE": "contry_code",
+    "CTY_NAME": "country_name",
+    "ALL_VAL_MO": "census_value",
+    "COMM_LVL": "comm_level",
+    "E_COMMODITY": "commodity",
+}
+EMPTY_DF = pl.DataFrame(
+    [
+        pl.Series("date", dtype=pl.Datetime),
+        pl.Series("census_value", dtype=pl.Int64),
+        pl.Series("comm_level", dtype=pl.String),
+        pl.Series("commodity", dtype=pl.String),
+        pl.Series("country_name", dtype=pl.String),
+        pl.Series("contry_code", dtype=pl.String),
+    ]
+)
+ROWS = [
+    ["CTY_CODE", "CTY_NAME", "ALL_VAL_MO", "COMM_LVL", "E_COMMODITY", "STATE", "time"]
+] + [
+    [
+        str(i),
+        f"COUNTRY {i}",
+        str(i * 1000),
+        "HS10",
+        str(i).zfill(10),
+        "PR",
+        f"2020-{i % 12 + 1:02d}",
+    ]
+    for i in range(500)
+]
+
+
+@pytest.fixture(scope="module")
+def data_pull(tmp_path_factory):
+    path = tmp_path_factory.mktemp("data")
+    return DataPull(f"{path}/", str(path / "data.ddb"), str(path / "test.log"))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64, 1024 * 1024])
+def test_decode_census(data_pull, chunk_size):
+    body = ("[" + ",\n".join(json.dumps(row) for row in ROWS) + "]").encode()
+    chunks = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)]
+    df = data_pull.decode_census(data_pull.iter_json_rows(chunks), NAMING, EMPTY_DF, 64)
+
+    expected = pl.DataFrame(ROWS[1:], schema=ROWS[0], orient="row").rename(NAMING)
+    expected = expected.with_columns(
+        date=(pl.col("time") + "-01").str.to_datetime("%Y-%m-%d"),
+        census_value=pl.col("census_value").cast(pl.Int64),
+    ).select(EMPTY_DF.columns)
+    assert_frame_equal(df, expected)
+
+
+def test_decode_census_empty(data_pull):
+    rows = data_pull.iter_json_rows([json.dumps(ROWS[:1]).encode()])
+    assert_frame_equal(data_pull.decode_census(rows, NAMING, EMPTY_DF), EMPTY_DF)
+
+
+def test_truncated_response(data_pull):
+    body = json.dumps(ROWS).encode()
+    with pytest.raises(ValueError):
+        list(data_pull.iter_json_rows([body[:-10]]))
@@ -0,0 +1,86 @@
+import pytest
+from src.data.data_pull import DataPull
+import polars as pl
+import datetime
+import json
+import os
+
+
+class StubResponse:
+    def __init__(self, body: bytes):
+        self.body = body
+        self.status_code = 200
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        yield self.body
+
+
+class StubSession:
+    """
+    Session answering every Census request with one row for the requested year.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, params, **kwargs):
+        self.requests.append((url, params["time"]))
+        header = params["get"].split(",") + ["STATE", "time"]
+        row = ["1"] * (len(header) - 1) + [f"{params['time']}-01"]
+        return StubResponse(json.dumps([header, row]).encode())
+
+
+@pytest.fixture
+def data_pull(tmp_path):
+    d = DataPull(f"{tmp_path}/", str(tmp_path / "data.ddb"), str(tmp_path / "test.log"))
+    d.session = StubSession()
+    return d
+
+
+def fetched(data_pull: DataPull) -> list:
+    years = sorted(year for _, year in data_pull.session.requests)
+    data_pull.session.requests.clear()
+    return years
+
+
+def test_pull_census_fetches_missing_years(data_pull):
+    current = datetime.date.today().year
+    pull = lambda: data_pull.pull_census_hts(current, current - 3, True, "PR")
+
+    pull()
+    assert fetched(data_pull) == list(range(current - 3, current + 1))
+
+    pull()
+    assert fetched(data_pull) == [current]
+
+    os.remove(
+        f"{data_pull.saving_dir}raw/census/intltrade_exports_statehs/state=PR/"
+        f"year={current - 2}.parquet"
+    )
+    pull()
+    assert fetched(data_pull) == [current - 2, current]
+
+    df = pl.read_parquet(f"{data_pull.saving_dir}raw/census_hts_exports.parquet")
+    assert sorted(df["date"].dt.year()) == list(range(current - 3, current + 1))
+
+
+def test_pull_census_naics_years(data_pull):
+    data_pull.pull_census_naics(2019, 2017, False, "PR")
+
+    urls = {url for url, _ in data_pull.session.requests}
+    assert urls == {
+        "https://api.census.gov/data/timeseries/intltrade/imports/statenaics"
+    }
+    assert fetched(data_pull) == [2017, 2018, 2019]
+    df = pl.read_parquet(f"{data_pull.saving_dir}raw/census_naics_imports.parquet")
+    assert sorted(df["date"].dt.year()) == [2017, 2018, 2019]
+    assert "naics_code" in df.columns
@@ -0,0 +1,43 @@
+import pytest
+from test.test_lake import make_trade
+from test.test_ingest import org_data
+import polars as pl
+
+
+@pytest.fixture
+def data_trade(tmp_path):
+    data_trade = make_trade(tmp_path, "duckdb")
+    hts = ["0101210000", "0101290000", "0102210000", "8703230000"]
+    df = pl.concat([org_data({1: 100}).with_columns(HTS=pl.lit(code)) for code in hts])
+    df.write_parquet(data_trade.org_data)
+    data_trade.insert_int_org()
+    return data_trade
+
+
+def test_level_ids(data_trade):
+    codes, ids = data_trade.code_index("hts")
+    assert codes == sorted(codes) and len(codes) == 4
+    hts_id = dict(zip(codes, ids))
+
+    assert data_trade.level_ids("hts", "0101") == [
+        hts_id["0101210000"],
+        hts_id["0101290000"],
+    ]
+    assert data_trade.level_ids("hts", "01") == ids[:3]
+    assert data_trade.level_ids("hts", "") == ids
+    assert data_trade.level_ids("hts", "0103") == []
+    assert data_trade.level_ids("country", "Sp") == [1]
+
+
+def test_invalid_code_before_scan(data_trade, monkeypatch):
+    def filter_table(*args):
+        raise AssertionError("the fact table was scanned")
+
+    monkeypatch.setattr(data_trade, "filter_table", filter_table)
+    with pytest.raises(ValueError, match="Invalid HTS code"):
+        data_trade.process_int_org("hts", "monthly", level_filter="9999")
+
+
+def test_prefix_filter(data_trade):
+    df = data_trade.process_int_org("hts", "monthly", level_filter="0101")
+    assert df.get_column("hts_code").to_list() == ["0101210000", "0101290000"]
@@ -0,0 +1,60 @@
+from test.test_ingest import data_pull, write_release
+import polars as pl
+
+NOMENCLATURE = pl.DataFrame(
+    {
+        "id": ["TOTAL", "01", "0101", "0102", "010121", "010221"],
+        "parent": [None, "TOTAL", "01", "01", "0101", "0102"],
+    }
+)
+
+
+class StubAPI:
+    """
+    Comtrade stand-in whose HS2 request for 2020-01 hits the cap and whose HS4 codes
+    return one row per reporter.
+    """
+
+    def __init__(self):
+        self.codes = []
+
+    def __call__(self, iso, trade_id, date, code, max_records):
+        if date != "202001":
+            return pl.DataFrame()
+        self.codes.append(code)
+        reporters = max_records if code == "01" else 2
+        return pl.DataFrame(
+            {
+                "refYear": "2020",
+                "refMonth": "1",
+                "partnerCode": iso,
+                "flowCode": trade_id,
+                "cmdCode": code,
+                "reporterCode": [str(reporter) for reporter in range(reporters)],
+            }
+        )
+
+
+def test_split_requests_codes_missing_locally(data_pull, monkeypatch):
+    write_release(data_pull, {1: 100}, 1)
+    NOMENCLATURE.write_parquet(f"{data_pull.saving_dir}external/comtrade_hs.parquet")
+    api = StubAPI()
+    monkeypatch.setattr(data_pull, "pull_comtrade", api)
+
+    df = data_pull.insert_comtrade("842", rate_limit=0)
+    # Puerto Rico only recorded 0101, the partner also trades 0102
+    assert sorted(api.codes) == ["01", "0101", "0102"]
+    assert sorted(df.get_column("cmdCode").unique()) == ["0101", "0102"]
+    assert df.get_column("queryCmdCode").unique().to_list() == ["01"]
+    ledger = data_pull.conn.sql(
+        "SELECT cmd_code, status, row_count FROM comtradeledger WHERE status = 'ok';"
+    ).fetchall()
+    assert ledger == [("01", "ok", 4)]
+
+
+def test_hts_children(data_pull):
+    NOMENCLATURE.write_parquet(f"{data_pull.saving_dir}external/comtrade_hs.parquet")
+    children = data_pull.hts_children()
+    assert children("01") == ["0101", "0102"]
+    assert children("0102") == ["010221"]
+    assert children("010221") == []
@@ -0,0 +1,90 @@
+import pytest
+from src.data.data_pull import DataPull
+from src.models import init_com_trade_data_table, init_com_trade_ledger_table
+import polars as pl
+
+
+@pytest.fixture
+def data_pull(tmp_path):
+    d = DataPull(f"{tmp_path}/", str(tmp_path / "data.ddb"), str(tmp_path / "test.log"))
+    init_com_trade_data_table(d.data_file)
+    return d
+
+
+def rows(year: int, month: int, code: str, partner: str, reporter: str):
+    return pl.DataFrame(
+        {
+            "refYear": [str(year)],
+            "refMonth": [str(month)],
+            "cmdCode": [code],
+            "partnerCode": [partner],
+            "reporterCode": [reporter],
+            "flowCode": ["X"],
+            "primaryValue": [1.0],
+        }
+    )
+
+
+def test_ledger_skips_loaded_and_retries_errors(data_pull):
+    init_com_trade_ledger_table(data_pull.data_file)
+    data_pull.flush_comtrade(
+        [rows(2010, 1, "01", "842", "4")],
+        [
+            ("842", 2010, 1, "01", "X", "ok", 1),
+            ("842", 2010, 1, "02", "X", "empty", 0),
+            ("842", 2010, 2, "01", "X", "error", 0),
+        ],
+    )
+
+    assert data_pull.conn.sql("SELECT count(*) FROM comtradetable;").fetchone() == (1,)
+    missing = set(data_pull.plan_comtrade("842", ["01", "02"]))
+    assert (2010, 1, "01") not in missing
+    assert (2010, 1, "02") not in missing
+    assert (2010, 2, "01") in missing
+    assert (2010, 1, "01") in set(data_pull.plan_comtrade("630", ["01"]))
+
+    coverage = data_pull.comtrade_coverage("842")
+    assert coverage.select("status", "requests", "rows").rows() == [
+        ("empty", 1, 0),
+        ("error", 1, 0),
+        ("ok", 1, 1),
+    ]
+
+
+def test_migrate_dummy_rows(data_pull):
+    dummy = rows(2010, 3, "02", "842", "").with_columns(flowCode=pl.lit(""))
+    old = pl.concat([rows(2010, 1, "01", "842", "4"), dummy])
+    data_pull.conn.sql("INSERT INTO comtradetable BY NAME SELECT * FROM old;")
+
+    init_com_trade_ledger_table(data_pull.data_file)
+    data_pull.migrate_comtrade_ledger()
+
+    assert data_pull.conn.sql("SELECT count(*) FROM comtradetable;").fetchone() == (1,)
+    ledger = data_pull.conn.sql(
+        "SELECT ref_month, cmd_code, status, row_count FROM comtradeledger ORDER BY 1;"
+    ).fetchall()
+    assert ledger == [(1, "01", "ok", 1), (3, "02", "empty", 0)]
+
+
+def test_truncated_fetch_is_replanned_and_replaced(data_pull):
+    init_com_trade_ledger_table(data_pull.data_file)
+    data_pull.flush_comtrade(
+        [rows(2010, 1, "01", "842", "4"), rows(2010, 1, "02", "842", "4")],
+        [
+            ("842", 2010, 1, "01", "X", "truncated", 1),
+            ("842", 2010, 1, "02", "X", "ok", 1),
+        ],
+    )
+    missing = set(data_pull.plan_comtrade("842", ["01", "02"]))
+    assert (2010, 1, "01") in missing
+    assert (2010, 1, "02") not in missing
+
+    data_pull.flush_comtrade(
+        [rows(2010, 1, "0101", "842", "4"), rows(2010, 1, "0102", "842", "4")],
+        [("842", 2010, 1, "01", "X", "ok", 2)],
+    )
+    stored = data_pull.conn.sql(
+        "SELECT cmdCode FROM comtradetable ORDER BY 1;"
+    ).fetchall()
+    assert stored == [("0101",), ("0102",), ("02",)]
+    assert (2010, 1, "01") not in set(data_pull.plan_comtrade("842", ["01"]))
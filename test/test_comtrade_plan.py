@@ -0,0 +1,64 @@
+import pytest
+from src.data.data_pull import DataPull
+from src.models import init_com_trade_data_table, init_com_trade_ledger_table
+import datetime
+
+
+class CountingConn:
+    """
+    Connection proxy counting the queries sent to DuckDB.
+    """
+
+    def __init__(self, conn):
+        self.inner = conn
+        self.queries = 0
+
+    def execute(self, *args, **kwargs):
+        self.queries += 1
+        return self.inner.execute(*args, **kwargs)
+
+    def sql(self, *args, **kwargs):
+        self.queries += 1
+        return self.inner.sql(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+@pytest.fixture
+def data_pull(tmp_path):
+    d = DataPull(f"{tmp_path}/", str(tmp_path / "data.ddb"), str(tmp_path / "test.log"))
+    init_com_trade_data_table(d.data_file)
+    init_com_trade_ledger_table(d.data_file)
+    return d
+
+
+def loaded(data_pull: DataPull, keys: list) -> None:
+    data_pull.flush_comtrade(
+        [],
+        [
+            (partner, int(year), int(month), code, "X", "ok", 1)
+            for year, month, code, partner in keys
+        ],
+    )
+
+
+def test_plan_skips_loaded_keys(data_pull, monkeypatch):
+    loaded(
+        data_pull,
+        [
+            ("2010", "1", "01", "842"),
+            ("2010", "2", "02", "842"),
+            ("2010", "1", "02", "630"),
+        ],
+    )
+    conn = CountingConn(data_pull.conn)
+    monkeypatch.setattr(DataPull, "conn", property(lambda self: conn), raising=False)
+
+    missing = data_pull.plan_comtrade("842", ["01", "02"])
+    assert conn.queries == 1
+    assert (2010, 1, "01") not in missing
+    assert (2010, 2, "02") not in missing
+    assert (2010, 1, "02") in missing
+    years = datetime.date.today().year - 2010 + 1
+    assert len(missing) == years * 12 * 2 - 2
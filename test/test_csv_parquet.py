@@ -0,0 +1,56 @@
+import pytest
+from src.data.data_pull import DataPull
+from polars.testing import assert_frame_equal
+import pyarrow.parquet as pq
+import polars as pl
+
+SAMPLE = "test/test_inserts/org_data_sample.parquet"
+
+
+def row_groups(parquet_file: str) -> list:
+    metadata = pq.ParquetFile(parquet_file).metadata
+    return [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+
+
+@pytest.fixture
+def data_pull(tmp_path):
+    return DataPull(
+        f"{tmp_path}/", str(tmp_path / "data.ddb"), str(tmp_path / "test.log")
+    )
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_csv_to_parquet(data_pull, tmp_path, streaming):
+    csv_file = str(tmp_path / "data.csv")
+    sample = pl.read_parquet(SAMPLE)
+    # A bad value past the rows the dtypes are inferred from becomes null
+    sample.with_columns(pl.col("value").cast(pl.String)).with_columns(
+        value=pl.when(pl.int_range(pl.len()) == 4000)
+        .then(pl.lit("n/a"))
+        .otherwise(pl.col("value"))
+    ).write_csv(csv_file)
+
+    parquet_file = str(tmp_path / "data.parquet")
+    data_pull.csv_to_parquet(
+        csv_file, parquet_file, streaming=streaming, row_group_size=1500
+    )
+
+    df = pl.read_parquet(parquet_file)
+    assert_frame_equal(df, pl.read_csv(csv_file, ignore_errors=True))
+    assert df.get_column("value").null_count() == 1
+    assert row_groups(parquet_file) == [1500, 1500, 1500, 500]
+    assert not (tmp_path / "data.parquet.tmp").exists()
+
+
+def test_csv_batches_span_files(data_pull, tmp_path):
+    sample = pl.read_parquet(SAMPLE)
+    csv_files = [str(tmp_path / "imports.csv"), str(tmp_path / "exports.csv")]
+    sample.head(700).write_csv(csv_files[0])
+    sample.tail(600).write_csv(csv_files[1])
+
+    parquet_file = str(tmp_path / "data.parquet")
+    data_pull.csv_batches_to_parquet(csv_files, parquet_file, row_group_size=500)
+
+    expected = pl.concat([pl.read_csv(file) for file in csv_files])
+    assert_frame_equal(pl.read_parquet(parquet_file), expected)
+    assert row_groups(parquet_file) == [500, 500, 300]
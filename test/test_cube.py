@@ -0,0 +1,61 @@
+import pytest
+from test.test_lake import make_trade, write_release
+from datetime import date
+import polars as pl
+
+
+@pytest.fixture(params=["duckdb", "lake"])
+def data_trade(request, tmp_path):
+    return make_trade(tmp_path, request.param)
+
+
+def cube(data_trade) -> dict:
+    return dict(
+        data_trade.trade_cube("inttradedata")
+        .aggregate("month, sum(data)", "month")
+        .order("month")
+        .fetchall()
+    )
+
+
+def test_cube_refresh(data_trade):
+    write_release(data_trade, {1: 100, 2: 200}, 1)
+    assert cube(data_trade) == {1: 100, 2: 200}
+    columns = data_trade.trade_cube("inttradedata").columns
+    assert {"year", "qrt", "fiscal_year", "naics_id", "qty"} <= set(columns)
+
+    # Only the revised and new months are rebuilt
+    built = data_trade.conn.sql("SELECT date, checksum FROM cubemonths;").fetchall()
+    write_release(data_trade, {1: 100, 2: 250, 3: 300}, 2)
+    data_trade.insert_int_org()
+    assert cube(data_trade) == {1: 100, 2: 250, 3: 300}
+    rebuilt = data_trade.conn.sql("SELECT date, checksum FROM cubemonths;").fetchall()
+    assert len(set(rebuilt) - set(built)) == 2
+
+
+def test_process_from_cube(data_trade):
+    write_release(data_trade, {1: 100, 2: 200}, 1)
+    df = data_trade.process_int_org("total", "qrt")
+    assert df.get_column("imports").to_list() == [300]
+    assert df.get_column("imports_qty").to_list() == [20.0]
+
+
+def test_calendar(data_trade):
+    dates = pl.DataFrame(
+        {"date": [date(2020, month, 1) for month in (1, 5, 6, 7, 8, 12)]}
+    )
+    calendar = data_trade.load_calendar(dates).sort("date")
+    assert calendar.get_column("qrt").to_list() == [1, 2, 2, 3, 3, 4]
+    assert calendar.get_column("fiscal_year").to_list() == [2020] * 3 + [2021] * 3
+    assert calendar.get_column("fiscal_qrt").to_list() == [3, 4, 4, 1, 1, 2]
+
+
+def test_fiscal_quarters(data_trade):
+    write_release(data_trade, {5: 100, 7: 200, 8: 300}, 1)
+    df = data_trade.process_int_org("total", "qrt")
+    assert df.select("qrt", "imports").rows() == [(2, 100), (3, 500)]
+    df = data_trade.process_int_org("total", "fiscal_qrt")
+    assert df.select("fiscal_year", "fiscal_qrt", "imports").rows() == [
+        (2020, 4, 100),
+        (2021, 1, 500),
+    ]
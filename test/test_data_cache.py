@@ -0,0 +1,121 @@
+from src.data.data_cache import DiskCache, ResultCache
+from polars.testing import assert_frame_equal
+from test.test_lake import make_trade, write_release
+import polars as pl
+import os
+
+
+def frame(rows: int) -> pl.DataFrame:
+    return pl.DataFrame({"value": range(rows)}, schema={"value": pl.Int64})
+
+
+def test_lru_eviction():
+    cache = ResultCache(max_bytes=frame(100).estimated_size() * 2)
+    cache.put("a", frame(100))
+    cache.put("b", frame(100))
+    assert cache.get("a") is not None
+    cache.put("c", frame(100))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats() == {
+        "hits": 3,
+        "misses": 1,
+        "evictions": 1,
+        "entries": 2,
+        "bytes": frame(100).estimated_size() * 2,
+    }
+
+    cache.put("big", frame(1000))
+    assert cache.get("big") is None
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0 and cache.get("a") is None
+
+
+def test_disabled_cache():
+    cache = ResultCache(max_bytes=0)
+    cache.put("empty", frame(0))
+    assert cache.get("empty") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_process_is_cached(tmp_path, monkeypatch):
+    data_trade = make_trade(tmp_path, "duckdb")
+    write_release(data_trade, {1: 100, 2: 200}, 1)
+    df = data_trade.process_int_org("total", "yearly")
+
+    calls = []
+    monkeypatch.setattr(data_trade, "filter_table", lambda *args: calls.append(args))
+    assert data_trade.process_int_org("total", "yearly", level_filter="01").equals(df)
+    assert calls == [] and data_trade.cache.stats()["hits"] == 1
+    monkeypatch.undo()
+
+    # A new release changes the data version
+    write_release(data_trade, {1: 100, 2: 250}, 2)
+    df = data_trade.process_int_org("total", "yearly")
+    assert df.get_column("imports").to_list() == [350]
+
+
+def test_lake_version_changes(tmp_path):
+    writer = make_trade(tmp_path, "lake")
+    write_release(writer, {1: 100}, 1)
+    writer.insert_int_org()
+    version = writer.data_version("inttradedata")
+
+    write_release(writer, {1: 100, 2: 200}, 2)
+    writer.insert_int_org()
+    assert writer.data_version("inttradedata") != version
+    assert os.path.isdir(tmp_path / "processed" / "source=inttradecube")
+
+
+def test_disk_eviction(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1)
+    cache.put("a", frame(100))
+    assert cache.stats()["entries"] == 0 and cache.stats()["evictions"] == 1
+
+    cache = DiskCache(str(tmp_path))
+    cache.put("a", frame(100))
+    cache.put("b", frame(100))
+    os.utime(cache.path("a"), (1, 1))
+    cache.max_bytes = os.path.getsize(cache.path("b"))
+    cache.evict()
+    assert cache.get("a") is None
+    assert_frame_equal(cache.get("b"), frame(100))
+    assert [file for file in os.listdir(tmp_path) if file.endswith(".tmp")] == []
+
+
+def test_fresh_worker_reads_disk(tmp_path, monkeypatch):
+    data_trade = make_trade(tmp_path, "duckdb")
+    write_release(data_trade, {1: 100, 2: 200}, 1)
+    df = data_trade.process_int_org("hts", "monthly")
+    data_trade.conn.close()
+
+    worker = make_trade(tmp_path, "duckdb")
+    monkeypatch.setattr(worker, "trade_cube", lambda *args: None)
+    assert_frame_equal(worker.process_int_org("hts", "monthly"), df)
+    assert worker.disk_cache.stats()["hits"] == 1
+
+
+def test_lake_revision_is_not_served_stale(tmp_path):
+    writer = make_trade(tmp_path, "lake")
+    write_release(writer, {1: 100, 2: 200}, 1)
+    writer.insert_int_org()
+    writer.process_int_org("total", "monthly")
+    writer.conn.close()
+
+    reader = make_trade(tmp_path, "lake")
+    df = reader.process_int_org("total", "monthly")
+    assert df.get_column("imports").to_list() == [100, 200]
+
+    # A revised month is rewritten inside the existing year directory
+    writer = make_trade(tmp_path, "lake")
+    write_release(writer, {1: 100, 2: 250}, 2)
+    writer.insert_int_org()
+    writer.process_int_org("total", "monthly")
+    writer.conn.close()
+
+    fresh = make_trade(tmp_path, "lake")
+    df = fresh.process_int_org("total", "monthly")
+    assert df.get_column("imports").to_list() == [100, 250]
+    df = reader.process_int_org("total", "monthly")
+    assert df.get_column("imports").to_list() == [100, 250]
@@ -0,0 +1,99 @@
+from src.data.data_comtrade import ComtradeFetcher, ComtradeQuery
+import polars as pl
+import threading
+
+REPORTERS = {2: 8, 4: 4, 6: 2}
+CHILDREN = {"01": ["0101", "0102"], "0101": ["010110", "010120"]}
+
+
+class StubAPI:
+    """
+    Local stand-in of the Comtrade API returning one row per reporter for every
+    partner and code of the request, truncated at max_records.
+    """
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, iso, trade_id, date, code, max_records):
+        with self.lock:
+            self.calls.append(code)
+            if self.failures > 0:
+                self.failures -= 1
+                raise ConnectionError("dropped")
+        rows = [
+            {
+                "period": date,
+                "flowCode": flow,
+                "partnerCode": partner,
+                "cmdCode": cmd,
+                "reporterCode": str(reporter),
+            }
+            for partner in iso.split(",")
+            for flow in trade_id.split(",")
+            for cmd in code.split(",")
+            for reporter in range(REPORTERS[len(cmd)])
+        ]
+        return pl.DataFrame(rows[:max_records])
+
+
+def run(api, queries, **kwargs):
+    fetcher = ComtradeFetcher(
+        fetch=api,
+        children=lambda code: CHILDREN.get(code, []),
+        max_records=5,
+        rate_limit=0,
+        backoff=0,
+        **kwargs,
+    )
+    return list(fetcher.run(queries))
+
+
+def test_split_by_partner():
+    query = ComtradeQuery("201001", "0101", "X", ("1", "2", "3"))
+    [(root, df, status)] = run(StubAPI(), [query])
+    assert root == query
+    assert status == "ok"
+    assert df.group_by("partnerCode").len().get_column("len").to_list() == [4, 4, 4]
+
+
+def test_split_by_hs_level():
+    query = ComtradeQuery("201001", "01", "X", ("1",))
+    [(_, df, status)] = run(StubAPI(), [query])
+    assert status == "ok"
+    assert sorted(df.get_column("cmdCode").unique().to_list()) == ["0101", "0102"]
+    assert len(df) == 8
+
+
+def test_truncated_when_no_split_left():
+    query = ComtradeQuery("201001", "0102", "X", ("1",))
+    api = StubAPI()
+    previous = REPORTERS[4]
+    REPORTERS[4] = 6
+    try:
+        [(_, df, status)] = run(api, [query])
+    finally:
+        REPORTERS[4] = previous
+    assert status == "truncated"
+    assert len(df) == 5
+
+
+def test_retry_and_error():
+    query = ComtradeQuery("201001", "0101", "X", ("1",))
+    [(_, df, status)] = run(StubAPI(failures=2), [query], retries=2)
+    assert status == "ok" and len(df) == 4
+
+    [(_, df, status)] = run(StubAPI(failures=5), [query], retries=2)
+    assert status == "error" and df.is_empty()
+
+
+def test_many_queries_concurrently():
+    queries = [
+        ComtradeQuery(f"2010{month:02d}", "01", "X", ("1", "2"))
+        for month in range(1, 13)
+    ]
+    results = run(StubAPI(), queries, max_workers=8)
+    assert sorted(root for root, _, _ in results) == sorted(queries)
+    assert all(status == "ok" and len(df) == 16 for _, df, status in results)
@@ -0,0 +1,166 @@
+import pytest
+from src.data.data_download import DataDownload, PartialFileError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import threading
+import hashlib
+import base64
+import os
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    payload = b""
+    etag = '"v1"'
+    digest = None
+    drop_after = None
+    requests = []
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == cls.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range") == cls.etag:
+            start = int(range_header.split("=")[1].rstrip("-"))
+        if start >= len(cls.payload):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(cls.payload)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = cls.payload[start:]
+
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header(
+                "Content-Range",
+                f"bytes {start}-{len(cls.payload) - 1}/{len(cls.payload)}",
+            )
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", cls.etag)
+        digest = cls.digest or hashlib.sha256(cls.payload).digest()
+        self.send_header(
+            "Repr-Digest", f"sha-256=:{base64.b64encode(digest).decode()}:"
+        )
+        self.end_headers()
+        if cls.drop_after is not None:
+            self.wfile.write(body[: cls.drop_after])
+            cls.drop_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    FileHandler.payload = os.urandom(256 * 1024)
+    FileHandler.etag = '"v1"'
+    FileHandler.digest = None
+    FileHandler.drop_after = None
+    FileHandler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/file.csv"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_and_skip_unchanged(server, tmp_path):
+    filename = str(tmp_path / "file.csv")
+    d = DataDownload(chunk_size=1024)
+
+    assert d.download(server, filename)
+    assert Path(filename).read_bytes() == FileHandler.payload
+    meta = d.read_meta(filename + ".meta.json")["complete"]
+    assert meta["etag"] == '"v1"'
+    assert meta["sha256"] == hashlib.sha256(FileHandler.payload).hexdigest()
+
+    assert not d.download(server, filename)
+    assert FileHandler.requests[-1]["If-None-Match"] == '"v1"'
+
+
+def test_download_changed_file(server, tmp_path):
+    filename = str(tmp_path / "file.csv")
+    d = DataDownload(chunk_size=1024)
+    d.download(server, filename)
+
+    FileHandler.payload = os.urandom(1024)
+    FileHandler.etag = '"v2"'
+    assert d.download(server, filename)
+    assert Path(filename).read_bytes() == FileHandler.payload
+
+
+def test_resume_dropped_download(server, tmp_path):
+    filename = str(tmp_path / "file.csv")
+    FileHandler.drop_after = 100 * 1024
+    d = DataDownload(chunk_size=1024)
+
+    assert d.download(server, filename)
+    assert Path(filename).read_bytes() == FileHandler.payload
+    assert FileHandler.requests[-1]["Range"] == f"bytes={100 * 1024}-"
+    assert not os.path.exists(filename + ".part")
+
+
+def test_digest_mismatch_keeps_old_file(server, tmp_path):
+    filename = str(tmp_path / "file.csv")
+    d = DataDownload(chunk_size=1024)
+    d.download(server, filename)
+    old = Path(filename).read_bytes()
+
+    FileHandler.etag = '"v2"'
+    FileHandler.payload = os.urandom(1024)
+    FileHandler.digest = hashlib.sha256(b"something else").digest()
+    with pytest.raises(ValueError):
+        d.download(server, filename)
+    assert Path(filename).read_bytes() == old
+    assert not os.path.exists(filename + ".part")
+
+
+def write_part(d: DataDownload, url: str, filename: str, body: bytes) -> None:
+    Path(filename + ".part").write_bytes(body)
+    digest = hashlib.sha256(FileHandler.payload).hexdigest()
+    partial = {"url": url, "etag": '"v1"', "size": len(body), "sha256": digest}
+    d.write_meta(filename + ".meta.json", {"partial": partial})
+
+
+def test_complete_part_is_promoted(server, tmp_path):
+    filename = str(tmp_path / "file.csv")
+    d = DataDownload(chunk_size=1024)
+    write_part(d, server, filename, FileHandler.payload)
+
+    assert d.download(server, filename)
+    assert Path(filename).read_bytes() == FileHandler.payload
+    assert len(FileHandler.requests) == 1
+    assert not os.path.exists(filename + ".part")
+    assert not d.download(server, filename)
+
+
+def test_corrupt_complete_part_restarts(server, tmp_path):
+    filename = str(tmp_path / "file.csv")
+    d = DataDownload(chunk_size=1024)
+    write_part(d, server, filename, os.urandom(len(FileHandler.payload)))
+
+    assert d.download(server, filename)
+    assert Path(filename).read_bytes() == FileHandler.payload
+    assert "Range" not in FileHandler.requests[-1]
+
+
+def test_corrupt_complete_part_counts_as_retry(server, tmp_path):
+    filename = str(tmp_path / "file.csv")
+    d = DataDownload(chunk_size=1024, retries=0)
+    write_part(d, server, filename, os.urandom(len(FileHandler.payload)))
+
+    with pytest.raises(PartialFileError):
+        d.download(server, filename)
+    assert not os.path.exists(filename + ".part")
+    assert d.download(server, filename)
+    assert Path(filename).read_bytes() == FileHandler.payload
@@ -0,0 +1,120 @@
+import pytest
+from src.data.data_pull import DataPull
+import polars as pl
+import json
+import os
+
+
+def org_data(months: dict, country: str = "Spain") -> pl.DataFrame:
+    return pl.DataFrame(
+        [
+            {
+                "IMPORT_EXPORT": "i",
+                "COUNTRY": country,
+                "YEAR": 2020,
+                "MONTH": month,
+                "VALUE": value,
+                "UNIT_1": "KG",
+                "QTY_1": 10,
+                "UNIT_2": None,
+                "QTY_2": 0,
+                "HTS": "0101210000",
+                "HTS_DESC": "Horses",
+            }
+            for month, value in months.items()
+        ],
+        schema_overrides={"UNIT_2": pl.String},
+    )
+
+
+@pytest.fixture
+def data_pull(tmp_path):
+    os.makedirs(tmp_path / "raw")
+    os.makedirs(tmp_path / "external")
+    with open(tmp_path / "external" / "code_agr.json", "w") as file:
+        json.dump({"0": 101}, file)
+    return DataPull(
+        f"{tmp_path}/", str(tmp_path / "data.ddb"), str(tmp_path / "test.log")
+    )
+
+
+def write_release(
+    data_pull: DataPull, months: dict, mtime: int, country: str = "Spain"
+) -> None:
+    filename = f"{data_pull.saving_dir}raw/org_data.parquet"
+    org_data(months, country).write_parquet(filename)
+    os.utime(filename, (mtime, mtime))
+
+
+def loaded(data_pull: DataPull) -> dict:
+    return dict(
+        data_pull.conn.sql(
+            "SELECT month(date), data FROM 'inttradedata' ORDER BY 1;"
+        ).fetchall()
+    )
+
+
+def test_incremental_ingest(data_pull):
+    write_release(data_pull, {1: 100, 2: 200}, 1)
+    df = data_pull.insert_int_org().pl()
+    assert len(df) == 2
+    assert data_pull.conn.sql("SELECT agri_prod FROM htstable;").fetchall() == [(True,)]
+
+    # An unchanged release is skipped
+    data_pull.conn.sql("UPDATE 'inttradedata' SET data = -1 WHERE month(date) = 1;")
+    data_pull.insert_int_org()
+    assert loaded(data_pull) == {1: -1, 2: 200}
+
+    # A new release rewrites revised months, appends new ones and keeps the rest
+    write_release(data_pull, {1: 100, 2: 250, 3: 300}, 2)
+    data_pull.insert_int_org()
+    assert loaded(data_pull) == {1: -1, 2: 250, 3: 300}
+    watermark = data_pull.conn.sql(
+        "SELECT max_date FROM 'ingestwatermark' WHERE source = 'inttradedata';"
+    ).fetchone()
+    assert str(watermark[0]) == "2020-03-01"
+
+
+def test_table_metadata(data_pull):
+    assert not data_pull.table_exists("inttradedata")
+    assert data_pull.table_rows("inttradedata") == 0
+    write_release(data_pull, {1: 100, 2: 200}, 1)
+    data_pull.insert_int_org()
+    assert data_pull.table_exists("inttradedata")
+    assert data_pull.table_rows("inttradedata") == 2
+
+
+def test_dimensions_grow(data_pull):
+    write_release(data_pull, {1: 100}, 1)
+    data_pull.insert_int_org()
+    write_release(data_pull, {1: 100, 2: 200}, 2, country="Chile")
+    df = data_pull.insert_int_org().pl()
+
+    assert df.get_column("country_id").to_list() == [2, 2]
+    countries = data_pull.conn.sql(
+        "SELECT id, country_name FROM countrytable ORDER BY id;"
+    ).fetchall()
+    assert countries == [(1, "Spain"), (2, "Chile")]
+    units = data_pull.conn.sql("SELECT unit_code FROM unittable;").fetchall()
+    assert units == [("kg",)]
+
+
+def test_legacy_table_is_reloaded(data_pull):
+    data_pull.conn.sql("CREATE TABLE inttradedata (hts_code TEXT, data BIGINT);")
+    data_pull.conn.sql("INSERT INTO inttradedata VALUES ('0101210000', 1);")
+    write_release(data_pull, {1: 100}, 1)
+    df = data_pull.insert_int_org().pl()
+    assert "hts_id" in df.columns
+    assert df.get_column("data").to_list() == [100]
+
+
+def test_unit_conversion_override(data_pull):
+    write_release(data_pull, {1: 100}, 1)
+    data_pull.insert_int_org()
+    assert data_pull.conn.sql("SELECT qty FROM inttradedata;").fetchall() == [(10.0,)]
+
+    # A new factor table reloads the data with the same release
+    with open(f"{data_pull.saving_dir}external/unit_conversion.csv", "w") as file:
+        file.write("unit_code,factor,target_unit\nKG,2.5,kg\n")
+    data_pull.insert_int_org()
+    assert data_pull.conn.sql("SELECT qty FROM inttradedata;").fetchall() == [(25.0,)]
@@ -0,0 +1,86 @@
+import pytest
+from src.data.data_process import DataTrade
+from polars.testing import assert_frame_equal
+from test.test_ingest import org_data
+import json
+import os
+
+
+def make_trade(path, backend: str) -> DataTrade:
+    os.makedirs(path / "raw", exist_ok=True)
+    os.makedirs(path / "external", exist_ok=True)
+    with open(path / "external" / "code_agr.json", "w") as file:
+        json.dump({"0": 101}, file)
+    return DataTrade(
+        f"{path}/", str(path / "data.ddb"), str(path / "test.log"), backend=backend
+    )
+
+
+def write_release(data_trade: DataTrade, months: dict, mtime: int) -> None:
+    filename = data_trade.org_data
+    org_data(months).write_parquet(filename)
+    os.utime(filename, (mtime, mtime))
+
+
+def test_invalid_backend(tmp_path):
+    with pytest.raises(ValueError):
+        make_trade(tmp_path, "sqlite")
+
+
+def test_lake_matches_duckdb(tmp_path):
+    lake = make_trade(tmp_path / "lake", "lake")
+    database = make_trade(tmp_path / "duckdb", "duckdb")
+    for data_trade in (lake, database):
+        write_release(data_trade, {1: 100, 2: 200, 3: 300}, 1)
+        data_trade.insert_int_org()
+
+    source = tmp_path / "lake" / "processed" / "source=inttradedata"
+    assert sorted(os.listdir(source / "year=2020")) == [
+        "month=1",
+        "month=2",
+        "month=3",
+    ]
+    assert os.listdir(source / "year=2020" / "month=1") == ["trade_id=1"]
+
+    for level, datetime in [("total", ""), ("hts", "2020-02-01"), ("country", "")]:
+        assert_frame_equal(
+            lake.process_int_org(level, "monthly", datetime),
+            database.process_int_org(level, "monthly", datetime),
+        )
+
+
+def test_lake_reader_skips_database(tmp_path):
+    writer = make_trade(tmp_path, "lake")
+    write_release(writer, {1: 100, 2: 200}, 1)
+    writer.insert_int_org()
+    writer.conn.close()
+
+    # A revised month replaces its partition
+    write_release(writer, {1: 100, 2: 250}, 2)
+    writer = make_trade(tmp_path, "lake")
+    writer.insert_int_org()
+    writer.conn.close()
+
+    reader = make_trade(tmp_path, "lake")
+    df = reader.process_int_org("total", "monthly", "2020-02-01")
+    assert df.get_column("imports").to_list() == [250]
+    assert reader._conn is None
+
+
+def test_revised_month_is_swapped_in_place(tmp_path):
+    data_trade = make_trade(tmp_path, "lake")
+    write_release(data_trade, {1: 100, 2: 200}, 1)
+    data_trade.insert_int_org()
+    month = tmp_path / "processed" / "source=inttradedata" / "year=2020" / "month=2"
+    inode = os.stat(month).st_ino
+
+    write_release(data_trade, {1: 100, 2: 250}, 2)
+    data_trade.insert_int_org()
+    # The month directory is kept and only its files are replaced
+    assert os.stat(month).st_ino == inode
+    assert os.listdir(month / "trade_id=1") == ["data_0.parquet"]
+    assert not any(
+        name.startswith(".staging") for name in os.listdir(tmp_path / "processed")
+    )
+    df = data_trade.process_int_org("total", "monthly", "2020-02-01")
+    assert df.get_column("imports").to_list() == [250]
@@ -0,0 +1,66 @@
+import pytest
+from src.data.data_process import DataTrade
+from src.data import data_pull
+from test.test_lake import make_trade, write_release
+from polars.testing import assert_frame_equal
+import polars as pl
+import os
+
+
+@pytest.fixture(params=["duckdb", "lake"])
+def data_trade(request, tmp_path):
+    make_trade(tmp_path, request.param)
+    return DataTrade(
+        f"{tmp_path}/",
+        str(tmp_path / "data.ddb"),
+        str(tmp_path / "test.log"),
+        backend=request.param,
+        memory_limit=256 * 1024**2,
+    )
+
+
+def setting(conn, name: str) -> str:
+    return conn.sql(f"SELECT current_setting('{name}');").fetchone()[0]
+
+
+def test_memory_budget(data_trade, tmp_path):
+    spill = str(tmp_path / "processed" / "spill")
+    for conn in (data_trade.conn, data_trade.reader()):
+        assert setting(conn, "memory_limit") == "256.0 MiB"
+        assert setting(conn, "temp_directory") == spill
+    assert os.path.isdir(spill)
+
+
+def test_out_of_core_matches(data_trade, tmp_path):
+    write_release(data_trade, {1: 100, 5: 200, 8: 300}, 1)
+    expected = make_trade(tmp_path / "default", "duckdb")
+    write_release(expected, {1: 100, 5: 200, 8: 300}, 1)
+
+    for level, time_frame in [("total", "fiscal_qrt"), ("hts", "monthly")]:
+        assert_frame_equal(
+            data_trade.process_int_org(level, time_frame),
+            expected.process_int_org(level, time_frame),
+        )
+    assert_frame_equal(data_trade.process_price(), expected.process_price())
+    with pytest.raises(ValueError):
+        data_trade.process_int_org("hts", "yearly", level_filter="99")
+
+
+def test_ingest_batches(data_trade, monkeypatch):
+    monkeypatch.setattr(data_pull, "INGEST_ROW_BYTES", data_trade.memory_limit // 3)
+    changed = pl.DataFrame({"month": [1, 2, 3, 4, 5], "rows": [2, 1, 5, 1, 1]})
+    batches = data_trade.ingest_batches(changed)
+    months = [batch.get_column("month").to_list() for batch in batches]
+    assert months == [[1, 2], [3], [4, 5]]
+
+
+def test_ingest_in_month_batches(data_trade, tmp_path, monkeypatch):
+    # A budget of one row loads every month in its own batch
+    monkeypatch.setattr(data_pull, "INGEST_ROW_BYTES", data_trade.memory_limit)
+    write_release(data_trade, {1: 100, 5: 200, 8: 300}, 1)
+    expected = make_trade(tmp_path / "default", "duckdb")
+    write_release(expected, {1: 100, 5: 200, 8: 300}, 1)
+    assert_frame_equal(
+        data_trade.process_int_org("hts", "monthly"),
+        expected.process_int_org("hts", "monthly"),
+    )
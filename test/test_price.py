@@ -0,0 +1,131 @@
+import pytest
+from test.test_lake import make_trade
+from polars.testing import assert_frame_equal
+from src.data.data_process import DataTrade
+import polars as pl
+import os
+
+
+@pytest.fixture(params=["duckdb", "lake"])
+def data_trade(request, tmp_path):
+    return make_trade(tmp_path, request.param)
+
+
+RELEASE = {
+    ("0101210000", 2020, 1): 10,
+    ("0101290000", 2020, 1): 10,
+    ("0101210000", 2020, 2): 20,
+    ("0101210000", 2021, 1): 30,
+    ("0201100000", 2020, 2): 100,
+    ("0201100000", 2021, 2): 200,
+}
+
+
+def write_prices(data_trade: DataTrade, imports: dict, mtime: int) -> None:
+    pl.DataFrame(
+        [
+            {
+                "IMPORT_EXPORT": "i",
+                "COUNTRY": "Spain",
+                "YEAR": year,
+                "MONTH": month,
+                "VALUE": value,
+                "UNIT_1": "KG",
+                "QTY_1": 1,
+                "UNIT_2": None,
+                "QTY_2": 0,
+                "HTS": hts,
+                "HTS_DESC": "Product",
+            }
+            for (hts, year, month), value in imports.items()
+        ],
+        schema_overrides={"UNIT_2": pl.String},
+    ).write_parquet(data_trade.org_data)
+    os.utime(data_trade.org_data, (mtime, mtime))
+
+
+def test_price_windows_are_per_series(data_trade):
+    write_prices(data_trade, RELEASE, 1)
+    price = data_trade.process_price()
+
+    assert price.select("hs4", "year", "month").rows() == [
+        ("0101", 2020, 1),
+        ("0101", 2020, 2),
+        ("0201", 2020, 2),
+        ("0101", 2021, 1),
+        ("0201", 2021, 2),
+    ]
+    assert price.get_column("price_imports").to_list() == [
+        10.0,
+        20.0,
+        100.0,
+        30.0,
+        200.0,
+    ]
+
+    # The 3 month window spans calendar months, so 2021-01 does not average 2020-02
+    assert price.get_column("moving_price_imports").to_list() == [
+        10.0,
+        15.0,
+        100.0,
+        30.0,
+        200.0,
+    ]
+    assert price.get_column("moving_price_imports_std").null_count() == 4
+
+    # Lags read the same product one month and one year before
+    assert price.get_column("pct_change_imports").to_list() == [
+        None,
+        0.5,
+        None,
+        None,
+        None,
+    ]
+    assert price.get_column("prev_year_imports").to_list() == [
+        None,
+        None,
+        None,
+        10.0,
+        100.0,
+    ]
+    assert price.get_column("pct_change_imports_year_over_year").to_list() == [
+        None,
+        None,
+        None,
+        2.0,
+        1.0,
+    ]
+    assert price.get_column("rank_imports").to_list() == [1, 1, 2, 1, 1]
+    assert price.get_column("rank_imports_change_year_over_year").to_list() == [
+        None,
+        None,
+        None,
+        0,
+        -1,
+    ]
+
+
+def test_price_refresh_is_incremental(data_trade, tmp_path):
+    write_prices(data_trade, RELEASE, 1)
+    data_trade.process_price()
+    data_trade.conn.sql(
+        "UPDATE 'pricetable' SET rank_imports = -1 WHERE date = '2020-01-01';"
+    )
+
+    # A revised and a new month only recompute the months that read them
+    release = RELEASE | {("0201100000", 2020, 2): 150, ("0101210000", 2021, 2): 60}
+    write_prices(data_trade, release, 2)
+    data_trade.insert_int_org()
+    price = data_trade.process_price()
+    assert price.filter(pl.col("date") == pl.datetime(2020, 1, 1)).get_column(
+        "rank_imports"
+    ).to_list() == [-1]
+
+    fresh = make_trade(tmp_path / "fresh", "duckdb")
+    write_prices(fresh, release, 2)
+    expected = fresh.process_price()
+    assert_frame_equal(
+        price.filter(pl.col("date") > pl.datetime(2020, 1, 1)),
+        expected.filter(pl.col("date") > pl.datetime(2020, 1, 1)),
+    )
+    assert len(price) == len(expected) == 6
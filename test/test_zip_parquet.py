@@ -0,0 +1,129 @@
+from src.data.data_pull import DataPull, ORG_SCHEMA
+from polars.testing import assert_frame_equal
+import pyarrow.parquet as pq
+import polars as pl
+import zipfile
+import io
+
+SAMPLE = "test/test_inserts/org_data_sample.parquet"
+
+
+def nested_zip(path, flows: dict) -> None:
+    """
+    Writes a zip archive holding one nested zip archive with a CSV per flow.
+    """
+    with zipfile.ZipFile(path, "w") as outer:
+        for member, df in flows.items():
+            nested = io.BytesIO()
+            with zipfile.ZipFile(nested, "w", zipfile.ZIP_DEFLATED) as inner:
+                inner.writestr(member.replace(".zip", ".csv"), df.write_csv())
+            outer.writestr(member, nested.getvalue())
+
+
+def test_zip_to_parquet(tmp_path):
+    data_pull = DataPull(
+        f"{tmp_path}/", str(tmp_path / "data.ddb"), str(tmp_path / "test.log")
+    )
+    sample = pl.read_parquet(SAMPLE)
+    imports = sample.filter(pl.col("import_export") == "i")
+    exports = sample.filter(pl.col("import_export") == "e")
+    flows = {"IMPORT_HTS10_ALL.zip": imports, "EXPORT_HTS10_ALL.zip": exports}
+    nested_zip(tmp_path / "tmp.zip", flows)
+
+    parquet_file = str(tmp_path / "org_data.parquet")
+    data_pull.zip_to_parquet(
+        str(tmp_path / "tmp.zip"),
+        list(flows),
+        parquet_file,
+        ORG_SCHEMA,
+        row_group_size=1000,
+    )
+
+    df = pl.read_parquet(parquet_file)
+    assert df.schema == pl.Schema(ORG_SCHEMA)
+    assert_frame_equal(df, sample, check_row_order=False)
+    metadata = pq.ParquetFile(parquet_file).metadata
+    sizes = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+    assert sum(sizes) == len(sample) and max(sizes) <= 1000
+    assert not (tmp_path / "org_data.parquet.tmp").exists()
+
+
+class StubDownloader:
+    """
+    Downloader writing the archive and reporting whether it changed.
+    """
+
+    def __init__(self, flows: dict, changed: bool):
+        self.flows = flows
+        self.changed = changed
+
+    def download(self, url, filename, verify, force):
+        if self.changed:
+            nested_zip(filename, self.flows)
+        return self.changed
+
+
+def test_pull_int_org_rewrites_changed_release(tmp_path):
+    data_pull = DataPull(
+        f"{tmp_path}/", str(tmp_path / "data.ddb"), str(tmp_path / "test.log")
+    )
+    sample = pl.read_parquet(SAMPLE)
+    flows = {
+        "IMPORT_HTS10_ALL.zip": sample.filter(pl.col("import_export") == "i"),
+        "EXPORT_HTS10_ALL.zip": sample.filter(pl.col("import_export") == "e"),
+    }
+    parquet_file = tmp_path / "raw" / "org_data.parquet"
+    parquet_file.parent.mkdir(exist_ok=True)
+    stale = sample.head(10)
+    stale.write_parquet(parquet_file)
+
+    data_pull.downloader = StubDownloader(flows, changed=False)
+    data_pull.pull_int_org()
+    assert_frame_equal(pl.read_parquet(parquet_file), stale)
+
+    data_pull.downloader = StubDownloader(flows, changed=True)
+    data_pull.pull_int_org()
+    assert_frame_equal(pl.read_parquet(parquet_file), sample, check_row_order=False)
+
+
+def test_pull_int_org_extracted_row_groups(tmp_path):
+    data_pull = DataPull(
+        f"{tmp_path}/", str(tmp_path / "data.ddb"), str(tmp_path / "test.log")
+    )
+    sample = pl.read_parquet(SAMPLE)
+    flows = {
+        "IMPORT_HTS10_ALL.zip": sample.filter(pl.col("import_export") == "i"),
+        "EXPORT_HTS10_ALL.zip": sample.filter(pl.col("import_export") == "e"),
+    }
+    data_pull.downloader = StubDownloader(flows, changed=True)
+    data_pull.pull_int_org(streaming=False, row_group_size=1000)
+
+    parquet_file = str(tmp_path / "raw" / "org_data.parquet")
+    expected = pl.concat(
+        [
+            pl.read_csv(tmp_path / "raw" / member.replace(".zip", ".csv"))
+            for member in flows
+        ]
+    )
+    assert_frame_equal(pl.read_parquet(parquet_file), expected)
+    metadata = pq.ParquetFile(parquet_file).metadata
+    sizes = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+    assert sizes == [1000] * (len(sample) // 1000)
+
+
+def test_nested_csv_is_read_without_seeking(tmp_path, monkeypatch):
+    data_pull = DataPull(
+        f"{tmp_path}/", str(tmp_path / "data.ddb"), str(tmp_path / "test.log")
+    )
+    sample = pl.read_parquet(SAMPLE)
+    nested_zip(tmp_path / "tmp.zip", {"IMPORT_HTS10_ALL.zip": sample})
+
+    # Seeking a compressed member inflates it again from the start
+    def seek(self, *args):
+        raise AssertionError("zip member seeked")
+
+    monkeypatch.setattr(zipfile.ZipExtFile, "seek", seek)
+    frames = data_pull._read_nested_csv(
+        str(tmp_path / "tmp.zip"), "IMPORT_HTS10_ALL.zip", ORG_SCHEMA
+    )
+    assert_frame_equal(pl.concat(list(frames)), sample)